@@ -0,0 +1,412 @@
+"""End to end benchmarks of the pull tester software, run off-device with simulated sensors.
+
+Measures:
+    acquisition     Highest sample rate the whole pipeline (data collector -> main -> GUI and run file) sustains
+                    without missed deadlines or ring buffer overruns
+    pipeline        Sample to main, sample to screen and sample to disk latency, frame times and memory growth
+                    of a longer run at a fixed rate
+    render          GUI frame build time in window and overview plot modes
+    export          Binary and csv write throughput and .ptrun -> csv export throughput
+
+Latencies use a clock sensor whose reading is the time it was read, so the age of a sample anywhere in the
+pipeline is the current time minus its value (time.perf_counter is system wide on Linux).
+
+Usage, from the PullTester directory:
+    python -m benchmarks.run [--quick] [--only acquisition,render] [--output results.json]
+    python -m benchmarks.run --compare old.json new.json
+
+Results are written as json to benchmarks/results/<date>_<commit>.json by default.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import contextlib
+import numpy as np
+
+from datetime import datetime
+from multiprocessing import Process, Queue, Pipe
+
+from src.main import queueReader, ringBufferReader, createRingBuffer, waitForWork
+from src.gui import GUI
+from src.dataCollector import dataCollector
+from src.ipc import eventMailbox, dataReadySignal
+from src.runWriter import runWriter, csvRunFile
+from src.runFormat import binaryRunFile, runHeader, exportCSV
+
+resultsDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+class clockSensor:
+    """Sensor whose reading is the time.perf_counter() at which it was read"""
+    sensorNum = 0
+
+    def __init__(self):
+        self.maxReadFrequency = 1000
+        self.name = "clock"
+        self.calibration = None
+        self.filters = []
+
+    def initInProcess(self):
+        pass
+
+    def reset(self):
+        self.__class__.sensorNum = 0
+
+    def read(self):
+        return time.perf_counter()
+
+    def convert(self, value):
+        return value
+
+def timedRunFile(writeLatencies):
+    """Binary run file type that records, for every row, the time from its sample to the flush that handed it
+    to the operating system (column 1 has to come from a clockSensor)"""
+
+    class timedBinaryRunFile(binaryRunFile):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.pending = []
+
+        def write(self, block):
+            super().write(block)
+            self.pending += [block[:, 1].copy()]
+
+        def flush(self):
+            super().flush()
+            if self.pending:
+                writeLatencies.append(time.perf_counter() - np.concatenate(self.pending))
+                self.pending = []
+
+    return timedBinaryRunFile
+
+@contextlib.contextmanager
+def discardOutput():
+    """Send everything printed to stdout, including by subprocesses like the GUI's clear, to os.devnull"""
+
+    sys.stdout.flush()
+    saved = os.dup(1)
+    with open(os.devnull, 'w') as devnull:
+        os.dup2(devnull.fileno(), 1)
+        try:
+            with contextlib.redirect_stdout(devnull):
+                yield
+        finally:
+            sys.stdout.flush()
+            os.dup2(saved, 1)
+            os.close(saved)
+
+def residentMemory(pid="self"):
+    """Resident set size of a process in MB, None where /proc is not available"""
+
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+
+def latencyStats(latencies):
+    """Summary of a list of arrays of latencies in seconds, reported in milliseconds"""
+
+    if len(latencies) == 0:
+        return None
+
+    values = np.concatenate(latencies) * 1000
+    return {'samples': int(len(values)),
+            'p50': float(np.percentile(values, 50)),
+            'p99': float(np.percentile(values, 99)),
+            'max': float(values.max())}
+
+def runPipeline(rate, seconds, transport='sharedMemory', extraSensors=1, directory=None):
+    """Run the data collector, a consumer loop matching src.main, the GUI frame builder and a run writer
+    together for a number of seconds.
+    Input:
+        rate:
+            Sample rate in Hz
+        extraSensors:
+            Number of clock sensors added after the first one, to load the pipeline with more columns"""
+
+    sensors = [clockSensor() for i in range(1 + extraSensors)]
+    settingsDict = {'sampleRate': rate, 'transport': transport, 'bufferSeconds': 10, 'spinWait': 0.0005,
+                    'missedDeadlines': 'skip', 'convert': False, 'guiFPS': 20, 'consumeInterval': 0.02}
+    columnNames = ["time"] + [f"clock{i}" for i in range(len(sensors))]
+
+    sensorQueue = Queue()
+    ringBuffer = createRingBuffer(settingsDict, sensors)
+    dataReady = dataReadySignal()
+    parentPipe, childPipe = Pipe()
+    collector = dataCollector(sensors, sensorQueue, childPipe, settingsDict, ringBuffer, dataReady)
+    collectorProcess = Process(target=collector.mainLoop)
+    collectorProcess.start()
+
+    # The GUI is driven in this process so frame times are measured directly, its output is discarded
+    with discardOutput():
+        gui = GUI(None, None, sensors, settingsDict)
+        gui.startTime = time.time()
+        gui.runNumber = 1
+
+        writeLatencies = []
+        directory = directory or tempfile.mkdtemp()
+        writer = runWriter(os.path.join(directory, "bench.ptrun"), columnNames, flushInterval=0.1, fsyncInterval=0,
+                           fileType=timedRunFile(writeLatencies), header=runHeader(columnNames, settingsDict, sensors))
+        writer.start()
+
+        events = eventMailbox()
+        def readSamples():
+            if ringBuffer != None:
+                return ringBufferReader(ringBuffer)
+            return queueReader(sensorQueue)
+
+        def dataAvailable():
+            if ringBuffer != None:
+                return ringBuffer.available() > 0
+            return not sensorQueue.empty()
+
+        receiveLatencies, screenLatencies, frameTimes, memory = [], [], [], []
+        unshown = []
+        rowCount = 0
+        lastConsume = 0
+        nextFrame = nextMemory = time.perf_counter()
+
+        parentPipe.send("read")
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            waitForWork(events, dataReady, dataAvailable, lastConsume, settingsDict['consumeInterval'])
+            rows = readSamples()
+            lastConsume = time.monotonic()
+
+            if rows is not None and len(rows) > 0:
+                receiveLatencies += [time.perf_counter() - rows[:, 1]]
+                gui.addRows(1, rowCount, rows)
+                writer.append(rows)
+                unshown += [rows[:, 1]]
+                rowCount += len(rows)
+
+            now = time.perf_counter()
+            if now >= nextFrame:
+                gui.drawGUI()
+                frameTimes += [gui.frameTime]
+                if unshown:
+                    screenLatencies += [time.perf_counter() - np.concatenate(unshown)]
+                    unshown = []
+                nextFrame = max(nextFrame + gui.frameInterval, now)
+
+            if now >= nextMemory:
+                memory += [(now, residentMemory(), residentMemory(collectorProcess.pid))]
+                nextMemory += 1
+
+        parentPipe.send("stop")
+        timing = parentPipe.recv()[1]['sensors'][0] if parentPipe.poll(2) else {}
+        while readSamples() is not None:
+            pass
+        writer.stop()
+
+    overruns = ringBuffer.overruns if ringBuffer != None else 0
+    parentPipe.send("off")
+    collectorProcess.join()
+    if ringBuffer != None:
+        ringBuffer.close()
+        ringBuffer.unlink()
+    shutil.rmtree(directory, ignore_errors=True)
+
+    growth = None
+    if len(memory) > 1 and memory[0][1] != None:
+        minutes = (memory[-1][0] - memory[0][0]) / 60
+        growth = {'mainStartMB': memory[0][1], 'mainEndMB': memory[-1][1],
+                  'mainGrowthMBPerMinute': (memory[-1][1] - memory[0][1]) / minutes,
+                  'collectorStartMB': memory[0][2], 'collectorEndMB': memory[-1][2],
+                  'collectorGrowthMBPerMinute': (memory[-1][2] - memory[0][2]) / minutes}
+
+    return {'rate': rate,
+            'seconds': seconds,
+            'transport': transport,
+            'columns': len(columnNames),
+            'rows': rowCount,
+            'rowsWritten': writer.rowsWritten,
+            'achievedRate': timing.get('achievedRate'),
+            'missedDeadlines': timing.get('missedDeadlines'),
+            'intervalP99ms': None if timing.get('intervalP99') == None else timing['intervalP99'] * 1000,
+            'overruns': overruns,
+            'sampleToMainMs': latencyStats(receiveLatencies),
+            'sampleToScreenMs': latencyStats(screenLatencies),
+            'sampleToDiskMs': latencyStats(writeLatencies),
+            'frameMs': latencyStats([np.array(frameTimes)]),
+            'memory': growth}
+
+def sustained(result, minimumRate=0.98):
+    """True if a pipeline run kept up with its sample rate: no rows were lost between processes or on the way
+    to disk, and the achieved rate is at least minimumRate of the target. The achieved rate is used instead of
+    requiring zero missed deadlines, since a single stall of a busy (or virtual) machine misses a few deadlines
+    at any rate."""
+
+    return (result['achievedRate'] != None and result['achievedRate'] >= minimumRate * result['rate']
+            and result['overruns'] == 0 and result['rowsWritten'] == result['rows'])
+
+def benchmarkAcquisition(quick):
+    """Double the sample rate, starting at the load cell's 80 Hz, until the pipeline stops keeping up"""
+
+    results = {}
+    for transport in ('sharedMemory', 'queue'):
+        steps = []
+        rate = 80
+        while rate <= 81920:
+            result = runPipeline(rate, 2 if quick else 5, transport)
+            steps += [{'rate': rate, 'sustained': sustained(result), 'achievedRate': result['achievedRate'],
+                       'missedDeadlines': result['missedDeadlines'], 'overruns': result['overruns']}]
+            if not sustained(result):
+                break
+            rate *= 2
+
+        passing = [step['rate'] for step in steps if step['sustained']]
+        results[transport] = {'maxSustainedRate': max(passing) if passing else None, 'steps': steps}
+
+    return results
+
+def benchmarkPipeline(quick):
+    """Latency and memory growth of a longer run at the load cell's rate and at a high rate"""
+    return {'80Hz': runPipeline(80, 10 if quick else 60), '2000Hz': runPipeline(2000, 5 if quick else 30)}
+
+def benchmarkRender(quick):
+    """Frame build time with a full plot, in window mode and in overview mode after a long run"""
+
+    frames = 50 if quick else 300
+    sensors = [clockSensor(), clockSensor()]
+    results = {}
+    for plotMode in ('window', 'overview'):
+        with discardOutput():
+            gui = GUI(None, None, sensors, {'plotMode': plotMode})
+            gui.startTime = time.time()
+            gui.runNumber = 1
+
+            t = np.arange(1000000) / 80
+            rows = np.column_stack((t, np.sin(t), np.cos(t)))
+            gui.addRows(1, 0, rows)
+
+            frameTimes = []
+            for frame in range(frames):
+                gui.addRows(1, len(rows) + frame * 4, rows[:4])
+                gui.drawGUI()
+                frameTimes += [gui.frameTime]
+
+        results[plotMode] = latencyStats([np.array(frameTimes)])
+
+    return results
+
+def benchmarkExport(quick):
+    """Write and export throughput for a run with three columns"""
+
+    rowCount = 200000 if quick else 2000000
+    blockRows = 4096
+    t = np.arange(rowCount) / 80
+    rows = np.column_stack((t, np.sin(t) * 1e6, np.cos(t) * 1e6))
+    columnNames = ["time", "a", "b"]
+    header = {'columns': columnNames, 'alignment': 'none', 'calibration': [None, None], 'convert': False, 'dtype': "<f8"}
+
+    directory = tempfile.mkdtemp()
+    results = {'rows': rowCount}
+    try:
+        for name, fileType in (('binaryWrite', binaryRunFile), ('csvWrite', csvRunFile)):
+            path = os.path.join(directory, "run" + fileType.extension)
+            start = time.perf_counter()
+            runFile = fileType(path, columnNames, header)
+            for blockStart in range(0, rowCount, blockRows):
+                runFile.write(rows[blockStart:blockStart + blockRows])
+            runFile.close()
+            seconds = time.perf_counter() - start
+            results[name] = {'rowsPerSecond': rowCount / seconds, 'MBPerSecond': os.path.getsize(path) / 1e6 / seconds}
+
+        start = time.perf_counter()
+        csvPath = exportCSV(os.path.join(directory, "run.ptrun"), os.path.join(directory, "export.csv"))
+        seconds = time.perf_counter() - start
+        results['exportCSV'] = {'rowsPerSecond': rowCount / seconds, 'MBPerSecond': os.path.getsize(csvPath) / 1e6 / seconds}
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return results
+
+benchmarks = {'acquisition': benchmarkAcquisition, 'pipeline': benchmarkPipeline,
+              'render': benchmarkRender, 'export': benchmarkExport}
+
+def environment():
+    """Where the results came from, so runs on different commits and machines can be told apart"""
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL).stdout.decode('utf-8').strip() or None
+    except OSError:
+        commit = None
+
+    return {'commit': commit,
+            'date': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count()}
+
+def flatten(results, prefix=""):
+    """Numeric leaves of a nested result dictionary, keyed by their path"""
+
+    values = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            values.update(flatten(value, path + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[path] = value
+    return values
+
+def compare(oldPath, newPath):
+    """Print the relative change of every number that is in both result files"""
+
+    with open(oldPath) as f:
+        old = flatten(json.load(f)['results'])
+    with open(newPath) as f:
+        new = flatten(json.load(f)['results'])
+
+    for key in sorted(old.keys() & new.keys()):
+        change = "" if old[key] == 0 else f"{(new[key] - old[key]) / abs(old[key]) * 100:+.1f}%"
+        print(f"{key:70s} {old[key]:14.4g} {new[key]:14.4g} {change:>9s}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the pull tester software with simulated sensors")
+    parser.add_argument('--quick', action='store_true', help="Shorter runs, for a quick check")
+    parser.add_argument('--only', default=None, help=f"Comma seperated benchmarks to run, from {list(benchmarks)}")
+    parser.add_argument('--output', default=None, help="Path of the json results file")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="Compare two results files and exit")
+    args = parser.parse_args(argv)
+
+    if args.compare != None:
+        compare(*args.compare)
+        return
+
+    selected = list(benchmarks) if args.only == None else args.only.split(",")
+    report = {'environment': environment(), 'quick': args.quick, 'results': {}}
+    for name in selected:
+        if name not in benchmarks:
+            print(f"ERROR: Unknown benchmark '{name}', options are {list(benchmarks)}")
+            continue
+
+        print(f"Running {name}...", file=sys.stderr)
+        start = time.perf_counter()
+        report['results'][name] = benchmarks[name](args.quick)
+        report['results'][name]['benchmarkSeconds'] = time.perf_counter() - start
+
+    output = args.output
+    if output == None:
+        os.makedirs(resultsDir, exist_ok=True)
+        output = os.path.join(resultsDir, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{report['environment']['commit']}.json")
+
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=4)
+
+    print(json.dumps(report['results'], indent=4))
+    print(f"Wrote {output}", file=sys.stderr)
+
+if __name__ == "__main__":
+    sys.exit(main())
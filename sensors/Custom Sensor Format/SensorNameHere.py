@@ -19,11 +19,23 @@ class SensorNameHere:
         # Important constants
         self.name = "SensorNameHere"
         self.maxReadFrequency = 100 # Hz
+
+        # Optional conversion from raw values to units, applied to whole blocks of data outside of the
+        # data collector (see src/calibration.py for the linear, polynomial and table types). Without it,
+        # convert() is called on every value.
+        self.calibration = {'type': 'linear', 'm': 1, 'b': 0}
+
+        # Optional noise filters the data collector runs on every value read (see src/filters.py),
+        # config.yaml can replace them with sensorSettings -> SensorNameHere -> filters
+        self.filters = []
+
         
         # Connect/intialize with a sensor
     
     def initInProcess(self):
-        """Run initialization commands when this sensor is accessed by the data collection process"""
+        """Run initialization commands when this sensor is accessed by the data collection process.
+        Import hardware libraries here instead of at the top of the file, so the rest of the system can load
+        the sensor on computers without them."""
         pass
 
     def reset(self):
@@ -36,7 +48,22 @@ class SensorNameHere:
         'Read data from the sensor. If the sensor has a problem with reading, you can return float("nan") to not plot anything'
         pass
 
+    # Optional, read several samples in one call. With blockSize above 1 in the sensor's sensorSettings in
+    # config.yaml, the data collector calls it instead of read(), once every blockSize samples, which saves the
+    # per sample overhead and lets drivers use the sensor's continuous or burst modes. Uncomment it if the
+    # sensor can do this.
+    #   count: Number of samples wanted (blockSize)
+    #   period: Nanoseconds between samples at the configured rate
+    #   start: time.perf_counter_ns() the block is due at, when its first sample should be taken
+    # Returns a numpy array of up to count raw values (NaN for failed reads), and a numpy int64 array with the
+    # time.perf_counter_ns() time each value was sampled at. Samples from before the run started are dropped.
+    #
+    # def readBlock(self, count, period, start): # Needs import numpy as np at the top of the file
+    #     values = np.array([self.read() for _ in range(count)])
+    #     times = start + period * np.arange(count, dtype=np.int64) # Sensors that keep their own pace
+    #     return values, times
+
     def convert(self, value):
-        "Convert the raw value to the desired display value."
+        "Convert the raw value to the desired display value, should match self.calibration."
         pass
 
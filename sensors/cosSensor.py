@@ -1,6 +1,7 @@
 """Testing class for sensor output"""
 
 import math
+import numpy as np
 
 class cosSensor:
     sensorNum = 0
@@ -10,6 +11,7 @@ class cosSensor:
         # Important constants
         self.maxReadFrequency = 20 # Hz
         self.name = "cos"
+        self.calibration = {'type': 'linear', 'm': 13, 'b': 0}
 
         self.time = 0. # Counter for sin
         # Connect/intialize with a sensor
@@ -29,6 +31,15 @@ class cosSensor:
         val = math.cos(self.time)
         self.time += 0.2
         return val
+
+    def readBlock(self, count, period, start):
+        """count samples at once, the same values count read() calls would return. The samples are stamped
+        period nanoseconds apart, from the block's deadline start on."""
+
+        values = np.cos(self.time + 0.2 * np.arange(count))
+        self.time += 0.2 * count
+        times = start + period * np.arange(count, dtype=np.int64)
+        return values, times
     
     def convert(self, val):
-        return val * 13
+        return val * self.calibration['m']
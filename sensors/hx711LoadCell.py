@@ -1,6 +1,5 @@
-import RPi.GPIO as GPIO
-from hx711 import HX711
-from line_profiler import profile
+import time
+import numpy as np
 
 class hx711LoadCell:
     sensorNum = 0
@@ -9,24 +8,37 @@ class hx711LoadCell:
     def __init__(self):
         """ Run once when adding a sensor. After running __init__, your sensor should be ready to have read() called and return data"""
         # Assign sensor ID
-        self.ID = hx711LoadCell.sensorNum
-        hx711LoadCell.sensorNum += 1
+        self.ID = self.__class__.sensorNum
+        self.__class__.sensorNum += 1
 
         # Important constants
         self.maxReadFrequency = 80 # Hz
         self.name = "hx711LoadCell"
 
+        ### Calibration Points ###
+        # 200lbs = 618750 = 90.7185 kg
+        # 50lbs = 167010 = 22.6796 kg
+        self.calibration = {'type': 'linear',
+                            'm': 0.0001506151769, # (90.7185 - 22.6796)/(618750 - 167010)
+                            'b': -2.474640689}
+
         # Organize pin numbers
-        self.dataPin, self.clockPin = hx711LoadCell.sensorPins[self.ID]
+        self.dataPin, self.clockPin = self.__class__.sensorPins[self.ID]
+
+        # Sensor noise filtering, run by the data collector (see src/filters.py). The HX711 occasionally outputs
+        # a ridiculous value in between two similar values, which is replaced by the mean of its neighbours, and
+        # other extreme changes are low passed to lessen the impact of noise not caught by the spike check.
+        self.filters = [{'type': 'despike', 'threshold': 300000, 'jumpThreshold': 500000, 'jumpGain': 0.05}]
 
-        # Control logic
-        self.previousVal = None
-        self.filterData = True
-        self.recentData = []
         
         # Connect/intialize with a sensor
 
     def initInProcess(self):
+        # Hardware libraries are imported here so the sensor can be created, and its settings read, on
+        # computers without them
+        import RPi.GPIO as GPIO
+        from hx711 import HX711
+
         # Assign pins, must be done when run by data collection process since 
         # gpio pins must be in the same process OR scope
         GPIO.setmode(GPIO.BCM)
@@ -39,7 +51,6 @@ class hx711LoadCell:
         pin assignments."""
         self.__class__.sensorNum = 0
 
-    @profile
     def read(self):
         "Read raw data from the sensor"
 
@@ -47,34 +58,27 @@ class hx711LoadCell:
 
         if val == -1:
             return float("nan")
-        else:
-            self.recentData += [val]
-        
-        # Filter sensor noise
-        if len(self.recentData) == 3: # Sensor is in steady state
-            # If the sensor has output a ridiculous value in between two similar values
-            if abs(self.recentData[0] - self.recentData[1]) > 300000 and abs(self.recentData[1] - self.recentData[2]) > 300000:# and abs(self.recentData[0] - self.recentData[2]) < 1000000:
-                # if middle value is a large change relative to the first, and if the middle value is a large change realtive to the third, and the first and third data points are similar
-                self.recentData[1] = (self.recentData[0] + self.recentData[2])/2 # Make the bad data the mean of the surrounding points
-
-            # Low pass extreme changes to lessen the impact of sensor noise not caught by the above filter
-            elif abs(self.recentData[0] - self.recentData[1]) > 500000:
-                self.recentData[1] = self.recentData[0] + 0.05 * (self.recentData[1] - self.recentData[0])
-            
-            val = self.recentData[0]
-            self.recentData.pop(0)
     
         return val
 
+    def readBlock(self, count, period, start):
+        """Read count samples period nanoseconds apart from start on, each stamped with the time it was read.
+        A read waits for the chip to have a sample ready, so samples can't come faster than its output rate."""
+
+        values = np.empty(count)
+        times = np.empty(count, dtype=np.int64)
+        for index in range(count):
+            wait = start + index * period - time.perf_counter_ns()
+            if wait > 0:
+                time.sleep(wait / 1e9)
+            val = self.hx._read()
+            times[index] = time.perf_counter_ns()
+            values[index] = float("nan") if val == -1 else val
+
+        return values, times
+
     def convert(self, value):
         "Convert the raw value to the desired display value."
-
-        ### Calibration Points ### 
-        # 200lbs = 618750 = 90.7185 kg
-        # 50lbs = 167010 = 22.6796 kg
-        m = 0.0001506151769 # (90.7185 - 22.6796)/(618750 - 167010)
-        b = -2.474640689
-        data = value * m + b
-        return data
+        return value * self.calibration['m'] + self.calibration['b']
 
 
@@ -0,0 +1,152 @@
+"""Plays back one column of a recorded run as if it was being read from a sensor, for reproducing problems seen
+in the field and load testing the rest of the system with real data. Options are set in config.yaml:
+
+    sensorSettings:
+      replaySensor:
+        file: Data/07-09-2024/Run1_10_30_AM.ptrun   # .ptrun or .csv run file
+        column: hx711LoadCell                       # Column name or index, defaults to the first sensor column
+        speed: 1                                    # Playback speed, 10 plays the run back ten times faster
+        loop: true                                  # Start over at the end of the recording, otherwise read NaN
+
+Each run starts playing from the beginning of the recording. Values are played back at the times they were
+recorded (scaled by speed), read() returns the latest recorded value at the time it is called.
+"""
+import csv
+import time
+import numpy as np
+
+from src.runFormat import readHeader, openRun
+from src.calibration import calibration
+
+class replaySensor:
+    sensorNum = 0
+
+    def __init__(self):
+        self.ID = replaySensor.sensorNum
+        replaySensor.sensorNum += 1
+
+        # Important constants
+        self.maxReadFrequency = 80 # Hz, replaced by the rate of the recording in configure()
+        self.name = "replay"
+        self.calibration = None
+
+        self.file = None
+        self.column = None
+        self.speed = 1.0
+        self.loop = True
+
+        self.times = None
+        self.values = None
+
+    def configure(self, options):
+        """Called with this sensor's sensorSettings from config.yaml after it is created"""
+
+        self.file = options.get('file')
+        self.column = options.get('column')
+        self.loop = options.get('loop', True) == True
+        try:
+            self.speed = float(options.get('speed', 1))
+        except (TypeError, ValueError):
+            print("ERROR: Bad speed value for replaySensor in config.yaml, must be a number. Using 1.")
+            self.speed = 1.0
+
+        if self.file == None:
+            print("ERROR: replaySensor needs a run file, set sensorSettings -> replaySensor -> file in config.yaml")
+            return
+
+        # A missing file or column reads NaN, like a sensor without a run file, instead of stopping the program
+        try:
+            self.readSettings()
+        except (OSError, ValueError, KeyError, IndexError, StopIteration) as error:
+            print(f"ERROR: Can't play back column {self.column} of {self.file} with replaySensor: {error}")
+            self.file = None
+
+    def readSettings(self):
+        """Rate, calibration and name of the played back column. Only the header is read here, the rows are
+        loaded by the data collector process in initInProcess()."""
+
+        if self.file.endswith(".ptrun"):
+            header = readHeader(self.file)[0]
+            columns = header['columns']
+            index = self.columnIndex(columns)
+            self.maxReadFrequency = header['sampleRates'][index - 1] * self.speed
+            self.calibration = header['calibration'][index - 1] # Raw values are played back, so keep their conversion
+        else:
+            with open(self.file, newline='') as f:
+                reader = csv.reader(f)
+                columns = next(reader)
+                times = [float(row[0]) for row, _ in zip(reader, range(1000))]
+            index = self.columnIndex(columns)
+
+            # Csv runs are already converted and have no header, estimate the rate from the recorded times
+            if len(times) > 1:
+                self.maxReadFrequency = self.speed / np.median(np.diff(times))
+
+        self.name = f"replay {columns[index]}"
+
+    def columnIndex(self, columns):
+        """Index of the played back column in the run file, column 0 is time"""
+
+        if self.column == None:
+            return 1
+        if isinstance(self.column, int):
+            return self.column
+        return columns.index(self.column)
+
+    def initInProcess(self):
+        """Load the recording, only the times at which the played back column has a value are kept"""
+
+        if self.file == None:
+            return
+
+        try:
+            if self.file.endswith(".ptrun"):
+                header, data = openRun(self.file)
+                index = self.columnIndex(header['columns'])
+                times, values = np.array(data[:, 0]), np.array(data[:, index])
+            else:
+                with open(self.file, newline='') as f:
+                    index = self.columnIndex(next(csv.reader(f)))
+                data = np.atleast_2d(np.genfromtxt(self.file, delimiter=',', skip_header=1)) # Empty cells become NaN
+                times, values = data[:, 0], data[:, index]
+        except (OSError, ValueError, KeyError, IndexError, StopIteration) as error: # e.g. the file was removed since configure()
+            print(f"ERROR: Can't load {self.file} for replaySensor: {error}")
+            times = values = np.empty(0)
+
+        valid = ~np.isnan(values)
+        self.times = (times[valid] - times[valid][0]) / self.speed if valid.any() else times[:0]
+        self.values = values[valid]
+        self.startRun()
+
+    def startRun(self):
+        """Called by the data collector when a run starts, playback restarts from the beginning"""
+        self.start = None
+
+    def reset(self):
+        """The reset function sets the sensor number for the entire class to 0. This is necessary to make
+        the flashdrive "plug and play" while supporting multiple sensors of the same type that have different
+        pin assignments."""
+        self.__class__.sensorNum = 0
+
+    def read(self):
+        if self.values is None or len(self.values) == 0:
+            return float("nan")
+
+        now = time.perf_counter()
+        if self.start == None:
+            self.start = now
+
+        elapsed = now - self.start
+        if elapsed > self.times[-1]:
+            if not self.loop:
+                return float("nan")
+            if len(self.times) > 1:
+                elapsed %= self.times[-1] * len(self.times) / (len(self.times) - 1) # One more period after the end
+
+        return float(self.values[np.searchsorted(self.times, elapsed, side='right') - 1])
+
+    def convert(self, value):
+        "The recorded values are converted with the calibration of the recording when it has one"
+        if self.calibration == None:
+            return value
+        return float(calibration(self.calibration).apply(value))
@@ -0,0 +1,100 @@
+"""Simulated HX711 load cell for testing the whole system without the hardware. It is read exactly like
+hx711LoadCell, only the HX711 chip is replaced by a model of its behaviour:
+
+    - A new conversion is ready every 1 / rate seconds, each simulated chip converts at a random phase like
+      separate chips that are not synchronised, and runs up to rateError (a fraction) fast or slow like the
+      HX711's internal oscillator. Reading blocks until the next conversion if the latest
+      one was already read, and reading the 24 bits takes readTime seconds of busy waiting (bit banging).
+    - Failed reads return -1 with probability failureRate.
+    - Spikes of +/- spikeSize counts are added with probability spikeRate, like the ones despike removes.
+    - The load follows repeated pulls, ramping up to peak kg over rampTime seconds and then breaking.
+
+Options are set in config.yaml, all of them are optional:
+
+    sensorSettings:
+      simulatedHX711:
+        rate: 80
+        rateError: 0.01
+        readTime: 0.0002
+        failureRate: 0.001
+        spikeRate: 0.002
+        spikeSize: 1000000
+        noise: 300          # Standard deviation of the noise in counts
+        peak: 50
+        rampTime: 10
+        seed: 1             # Makes the simulated data repeatable, each load cell adds its number to it
+"""
+import time
+import numpy as np
+
+from sensors.hx711LoadCell import hx711LoadCell
+
+class simulatedChip:
+    """Stands in for hx711.HX711, only _read() is provided"""
+
+    breakTime = 2 # Seconds at zero load after each break
+
+    def __init__(self, options, calibration, channel=0):
+        self.rate = options.get('rate', 80)
+        self.rateError = options.get('rateError', 0.01)
+        self.readTime = options.get('readTime', 0.0002)
+        self.failureRate = options.get('failureRate', 0.001)
+        self.spikeRate = options.get('spikeRate', 0.002)
+        self.spikeSize = options.get('spikeSize', 1000000)
+        self.noise = options.get('noise', 300)
+        self.peak = options.get('peak', 50)
+        self.rampTime = options.get('rampTime', 10)
+        self.calibration = calibration
+        seed = options.get('seed')
+        self.random = np.random.default_rng(None if seed == None else seed + channel)
+        self.rate *= 1 + self.random.uniform(-self.rateError, self.rateError)
+
+        self.startTime = time.perf_counter() - self.random.random() / self.rate # Random conversion phase
+        self.lastConversion = -1 # Index of the last conversion that was read
+
+    def load(self, t):
+        """Simulated load in kg at t seconds"""
+
+        t %= self.rampTime + simulatedChip.breakTime
+        if t < self.rampTime:
+            return self.peak * t / self.rampTime
+        return 0.0
+
+    def _read(self):
+        # Wait for a conversion that has not been read yet, older unread conversions are lost like on the chip
+        conversion = int((time.perf_counter() - self.startTime) * self.rate)
+        if conversion <= self.lastConversion:
+            conversion = self.lastConversion + 1
+            time.sleep(max(0, self.startTime + conversion / self.rate - time.perf_counter()))
+        self.lastConversion = conversion
+
+        end = time.perf_counter() + self.readTime
+        while time.perf_counter() < end:
+            pass
+
+        if self.random.random() < self.failureRate:
+            return -1
+
+        value = (self.load(conversion / self.rate) - self.calibration['b']) / self.calibration['m']
+        value += self.random.normal(0, self.noise)
+        if self.random.random() < self.spikeRate:
+            value += self.spikeSize * self.random.choice([-1, 1])
+
+        return int(value)
+
+class simulatedHX711(hx711LoadCell):
+    sensorNum = 0
+    sensorPins = [[None, None]] * 16 # No pins are used, up to 16 simulated load cells
+
+    def __init__(self):
+        super().__init__()
+        self.name = "simulatedHX711"
+        self.options = {}
+
+    def configure(self, options):
+        """Called with this sensor's sensorSettings from config.yaml after it is created"""
+        self.options = options
+        self.maxReadFrequency = options.get('rate', 80)
+
+    def initInProcess(self):
+        self.hx = simulatedChip(self.options, self.calibration, self.ID)
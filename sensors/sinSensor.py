@@ -1,6 +1,7 @@
 """Testing class for sensor output"""
 
 import math
+import numpy as np
 
 class sinSensor:
     sensorNum = 0
@@ -10,6 +11,7 @@ class sinSensor:
         # Important constants
         self.maxReadFrequency = 20 # Hz
         self.name = "sin" # For testing only
+        self.calibration = {'type': 'linear', 'm': 10, 'b': 0}
 
         self.time = 0. # Counter for sin
 
@@ -30,9 +32,18 @@ class sinSensor:
         val = math.sin(self.time)
         self.time += 0.2
         return val
+
+    def readBlock(self, count, period, start):
+        """count samples at once, the same values count read() calls would return. The samples are stamped
+        period nanoseconds apart, from the block's deadline start on."""
+
+        values = np.sin(self.time + 0.2 * np.arange(count))
+        self.time += 0.2 * count
+        times = start + period * np.arange(count, dtype=np.int64)
+        return values, times
     
     def convert(self, val):
-        return val * 10
+        return val * self.calibration['m']
 
     def calibrate(self):
         pass
@@ -0,0 +1,255 @@
+"""Parallel acquisition, every sensor is read by its own thread so sensors that block while waiting for data
+(like the HX711 waiting for its data ready line) wait at the same time instead of one after another."""
+import time
+import threading
+import numpy as np
+
+from src.scheduler import sleepUntil
+from src.metrics import histogram, latencyBuckets
+
+def blockRows(values, times, chain, column, nColumns, startTime):
+    """Rows for the samples returned by a sensor's readBlock(), with NaN in the other sensors' columns. The
+    values run through the sensor's filter chain, samples that the filters hold back, that failed or that were
+    sampled before the run started (startTime) get no row."""
+
+    values = chain.processBlock(values)
+    times = np.asarray(times, dtype=np.int64)
+    keep = ~np.isnan(values) & (times >= startTime)
+    rows = np.full((int(keep.sum()), nColumns), np.nan)
+    rows[:, 0] = (times[keep] - startTime) / 1e9
+    rows[:, column] = values[keep]
+    return rows
+
+class timeOrder:
+    """Puts rows that are produced out of time order (blocks of samples stamped by the sensor, rows merged from
+    readings) back in order without changing their times. Rows are held until the watermark passes them: the
+    earliest time any sensor can still produce a sample for, given by the caller.
+    Input:
+        nColumns:
+            Columns per row, including time"""
+
+    def __init__(self, nColumns):
+        self.nColumns = nColumns
+        self.held = []
+        self.released = -np.inf # Watermark of the last release, in seconds
+        self.late = 0 # Samples that arrived behind a row already released, they are dropped
+
+    def add(self, rows):
+        """Hold a 2D block of rows until they can be released"""
+
+        rows = np.asarray(rows, dtype=np.float64).reshape(-1, self.nColumns)
+        late = rows[:, 0] < self.released
+        if late.any(): # Only happens when a stalled sensor was given up on (see parallelAcquisition's maxWait)
+            self.late += int(late.sum())
+            rows = rows[~late]
+        if len(rows) > 0:
+            self.held += [rows]
+
+    def release(self, watermark):
+        """The held rows older than watermark (seconds since the start of the run), in time order"""
+
+        self.released = max(self.released, watermark)
+        if len(self.held) == 0:
+            return np.empty((0, self.nColumns))
+
+        rows = self.held[0] if len(self.held) == 1 else np.vstack(self.held)
+        rows = rows[np.argsort(rows[:, 0], kind='stable')]
+        count = int(np.searchsorted(rows[:, 0], self.released, side='left'))
+        self.held = [rows[count:]] if count < len(rows) else []
+        return rows[:count]
+
+    def flush(self):
+        """Every held row, once no sensor will produce another one"""
+        return self.release(np.inf)
+
+class parallelAcquisition:
+    """Reads each sensor on its own schedule from its own thread and merges the readings into rows.
+
+    Readings are stamped with the time their read() returned. Readings scheduled for the same deadline are
+    merged into one row, which is emitted once every sensor due at that deadline has reported (or has moved
+    past it after missing it). The row time is the mean of its readings' stamps, and the spread of the stamps
+    is recorded as the skew between channels. Sensors that are not due at a deadline are NaN in its row, the
+    same as in sequential acquisition.
+
+    Sensors read in blocks (blockSize in their sensorSettings) are not merged, each block of samples becomes rows
+    of its own with the times the sensor stamped them with. Rows are passed on in time order (see timeOrder), once
+    no sensor can report an earlier reading: the earliest deadline a sensor is still reading or waiting for.
+
+    Input:
+        sensors, schedulers, filterChains:
+            One each per sensor, as set up by src.dataCollector.dataCollector
+        startTime:
+            perf_counter_ns() the schedulers were started at
+        emit:
+            Called with (row, now) for a single row, in time order, from whichever thread completed it
+        metrics:
+            src.metrics.metricSet that read times and failed reads are recorded in
+        maxWait:
+            Seconds a row waits for a sensor that stopped responding before it is emitted without it
+        blockSizes:
+            Samples per readBlock() call of each sensor, None for sensors that are read with read()
+        emitRows:
+            Called with (rows, now) instead of emit when several rows are passed on at once"""
+
+    def __init__(self, sensors, schedulers, filterChains, startTime, emit, metrics, maxWait=1.0, blockSizes=None, emitRows=None):
+        self.sensors = sensors
+        self.schedulers = schedulers
+        self.filterChains = filterChains
+        self.startTime = startTime
+        self.emit = emit
+        self.metrics = metrics
+        self.maxWait = int(maxWait * 1e9)
+        self.blockSizes = blockSizes or [None] * len(sensors)
+        self.emitRows = emitRows
+
+        self.lock = threading.Lock()
+        self.stopEvent = threading.Event()
+        self.threads = []
+
+        self.pending = {} # Deadline -> [values, stamps]
+        self.lastDeadline = [None] * len(sensors) # Latest deadline each sensor reported
+        self.lastEmitted = None
+        self.order = timeOrder(len(sensors) + 1)
+        self.producing = [scheduler.nextDeadline for scheduler in schedulers] # Earliest deadline each sensor can still report
+        self.lateReadings = 0
+        self.skew = histogram(latencyBuckets)
+
+    def start(self):
+        for index in range(len(self.sensors)):
+            thread = threading.Thread(target=self.sensorLoop, args=(index,), daemon=True)
+            thread.start()
+            self.threads += [thread]
+
+    def stop(self):
+        """Stop every thread and emit the rows still waiting for readings"""
+
+        self.stopEvent.set()
+        for thread in self.threads:
+            thread.join()
+
+        with self.lock:
+            for deadline in sorted(self.pending):
+                self.emitRow(deadline)
+            self.passOn(self.order.flush(), time.perf_counter_ns())
+
+    def sensorLoop(self, index):
+        sensor = self.sensors[index]
+        scheduler = self.schedulers[index]
+        chain = self.filterChains[index]
+
+        while True:
+            deadline = scheduler.nextDeadline
+            if not sleepUntil(deadline, 0, self.stopEvent.wait): # No spin, a spinning thread holds up the others
+                return
+
+            scheduler.fire(time.perf_counter_ns())
+            deadline = scheduler.nextDeadline - scheduler.period # Later than planned if deadlines were skipped
+            if self.blockSizes[index] != None:
+                self.readBlock(index, deadline)
+                if self.stopEvent.is_set():
+                    return
+                continue
+
+            readStart = time.perf_counter_ns()
+            raw = sensor.read()
+            stamp = time.perf_counter_ns()
+            value = chain.process(raw)
+
+            with self.lock:
+                if self.metrics.enabled:
+                    self.metrics.observe('sensorRead', (stamp - readStart) / 1e9)
+                    self.metrics.observe('sensorRead.' + sensor.name, (stamp - readStart) / 1e9)
+                    if raw != raw: # NaN
+                        self.metrics.count('failedReads')
+
+                self.merge(index, deadline, stamp, value)
+                self.producing[index] = self.schedulers[index].nextDeadline
+                self.releaseRows(stamp)
+
+            if self.stopEvent.is_set():
+                return
+
+    def readBlock(self, index, deadline):
+        """Read a block of samples from a sensor with readBlock() and emit them"""
+
+        sensor = self.sensors[index]
+        blockSize = self.blockSizes[index]
+        readStart = time.perf_counter_ns()
+        values, times = sensor.readBlock(blockSize, self.schedulers[index].period // blockSize, deadline)
+        stamp = time.perf_counter_ns()
+        rows = blockRows(values, times, self.filterChains[index], index + 1, len(self.sensors) + 1, self.startTime)
+
+        with self.lock:
+            if self.metrics.enabled:
+                self.metrics.observe('sensorRead', (stamp - readStart) / 1e9)
+                self.metrics.observe('sensorRead.' + sensor.name, (stamp - readStart) / 1e9)
+                self.metrics.count('failedReads', int(np.isnan(values).sum()))
+
+            self.lastDeadline[index] = deadline
+            self.order.add(rows)
+            self.producing[index] = self.schedulers[index].nextDeadline
+            self.releaseRows(stamp)
+
+    def due(self, index, deadline):
+        """True if the sensor's schedule includes the deadline, sensors read in blocks are never part of a row"""
+        if self.blockSizes[index] != None:
+            return False
+        return (deadline - self.startTime) % self.schedulers[index].period == 0
+
+    def merge(self, index, deadline, stamp, value):
+        """Add a reading and emit every row that is complete, called with the lock held"""
+
+        self.lastDeadline[index] = deadline
+
+        if self.lastEmitted != None and deadline <= self.lastEmitted:
+            self.lateReadings += 1 # Its row was already emitted without it
+            return
+
+        if deadline not in self.pending:
+            self.pending[deadline] = [[float("nan")] * len(self.sensors), []]
+
+        if value != None: # None means the filters are holding the value back (e.g. decimation)
+            self.pending[deadline][0][index] = value
+            self.pending[deadline][1] += [stamp]
+
+        for oldest in sorted(self.pending):
+            complete = all([not self.due(other, oldest) or (self.lastDeadline[other] != None and self.lastDeadline[other] >= oldest)
+                            for other in range(len(self.sensors))])
+            if not complete and stamp - oldest < self.maxWait:
+                break
+            self.emitRow(oldest)
+
+    def emitRow(self, deadline):
+        values, stamps = self.pending.pop(deadline)
+        self.lastEmitted = deadline
+
+        if len(stamps) == 0: # No sensor had an output for this deadline
+            return
+
+        if len(stamps) > 1:
+            self.skew.record((max(stamps) - min(stamps)) / 1e9)
+
+        # Readings are stamped when their read returned, never earlier than their deadline
+        self.order.add([(sum(stamps) / len(stamps) - self.startTime) / 1e9] + values)
+
+    def releaseRows(self, now):
+        """Pass on the rows no sensor can report an earlier reading than, called with the lock held. A sensor
+        that stopped responding holds rows back for at most maxWait."""
+
+        watermark = min(self.producing + list(self.pending))
+        self.passOn(self.order.release((max(watermark, now - self.maxWait) - self.startTime) / 1e9), now)
+
+    def passOn(self, rows, now):
+        if len(rows) > 1 and self.emitRows != None:
+            self.emitRows(rows, now)
+        else:
+            for row in rows.tolist():
+                self.emit(row, now)
+
+    def skewStats(self):
+        """Spread of the reading times within rows, in seconds"""
+
+        summary = self.skew.summary()
+        del summary['buckets']
+        summary['lateReadings'] = self.lateReadings + self.order.late
+        return summary
@@ -0,0 +1,110 @@
+"""Alignment of multi rate sensor streams.
+
+When sensors are read at different rates the data collector emits one row per read time, and a sensor that was
+not due at that time has NaN in its column. The classes here fill those gaps block by block, carrying state
+between blocks so that a stream gives the same result no matter how it was split up."""
+import numpy as np
+
+def holdColumns(block, carry):
+    """Forward fill NaN values in every column of block (2D, without the time column) with the last real value
+    before them. carry holds the last real value of each column from previous blocks (NaN if none yet).
+    Returns the filled block and the new carry."""
+
+    filled = np.vstack((carry, block))
+    valid = ~np.isnan(filled)
+    index = np.where(valid, np.arange(len(filled))[:, None], 0)
+    np.maximum.accumulate(index, axis=0, out=index)
+    filled = np.take_along_axis(filled, index, axis=0)
+    return filled[1:], filled[-1].copy()
+
+class streamAligner:
+    """Aligns a multi rate stream of rows (time in column 0) into rows where every sensor has a value.
+
+    Input:
+        mode:
+            'hold' repeats the last reading of a sensor until its next one (sample and hold)
+            'interpolate' linearly interpolates between readings, rows are held back until every sensor has a
+            reading after them, so output lags the input by up to one period of the slowest sensor
+            'none' passes rows through unchanged
+        maxPending:
+            Interpolation never holds back more than this many rows, if a sensor stops reporting the oldest
+            rows are released with sample and hold"""
+
+    def __init__(self, mode='hold', maxPending=4096):
+        if mode not in ('hold', 'interpolate', 'none'):
+            print(f"ERROR: Unknown alignment '{mode}' in config.yaml, using 'hold'.")
+            mode = 'hold'
+
+        self.mode = mode
+        self.maxPending = maxPending
+        self.carry = None # Last real value of each sensor column
+        self.carryTime = None # Time of that value, used for interpolation
+        self.pending = None
+
+    def align(self, block):
+        """Align a 2D block of rows. Returns the aligned rows, which may be fewer than the input rows when
+        interpolating (the rest are returned by later calls or by flush())."""
+
+        block = np.asarray(block, dtype=np.float64)
+        if self.mode == 'none' or len(block) == 0:
+            return block
+
+        if self.carry is None:
+            self.carry = np.full(block.shape[1] - 1, np.nan)
+            self.carryTime = np.full(block.shape[1] - 1, np.nan)
+
+        if self.mode == 'hold':
+            values, self.carry = holdColumns(block[:, 1:], self.carry)
+            return np.column_stack((block[:, 0], values))
+
+        return self.interpolate(block)
+
+    def interpolate(self, block):
+        if self.pending is not None:
+            block = np.vstack((self.pending, block))
+
+        valid = ~np.isnan(block[:, 1:])
+        seen = valid.any(axis=0) | ~np.isnan(self.carry)
+
+        # Rows up to and including the earliest "last reading" among the sensors can be interpolated
+        lastValid = np.where(valid.any(axis=0), len(block) - 1 - np.argmax(valid[::-1], axis=0), -1)
+        release = int(lastValid[seen].min()) + 1 if seen.any() else len(block)
+        release = max(release, len(block) - self.maxPending)
+
+        out = block[:release].copy()
+        times = block[:, 0]
+        for column in range(1, block.shape[1]):
+            known = valid[:, column - 1]
+            knownTimes = times[known]
+            knownValues = block[known, column]
+            if not np.isnan(self.carry[column - 1]):
+                knownTimes = np.concatenate(([self.carryTime[column - 1]], knownTimes))
+                knownValues = np.concatenate(([self.carry[column - 1]], knownValues))
+
+            if len(knownTimes) == 0:
+                continue
+
+            # np.interp holds the end values, which is what the rows released past the last reading need
+            filled = np.interp(out[:, 0], knownTimes, knownValues)
+            filled[out[:, 0] < knownTimes[0]] = np.nan
+            out[:, column] = filled
+
+        # Remember the last real reading of each sensor among the released rows
+        for column in range(1, block.shape[1]):
+            known = np.flatnonzero(valid[:release, column - 1])
+            if len(known) > 0:
+                self.carry[column - 1] = block[known[-1], column]
+                self.carryTime[column - 1] = block[known[-1], 0]
+
+        self.pending = block[release:] if release < len(block) else None
+        return out
+
+    def flush(self):
+        """Release every held back row, sensors without a later reading are held at their last value"""
+
+        if self.pending is None:
+            return None
+
+        block, self.pending = self.pending, None
+        values, self.carry = holdColumns(block[:, 1:], self.carry)
+        return np.column_stack((block[:, 0], values))
@@ -0,0 +1,121 @@
+"""Conversion of raw sensor values to units, applied to whole blocks of rows with numpy.
+
+The data collector always stores raw values. Each sensor describes its conversion with a `calibration`
+dictionary, which can be overridden from config.yaml without touching the sensor code:
+
+    sensorSettings:
+      hx711LoadCell:
+        calibration: {type: linear, m: 0.0001506151769, b: -2.474640689}
+
+Supported calibration types:
+    linear          value = m * raw + b
+    polynomial      value = coefficients[0] + coefficients[1] * raw + coefficients[2] * raw**2 + ...
+    table           Piecewise linear through the points (raw[i], value[i]), raw must be increasing. Values
+                    outside of the table are extrapolated from the first and last segment.
+
+Sensors without a calibration fall back to calling their convert() method on every value.
+"""
+import numpy as np
+
+from src.settings import sensorSettings
+
+def calibrationSpec(settingsDict, sensor):
+    """The calibration of a sensor, config.yaml wins over the sensor's own calibration attribute"""
+    return sensorSettings(settingsDict, sensor).get('calibration', getattr(sensor, 'calibration', None))
+
+class calibration:
+    """Vectorized conversion for one sensor.
+    Input:
+        spec:
+            Calibration dictionary (see the top of this module) or None
+        function:
+            Scalar conversion function used when spec is None, leave as None to pass raw values through"""
+
+    def __init__(self, spec=None, function=None):
+        self.spec = spec
+        self.function = function
+
+        if spec == None:
+            return
+
+        kind = spec.get('type', 'linear')
+        if kind == 'linear':
+            self.coefficients = np.array([spec.get('b', 0.0), spec.get('m', 1.0)], dtype=np.float64)
+        elif kind == 'polynomial':
+            self.coefficients = np.array(spec['coefficients'], dtype=np.float64)
+        elif kind == 'table':
+            self.raw = np.array(spec['raw'], dtype=np.float64)
+            self.value = np.array(spec['value'], dtype=np.float64)
+            if len(self.raw) < 2 or len(self.raw) != len(self.value) or np.any(np.diff(self.raw) <= 0):
+                raise ValueError("A table calibration needs at least two points with increasing raw values")
+        else:
+            raise ValueError(f"Unknown calibration type '{kind}'")
+
+        self.kind = kind
+
+    def apply(self, values):
+        values = np.asarray(values, dtype=np.float64)
+
+        if self.spec == None:
+            if self.function == None:
+                return values
+            return np.frompyfunc(self.function, 1, 1)(values).astype(np.float64)
+
+        if self.kind == 'table':
+            converted = np.interp(values, self.raw, self.value)
+            # np.interp clamps at the ends, extend the first and last segment instead
+            below = values < self.raw[0]
+            above = values > self.raw[-1]
+            converted[below] = self.value[0] + (values[below] - self.raw[0]) * (self.value[1] - self.value[0]) / (self.raw[1] - self.raw[0])
+            converted[above] = self.value[-1] + (values[above] - self.raw[-1]) * (self.value[-1] - self.value[-2]) / (self.raw[-1] - self.raw[-2])
+            return converted
+
+        return np.polynomial.polynomial.polyval(values, self.coefficients)
+
+class blockConverter:
+    """Converts the sensor columns of blocks of rows (time in column 0) to units.
+    Input:
+        calibrations:
+            One calibration per sensor column
+        enabled:
+            When False blocks are returned unchanged, matching convert: false in config.yaml"""
+
+    def __init__(self, calibrations, enabled=True):
+        self.calibrations = calibrations
+        self.enabled = enabled
+
+    @classmethod
+    def fromSensors(cls, settingsDict, sensors):
+        return cls([calibration(calibrationSpec(settingsDict, sensor), sensor.convert) for sensor in sensors],
+                   settingsDict.get('convert', False) == True)
+
+    @classmethod
+    def fromHeader(cls, header, settingsDict=None):
+        """Converter for a stored run (see src.runFormat.runHeader). Calibrations in settingsDict's
+        sensorSettings replace the stored ones, so a run can be re-converted after recalibrating."""
+
+        specs = list(header.get('calibration') or [])
+        types = header.get('sensorTypes') or []
+        enabled = header.get('convert', False)
+
+        if settingsDict != None:
+            enabled = settingsDict.get('convert', enabled)
+            allSensorSettings = settingsDict.get('sensorSettings') or {}
+            for index, sensorType in enumerate(types):
+                if 'calibration' in (allSensorSettings.get(sensorType) or {}):
+                    specs[index] = allSensorSettings[sensorType]['calibration']
+
+        return cls([calibration(spec) for spec in specs], enabled == True)
+
+    def convert(self, block):
+        """Return a converted copy of block, or block itself when conversion is disabled"""
+
+        block = np.asarray(block, dtype=np.float64)
+        if not self.enabled or len(block) == 0:
+            return block
+
+        converted = block.copy()
+        for column, columnCalibration in enumerate(self.calibrations, start=1):
+            converted[:, column] = columnCalibration.apply(block[:, column])
+
+        return converted
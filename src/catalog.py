@@ -0,0 +1,267 @@
+"""SQLite catalog of every run, so runs can be found without opening the run files.
+
+The main process records each run in Data/catalog.sqlite of this repository when it starts and completes the
+record when it stops, wherever the run file is written (flash drive or Data folder). Run numbers come from the
+catalog, so they keep counting up across restarts and file names never collide. Runs recorded before the catalog
+existed, or copied in from elsewhere, are added by a backfill that only reads files it has not seen (or that
+changed since).
+
+Each run has its path, start and stop time, sensors, columns, sample rate, row count and duration, and the peak,
+mean and break of each channel (from the run's _summary.json when it has one, otherwise computed once from the
+file).
+
+Usage as a script, from the PullTester directory:
+    python -m src.catalog backfill [Data /media/pulltester/USB/Data]
+    python -m src.catalog list [--since 7] [--min-peak 50] [--channel hx711LoadCell] [--limit 20]
+    python -m src.catalog show 12
+"""
+import os
+import sys
+import csv
+import json
+import glob
+import sqlite3
+import argparse
+
+from datetime import datetime, timedelta
+from src.runFormat import readHeader, iterBlocks, iterCSVBlocks
+from src.calibration import blockConverter
+from src.runStats import runStatistics
+
+dataDir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Data") # Data folder of this repository
+defaultPath = os.path.join(dataDir, "catalog.sqlite")
+
+schema = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    runNumber INTEGER,
+    path TEXT UNIQUE,
+    started TEXT,
+    stopped TEXT,
+    sensors TEXT,
+    columns TEXT,
+    sampleRate REAL,
+    rows INTEGER,
+    duration REAL,
+    size INTEGER,
+    modified REAL
+);
+CREATE TABLE IF NOT EXISTS channels (
+    runId INTEGER REFERENCES runs(id) ON DELETE CASCADE,
+    name TEXT,
+    peak REAL,
+    timeOfPeak REAL,
+    mean REAL,
+    breakTime REAL,
+    PRIMARY KEY (runId, name)
+);
+CREATE INDEX IF NOT EXISTS runsStarted ON runs(started);
+CREATE INDEX IF NOT EXISTS channelsPeak ON channels(peak);
+"""
+
+class runCatalog:
+    """Connection to the catalog database, one per thread.
+    Input:
+        path:
+            Database file, created with its folder if needed"""
+
+    def __init__(self, path=defaultPath):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=10)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL") # Readers don't wait for the writer
+        self.db.execute("PRAGMA foreign_keys=ON")
+        self.db.executescript(schema)
+
+    def close(self):
+        self.db.close()
+
+    def nextRunNumber(self):
+        number = self.db.execute("SELECT MAX(runNumber) FROM runs").fetchone()[0]
+        return 1 if number == None else number + 1
+
+    ### Recording runs as they are collected ###
+    def startRun(self, runNumber, path, settingsDict, sensors, sampleRates):
+        """Record a run that is starting, returns its id"""
+
+        with self.db:
+            cursor = self.db.execute("INSERT OR REPLACE INTO runs (runNumber, path, started, sensors, columns, sampleRate, rows) "
+                                     "VALUES (?, ?, ?, ?, ?, ?, 0)",
+                                     (runNumber, os.path.abspath(path), datetime.now().isoformat(timespec='seconds'),
+                                      json.dumps([sensor.name for sensor in sensors]),
+                                      json.dumps(["Time (seconds)"] + settingsDict['columnNames']), max(sampleRates + [0])))
+        return cursor.lastrowid
+
+    def finishRun(self, runId, path, summary):
+        """Complete the record of a stopped run with its final path and its src.runStats summary"""
+
+        try:
+            stat = os.stat(path)
+            size, modified = stat.st_size, stat.st_mtime
+        except OSError: # The run file couldn't be finalized, the backfill picks it up if it turns up
+            size, modified = None, None
+
+        with self.db:
+            self.db.execute("UPDATE runs SET path = ?, stopped = ?, rows = ?, duration = ?, size = ?, modified = ? WHERE id = ?",
+                            (os.path.abspath(path), datetime.now().isoformat(timespec='seconds'), summary['rows'],
+                             summary['duration'], size, modified, runId))
+            self.saveChannels(runId, summary)
+
+    def saveChannels(self, runId, summary):
+        self.db.execute("DELETE FROM channels WHERE runId = ?", (runId,))
+        self.db.executemany("INSERT INTO channels (runId, name, peak, timeOfPeak, mean, breakTime) VALUES (?, ?, ?, ?, ?, ?)",
+                            [(runId, channel['name'], channel['max'], channel['timeOfMax'], channel['mean'], channel['breakTime'])
+                             for channel in summary['channels']])
+
+    ### Backfill ###
+    def backfill(self, dataDirs):
+        """Add run files in the Data folders that are not in the catalog, or changed since they were added.
+        Returns the number of runs added or updated."""
+
+        known = {row['path']: (row['size'], row['modified']) for row in self.db.execute("SELECT path, size, modified FROM runs")}
+        added = 0
+        for path in runFiles(dataDirs):
+            stat = os.stat(path)
+            if known.get(path) == (stat.st_size, stat.st_mtime):
+                continue
+
+            try:
+                record, summary = describeRun(path)
+            except (OSError, ValueError, KeyError, IndexError) as error:
+                print(f"ERROR: Couldn't add {path} to the run catalog: {error}")
+                continue
+
+            with self.db:
+                self.db.execute("DELETE FROM runs WHERE path = ?", (path,))
+                cursor = self.db.execute("INSERT INTO runs (runNumber, path, started, stopped, sensors, columns, sampleRate, rows, duration, size, modified) "
+                                         "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                         (record['runNumber'], path, record['started'], record['stopped'], json.dumps(record['sensors']),
+                                          json.dumps(record['columns']), record['sampleRate'], summary['rows'], summary['duration'],
+                                          stat.st_size, stat.st_mtime))
+                self.saveChannels(cursor.lastrowid, summary)
+            added += 1
+
+        return added
+
+    ### Queries ###
+    def find(self, since=None, minimumPeak=None, channel=None, limit=None):
+        """Runs started after since (a datetime) with a channel (optionally a named one) peaking at or above
+        minimumPeak, newest first"""
+
+        query = "SELECT DISTINCT runs.* FROM runs LEFT JOIN channels ON channels.runId = runs.id WHERE 1"
+        parameters = []
+        if since != None:
+            query += " AND runs.started >= ?"
+            parameters += [since.isoformat(timespec='seconds')]
+        if minimumPeak != None:
+            query += " AND channels.peak >= ?"
+            parameters += [minimumPeak]
+        if channel != None:
+            query += " AND channels.name = ?"
+            parameters += [channel]
+        query += " ORDER BY runs.started DESC"
+        if limit != None:
+            query += " LIMIT ?"
+            parameters += [limit]
+
+        return [dict(row) for row in self.db.execute(query, parameters)]
+
+    def channels(self, runId):
+        return [dict(row) for row in self.db.execute("SELECT * FROM channels WHERE runId = ? ORDER BY rowid", (runId,))]
+
+def runFiles(dataDirs):
+    """Run files in Data folders (Data/<day>/Run*) or day folders, csv copies of binary runs are left out"""
+
+    paths = []
+    for dataDir in dataDirs:
+        dataDir = os.path.abspath(dataDir)
+        for path in sorted(glob.glob(os.path.join(dataDir, "*", "Run*")) + glob.glob(os.path.join(dataDir, "Run*"))):
+            name = os.path.basename(path)
+            if name.endswith(".ptrun"):
+                paths += [path]
+            elif name.endswith(".csv") and not os.path.exists(path[:-len(".csv")] + ".ptrun"):
+                paths += [path]
+
+    return paths
+
+def describeRun(path):
+    """Catalog record and src.runStats summary of a run file. The summary comes from the run's _summary.json
+    when there is one, otherwise the file is read once in blocks."""
+
+    stem = os.path.splitext(path)[0]
+    name = os.path.basename(stem) # Run<N>_<hour>_<minute>_<AM/PM>
+    runNumber = int(name.split("_")[0][len("Run"):])
+    stopped = datetime.fromtimestamp(os.stat(path).st_mtime).isoformat(timespec='seconds')
+    try:
+        day = os.path.basename(os.path.dirname(path))
+        started = datetime.strptime(f"{day} {name.split('_', 1)[1]}", "%m-%d-%Y %I_%M_%p").isoformat(timespec='seconds')
+    except (ValueError, IndexError):
+        started = stopped
+
+    if path.endswith(".ptrun"):
+        header, _ = readHeader(path)
+        record = {'started': header.get('created', started)[:19], 'sensors': header.get('sensors', []),
+                  'columns': header['columns'], 'sampleRate': header.get('sampleRate')}
+        blocks = None
+        if not os.path.exists(stem + "_summary.json"):
+            converter = blockConverter.fromHeader(header)
+            blocks = (converter.convert(block) for block in iterBlocks(path))
+    else:
+        with open(path, newline='') as f:
+            columns = next(csv.reader(f))
+        record = {'started': started, 'sensors': columns[1:], 'columns': columns, 'sampleRate': None}
+        blocks = None if os.path.exists(stem + "_summary.json") else iterCSVBlocks(path)
+
+    record.update(runNumber=runNumber, stopped=stopped)
+
+    if blocks == None:
+        with open(stem + "_summary.json") as f:
+            return record, json.load(f)
+
+    stats = runStatistics(record['columns'][1:])
+    for block in blocks:
+        stats.update(block)
+    return record, stats.summary()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find pull tester runs in the run catalog")
+    parser.add_argument('--catalog', default=defaultPath, help="Catalog database file")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    backfill = commands.add_parser('backfill', help="Add runs in Data folders that are not in the catalog yet")
+    backfill.add_argument('dataDirs', nargs='*', default=[dataDir])
+
+    find = commands.add_parser('list', help="List runs, newest first")
+    find.add_argument('--since', type=float, default=None, help="Only runs from the last this many days")
+    find.add_argument('--min-peak', type=float, default=None, help="Only runs with a channel peaking at or above this")
+    find.add_argument('--channel', default=None, help="Channel (column name) that --min-peak applies to")
+    find.add_argument('--limit', type=int, default=None)
+
+    show = commands.add_parser('show', help="Everything the catalog has on one run")
+    show.add_argument('id', type=int)
+
+    args = parser.parse_args(argv)
+    catalog = runCatalog(args.catalog)
+
+    if args.command == 'backfill':
+        print(f"Added {catalog.backfill(args.dataDirs)} runs")
+
+    elif args.command == 'list':
+        since = datetime.now() - timedelta(days=args.since) if args.since != None else None
+        runs = catalog.find(since, args.min_peak, args.channel, args.limit)
+        print(f"{'id':>5}  {'run':>5}  {'started':19}  {'rows':>9}  {'seconds':>8}  peaks  path")
+        for run in runs:
+            peaks = ", ".join([f"{channel['name']} {channel['peak']:.2f}" for channel in catalog.channels(run['id']) if channel['peak'] != None])
+            duration = f"{run['duration']:.1f}" if run['duration'] != None else "-"
+            print(f"{run['id']:>5}  {run['runNumber']:>5}  {run['started'] or '-':19}  {run['rows'] or 0:>9}  {duration:>8}  {peaks}  {run['path']}")
+
+    elif args.command == 'show':
+        runs = [dict(row) for row in catalog.db.execute("SELECT * FROM runs WHERE id = ?", (args.id,))]
+        if len(runs) == 0:
+            print(f"ERROR: There is no run with id {args.id}")
+            return 1
+        run = dict(runs[0], sensors=json.loads(runs[0]['sensors']), columns=json.loads(runs[0]['columns']))
+        print(json.dumps(dict(run, channels=catalog.channels(args.id)), indent=4))
+
+if __name__ == "__main__":
+    sys.exit(main())
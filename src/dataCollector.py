@@ -1,7 +1,12 @@
 import time
-import RPi.GPIO as gpio
-import cProfile
-from line_profiler import profile
+import numpy as np
+
+from src.metrics import metricSet, histogram, latencyBuckets
+from src.scheduler import deadlineScheduler, sleepUntil
+from src.settings import sensorRates, sensorSettings
+from src.filters import filterChain
+from src.acquisition import parallelAcquisition, timeOrder, blockRows
+from src.trigger import triggeredCapture
 
 class dataCollector:
     """This class facilitates the reading of sensors when requested. Its been seperated from the
@@ -16,19 +21,57 @@ class dataCollector:
             The multiprocessing.Queue assigned to store sensor data
         commandPipe:
             Pipe used to recieve collect, stop, and shutdown commands
+        ringBuffer:
+            Optional src.ringBuffer.sharedRingBuffer, if provided rows are written to shared memory instead of
+            being put into the dataQueue
+        dataReady:
+            Optional src.ipc.dataReadySignal, notified whenever new rows have been written
+
+    The process never polls: while idle it blocks on the commandPipe, and while reading, the wait for the
+    next sensor deadline is a wait on the commandPipe, so commands are handled as soon as they arrive.
+
+    Each sensor is read on its own absolute deadlines (see src.scheduler.deadlineScheduler), at the rate given
+    by src.settings.sensorRates. Sensors that are due at the same time share a row, and a sensor that was not
+    due has NaN in its column, the consumers of the stream align it (see src.alignment). Every value read runs
+    through the sensor's filter chain (see src.filters), a sensor with decimating filters is read that many
+    times faster than its rate, and rows where no sensor produced an output are not emitted. Sensors with a
+    readBlock() method and a blockSize above 1 in their sensorSettings are read blockSize samples at a time on a
+    schedule of rate / blockSize, and their samples are written as a block of rows of their own (not shared with
+    other sensors), stamped with the times the sensor reports. Rows are then held until every sensor has read
+    past them, so they are written in time order (see src.acquisition.timeOrder). When a run is stopped the
+    timing statistics of each sensor are sent back through the commandPipe as ("timing", statsDict).
+
+    With acquisition: parallel in config.yaml each sensor is read by its own thread instead (see
+    src.acquisition.parallelAcquisition), so sensors that block until they have data wait at the same time and
+    the row rate no longer drops as sensors are added. The process then only waits for commands. In both modes the
+    spread of the read times within each row is reported as the skew between channels in the timing statistics.
+
+    With capture: triggered in config.yaml the rows are held in a bounded pre-trigger buffer until the trigger
+    condition fires (see src.trigger.triggeredCapture), and only the rows around each trigger are passed on.
+    Each capture is sent through the commandPipe as ("capture", captureDict) when it starts (with 'end' None)
+    and again when it ends.
     
     Generalized Output:
         val: int, or float
-            Raw sensor value, val is not directly returned, but instead put into the dataQueue
+            Raw sensor value, val is not directly returned, but instead put into the dataQueue or ringBuffer.
+            Values are never converted here, conversion to units is done on whole blocks by the consumers
+            (see src.calibration).
             
     """
 
-    def __init__(self, sensors, dataQueue, commandPipe, settingsDict):
+    def __init__(self, sensors, dataQueue, commandPipe, settingsDict, ringBuffer=None, dataReady=None):
 
         self.sensors = sensors
         self.dataQueue = dataQueue
+        self.ringBuffer = ringBuffer
+        self.dataReady = dataReady
         self.commandPipe = commandPipe
         self.settingsDict = settingsDict
+        self.metrics = metricSet(settingsDict.get('metrics', False))
+        self.acquisition = None
+        self.capture = None
+        self.order = None
+        self.skew = histogram(latencyBuckets)
         
         # Set the max read frequency
         self.setMaxReadFrequency()
@@ -39,18 +82,52 @@ class dataCollector:
         self.newCmd = None
 
     def setMaxReadFrequency(self):
-        # Get the sample rate, if none is provided use the slowest sensor as the maximum sample rate
-        if self.settingsDict['sampleRate'] == None:
-            maxReadFrequency = []
-            for sensor in self.sensors:
-                maxReadFrequency += [sensor.maxReadFrequency]
-            maxReadFrequency = min(maxReadFrequency)
+        """Create one filter chain and deadline scheduler per sensor, so fast sensors are not throttled by slow ones"""
+
+        self.filterChains = [filterChain(sensorSettings(self.settingsDict, sensor).get('filters', getattr(sensor, 'filters', [])))
+                             for sensor in self.sensors]
+
+        self.readFrequencies = [rate * chain.oversampling for rate, chain in
+                                zip(sensorRates(self.settingsDict, self.sensors), self.filterChains)]
+        self.maxReadFrequency = max(self.readFrequencies + [0])
+        self.spinWait = int(self.settingsDict.get('spinWait', 0.0005) * 1e9)
+
+        # Samples per readBlock() call, None for sensors read one value at a time with read(). Blocks are only
+        # read when asked for in sensorSettings, block rows aren't shared with other sensors.
+        self.blockSizes = []
+        for sensor in self.sensors:
+            blockSize = int(sensorSettings(self.settingsDict, sensor).get('blockSize', 1))
+            self.blockSizes += [blockSize if blockSize > 1 and hasattr(sensor, 'readBlock') else None]
+
+        self.schedulers = [deadlineScheduler(frequency / (blockSize or 1), 0, self.settingsDict.get('missedDeadlines', 'skip') == 'catchUp')
+                           for frequency, blockSize in zip(self.readFrequencies, self.blockSizes)]
+
+    def timingStats(self):
+        """Timing statistics of the current run for each sensor"""
+
+        stats = {'sensors': []}
+        for sensor, scheduler, blockSize in zip(self.sensors, self.schedulers, self.blockSizes):
+            stats['sensors'] += [dict(name=sensor.name, **scheduler.stats())]
+            if blockSize != None: # The scheduler's rate is in blocks
+                stats['sensors'][-1]['blockSize'] = blockSize
+
+        if self.acquisition != None:
+            stats['skew'] = self.acquisition.skewStats()
         else:
-            if isinstance(self.settingsDict['sampleRate'], (float, int)):
-                maxReadFrequency = self.settingsDict['sampleRate']
-            else:
-                print(f"ERROR: Bad sampleRate value in config.yaml, must be of type int or float.")
-        self.maxReadFrequency = maxReadFrequency
+            stats['skew'] = self.skew.summary()
+            del stats['skew']['buckets']
+        stats['skew']['mode'] = self.settingsDict.get('acquisition', 'sequential')
+
+        if self.capture != None:
+            stats['captures'] = self.capture.captures
+
+        return stats
+
+    def metricsSnapshot(self):
+        """Metrics of the current run, sent to the main process"""
+
+        self.metrics.counters['missedDeadlines'] = sum([int(scheduler.missedDeadlines) for scheduler in self.schedulers])
+        return self.metrics.snapshot()
 
     def setSettingsDict(self, settingsDict):
         """Setter method for settings dictionary. Used to update the settings used to collect
@@ -58,6 +135,7 @@ class dataCollector:
         NOTE: This is only safe to use when the system is not collecting data, and this class
          is not responsible for formatting column names/table data."""
         self.settingsDict = settingsDict
+        self.metrics.enabled = settingsDict.get('metrics', False)
 
     def setSensors(self, sensors):
         """Setter method for sensor object. Used to update the selected sensors
@@ -68,6 +146,14 @@ class dataCollector:
         for sensor in self.sensors:
             sensor.initInProcess()
 
+    def setRingBuffer(self, ringBuffer):
+        """Setter method for the shared memory ring buffer, None switches back to the dataQueue.
+        NOTE: This is only safe to use when the system is not collecting data. """
+        if self.ringBuffer != None:
+            self.ringBuffer.close()
+
+        self.ringBuffer = ringBuffer
+
     def mainLoop(self):
         """At this point, this class becomes a process, and initialization functions that
         should be run in the new process should be called now."""
@@ -77,16 +163,51 @@ class dataCollector:
 
         while not self.shutDown:
 
+            if self.beginRead and self.acquisition == None:
+                self.collectData() # Returns early if a command arrives while waiting for the next deadline
+            else:
+                self.commandPipe.poll(None) # Nothing to do until the next command, or the sensor threads are reading
+
             if self.commandPipe.poll():
                 self.newCmd = self.commandPipe.recv()
 
             # Use if instead of match due to python 3.9.2
             if self.newCmd == "read":
-                self.startTime = time.time()
+                self.setMaxReadFrequency() # Settings or sensors may have changed since the last run
+                for sensor in self.sensors:
+                    if hasattr(sensor, 'startRun'):
+                        sensor.startRun()
+                self.startTime = time.perf_counter_ns()
+                for scheduler in self.schedulers:
+                    scheduler.start(self.startTime)
+                self.metrics.reset()
+                self.lastRowTime = None
+                self.lastMetricsSent = self.startTime
+                self.skew = histogram(latencyBuckets)
+                self.capture = triggeredCapture.fromSettings(self.settingsDict, self.sensors, sum(self.readFrequencies))
+                self.acquisition = None
+                self.order = timeOrder(len(self.sensors) + 1) if any([blockSize != None for blockSize in self.blockSizes]) else None
+                if self.settingsDict.get('acquisition', 'sequential') == 'parallel':
+                    self.acquisition = parallelAcquisition(self.sensors, self.schedulers, self.filterChains,
+                                                           self.startTime, self.writeRow, self.metrics,
+                                                           blockSizes=self.blockSizes, emitRows=self.writeRows)
+                    self.acquisition.start()
                 self.beginRead = True
 
             if self.newCmd == "stop":
                 self.beginRead = False
+                if self.acquisition != None:
+                    self.acquisition.stop() # The threads are done with the commandPipe before anything else is sent
+                elif self.order != None:
+                    rows = self.order.flush()
+                    if len(rows) > 0:
+                        self.writeRows(rows, time.perf_counter_ns())
+                finished = self.capture.stop() if self.capture != None else None
+                if finished != None:
+                    self.commandPipe.send(("capture", finished))
+                if self.metrics.enabled:
+                    self.commandPipe.send(("metrics", self.metricsSnapshot()))
+                self.commandPipe.send(("timing", self.timingStats()))
 
             if self.newCmd == "off":
                 self.shutDown = True
@@ -98,24 +219,137 @@ class dataCollector:
             if self.newCmd == "set settings":
                 self.setSettingsDict(self.commandPipe.recv())
 
+            if self.newCmd == "set buffer":
+                self.setRingBuffer(self.commandPipe.recv())
+
             self.newCmd = None # Makes each of these cases run once uppon recieving a new command
 
-            if self.beginRead:
-                self.collectData()
+    def collectData(self):
+        """Wait for the earliest sensor deadline and read every sensor that is due"""
+
+        if not sleepUntil(min([scheduler.nextDeadline for scheduler in self.schedulers]), self.spinWait, self.commandPipe.poll):
+            return # A command arrived first
+
+        now = time.perf_counter_ns()
+
+        data = [(now - self.startTime) / 1e9]
+        stamps = []
+        blocks = []
+        for index, (sensor, scheduler, chain, blockSize) in enumerate(zip(self.sensors, self.schedulers, self.filterChains, self.blockSizes)):
+            if scheduler.nextDeadline > now: # Not due, the consumers fill the gap
+                data += [float("nan")]
+                continue
+
+            scheduler.fire(now)
+            if blockSize != None: # Its samples get rows of their own
+                blocks += [self.readBlock(index, blockSize, scheduler.nextDeadline - scheduler.period)]
+                data += [float("nan")]
                 continue
+
+            if self.metrics.enabled:
+                readStart = time.perf_counter_ns()
+                raw = sensor.read()
+                readTime = (time.perf_counter_ns() - readStart) / 1e9
+                self.metrics.observe('sensorRead', readTime)
+                self.metrics.observe('sensorRead.' + sensor.name, readTime)
+                if raw != raw: # NaN
+                    self.metrics.count('failedReads')
             else:
-                time.sleep(0.1) # Check if we should be reading sensors every tenth of a second
+                raw = sensor.read()
 
-    @profile
-    def collectData(self):
-        data = [time.time() - self.startTime]
-        for sensor in self.sensors:
-            # Convert if requested, default to storing raw values
-            if self.settingsDict['convert'] == True:
-                data += [sensor.convert(sensor.read())]
+            val = chain.process(raw)
+            if val == None: # The filters are holding this value back (e.g. decimation)
+                data += [float("nan")]
             else:
-                data += [sensor.read()]
+                data += [val]
+                stamps += [time.perf_counter_ns()]
+
+        if len(stamps) > 1: # Sensors in a row are read one after another
+            self.skew.record((stamps[-1] - stamps[0]) / 1e9)
+
+        if self.order != None: # Block samples are stamped by their sensor, rows are put back in time order
+            for rows in blocks + ([data] if len(stamps) > 0 else []):
+                self.order.add(rows)
+            rows = self.order.release((min([scheduler.nextDeadline for scheduler in self.schedulers]) - self.startTime) / 1e9)
+            if len(rows) > 0:
+                self.writeRows(rows, now)
+            return
+
+        if len(stamps) == 0:
+            return
+
+        self.writeRow(data, now)
+
+    def readBlock(self, index, blockSize, deadline):
+        """Read blockSize samples from a sensor with readBlock(), returns them as rows"""
+
+        sensor = self.sensors[index]
+        readStart = time.perf_counter_ns()
+        values, times = sensor.readBlock(blockSize, self.schedulers[index].period // blockSize, deadline)
+        if self.metrics.enabled:
+            readTime = (time.perf_counter_ns() - readStart) / 1e9
+            self.metrics.observe('sensorRead', readTime)
+            self.metrics.observe('sensorRead.' + sensor.name, readTime)
+            self.metrics.count('failedReads', int(np.isnan(values).sum()))
+
+        return blockRows(values, times, self.filterChains[index], index + 1, len(self.sensors) + 1, self.startTime)
+
+    def writeRow(self, data, now):
+        """Pass a row on to the main process, now is the perf_counter_ns() time it was read. With triggered
+        capture the row may be held back, or passed on together with the pre-trigger rows."""
+
+        if self.capture == None:
+            if self.ringBuffer != None:
+                self.ringBuffer.write(data)
+            else:
+                self.dataQueue.put(data)
+            written = True
+        else:
+            rows = self.capture.process(data)
+            written = len(rows) > 0
+            if written and self.ringBuffer != None:
+                self.ringBuffer.write(rows)
+            elif written:
+                for row in rows.tolist():
+                    self.dataQueue.put(row)
+
+            if self.capture.started != None:
+                self.commandPipe.send(("capture", self.capture.started))
+            if self.capture.finished != None:
+                self.commandPipe.send(("capture", self.capture.finished))
+
+        self.rowsWritten(written, 1, now)
+
+    def writeRows(self, rows, now):
+        """Pass a 2D block of rows on to the main process in one write"""
+
+        if self.capture != None: # The capture looks at every row
+            for row in rows:
+                self.writeRow(row, now)
+            return
+
+        if self.ringBuffer != None:
+            self.ringBuffer.write(rows)
+        else:
+            for row in rows.tolist():
+                self.dataQueue.put(row)
+
+        self.rowsWritten(True, len(rows), now)
+
+    def rowsWritten(self, written, count, now):
+        """Wake up the main process and record metrics after rows were passed on"""
+
+        if written and self.dataReady != None:
+            self.dataReady.notify()
+
+        if self.metrics.enabled:
+            self.metrics.count('rows', count)
+            if self.lastRowTime != None:
+                self.metrics.observe('loopInterval', (now - self.lastRowTime) / 1e9)
+            self.lastRowTime = now
 
-        self.dataQueue.put(data)
-        time.sleep(1 / self.maxReadFrequency)
+            # Live metrics for the GUI status line, once a second
+            if now - self.lastMetricsSent >= 1e9:
+                self.commandPipe.send(("metrics", self.metricsSnapshot()))
+                self.lastMetricsSent = now
 
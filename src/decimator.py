@@ -0,0 +1,99 @@
+"""Min/max decimation of a whole run into a fixed number of plot buckets"""
+import numpy as np
+
+class minMaxDecimator:
+    """Keeps the minimum and maximum of every column over buckets of rows covering the whole run, so a plot of
+    a long run still shows its peaks and spikes. Bucket size starts at one row and doubles (neighbouring
+    buckets are merged) whenever the run no longer fits, so memory and the work per frame only depend on the
+    number of buckets.
+
+    Input:
+        buckets:
+            Number of buckets kept, each one is plotted as two points (min and max)
+        nColumns:
+            Number of columns in each row, including time in column 0"""
+
+    def __init__(self, buckets, nColumns):
+        self.buckets = buckets
+        self.nColumns = nColumns
+        self.reset()
+
+    def reset(self):
+        self.bucketSize = 1 # Rows per bucket
+        self.filled = 0 # Number of complete buckets
+        self.mins = np.empty((self.buckets, self.nColumns))
+        self.maxs = np.empty((self.buckets, self.nColumns))
+
+        # Bucket being filled
+        self.partialMin = None
+        self.partialMax = None
+        self.partialRows = 0
+
+        self.rows = 0
+
+    def add(self, rows):
+        """Add a block of rows, O(len(rows)) with no per row Python work"""
+
+        rows = np.asarray(rows, dtype=np.float64)
+        self.rows += len(rows)
+
+        while len(rows) > 0:
+            if self.partialRows == 0 and len(rows) >= self.bucketSize:
+                # Whole buckets at once, limited to the free space so merging happens at the right time
+                count = min(len(rows) // self.bucketSize, self.buckets - self.filled)
+                whole = rows[:count * self.bucketSize].reshape(count, self.bucketSize, self.nColumns)
+                self.mins[self.filled:self.filled + count] = np.fmin.reduce(whole, axis=1)
+                self.maxs[self.filled:self.filled + count] = np.fmax.reduce(whole, axis=1)
+                self.filled += count
+                rows = rows[count * self.bucketSize:]
+            else:
+                take = min(self.bucketSize - self.partialRows, len(rows))
+                blockMin = np.fmin.reduce(rows[:take], axis=0)
+                blockMax = np.fmax.reduce(rows[:take], axis=0)
+                if self.partialRows == 0:
+                    self.partialMin, self.partialMax = blockMin, blockMax
+                else:
+                    self.partialMin = np.fmin(self.partialMin, blockMin)
+                    self.partialMax = np.fmax(self.partialMax, blockMax)
+                self.partialRows += take
+                rows = rows[take:]
+
+                if self.partialRows == self.bucketSize:
+                    self.mins[self.filled] = self.partialMin
+                    self.maxs[self.filled] = self.partialMax
+                    self.filled += 1
+                    self.partialRows = 0
+
+            if self.filled == self.buckets:
+                self.merge()
+
+    def merge(self):
+        """Combine neighbouring buckets, halving the number of buckets and doubling their size"""
+
+        half = self.filled // 2
+        self.mins[:half] = np.fmin(self.mins[0:2 * half:2], self.mins[1:2 * half:2])
+        self.maxs[:half] = np.fmax(self.maxs[0:2 * half:2], self.maxs[1:2 * half:2])
+
+        if self.filled % 2: # An odd bucket out becomes the start of the partial bucket
+            oddMin, oddMax = self.mins[self.filled - 1].copy(), self.maxs[self.filled - 1].copy()
+            if self.partialRows > 0:
+                oddMin, oddMax = np.fmin(oddMin, self.partialMin), np.fmax(oddMax, self.partialMax)
+            self.partialMin, self.partialMax = oddMin, oddMax
+            self.partialRows += self.bucketSize
+
+        self.filled = half
+        self.bucketSize *= 2
+
+    def series(self):
+        """Plot series, one list per sensor column, alternating the min and max of each bucket in time order.
+        The partial bucket is included so the newest rows are always shown."""
+
+        mins, maxs = self.mins[:self.filled], self.maxs[:self.filled]
+        if self.partialRows > 0:
+            mins = np.vstack((mins, self.partialMin))
+            maxs = np.vstack((maxs, self.partialMax))
+
+        points = np.empty((2 * len(mins), self.nColumns - 1))
+        points[0::2] = mins[:, 1:]
+        points[1::2] = maxs[:, 1:]
+        return points.T.tolist()
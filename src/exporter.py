@@ -0,0 +1,80 @@
+"""Exports finished binary runs to csv in the background, so stopping a run never waits on slow USB storage."""
+import os
+import time
+import queue
+import threading
+
+from src.runFormat import exportCSV
+
+class exportWorker:
+    """Background thread that exports runs one at a time, in the order they were submitted. The next run can be
+    collected while earlier ones are still exporting.
+
+    Input:
+        notify:
+            Called with a status dictionary when an export is queued (by submit's caller), starts, makes
+            progress (at most every progressInterval seconds), finishes or fails (by the worker thread):
+                {'run': run file name, 'state': 'queued', 'exporting', 'done' or 'failed', 'fraction': 0 to 1,
+                 'queued': exports waiting to start, 'path': csv path when done, 'error': text when failed}
+        progressInterval:
+            Minimum seconds between progress updates
+        maxHeldRuns:
+            In-memory runs (src.runBuffer.runBuffer) held by queued and running exports. Runs submitted beyond
+            that are exported from their file, so the memory held doesn't grow with the queue."""
+
+    def __init__(self, notify, progressInterval=0.25, maxHeldRuns=1):
+        self.notify = notify
+        self.progressInterval = progressInterval
+        self.maxHeldRuns = maxHeldRuns
+        self.heldRuns = 0
+        self.lock = threading.Lock()
+        self.jobs = queue.Queue()
+        self.thread = threading.Thread(target=self.exportLoop, daemon=True)
+        self.thread.start()
+
+    def submit(self, runPath, converter=None, compress=False, rows=None):
+        """Queue a run to be exported next to it as .csv (or .csv.gz), see src.runFormat.exportCSV. rows is the
+        run's src.runBuffer.runBuffer when it is still in memory, it is released once the export is done."""
+
+        with self.lock:
+            if rows != None and self.heldRuns >= self.maxHeldRuns:
+                rows = None # Read back from the file instead
+            elif rows != None:
+                self.heldRuns += 1
+
+        self.jobs.put((runPath, converter, compress, rows))
+        self.notify(self.status(runPath, 'queued', 0.0))
+
+    def pending(self):
+        """Number of runs waiting to be exported, not counting the one being exported"""
+        return self.jobs.qsize()
+
+    def status(self, runPath, state, fraction, **extra):
+        return dict(run=os.path.basename(runPath), state=state, fraction=fraction, queued=self.pending(), **extra)
+
+    def exportLoop(self):
+        while True:
+            runPath, converter, compress, rows = self.jobs.get()
+            self.notify(self.status(runPath, 'exporting', 0.0))
+
+            lastUpdate = time.monotonic()
+            def progress(rowsWritten, rowCount):
+                nonlocal lastUpdate
+                now = time.monotonic()
+                if now - lastUpdate >= self.progressInterval:
+                    lastUpdate = now
+                    self.notify(self.status(runPath, 'exporting', rowsWritten / rowCount))
+
+            try:
+                csvPath = exportCSV(runPath, converter=converter, compress=compress, progress=progress, rows=rows)
+            except Exception as error: # e.g. the flash drive was removed or the run is malformed, the next runs are still exported
+                print(f"ERROR: Failed to export {runPath}: {type(error).__name__}: {error}")
+                self.notify(self.status(runPath, 'failed', 0.0, error=str(error)))
+                continue
+            finally:
+                if rows != None:
+                    with self.lock:
+                        self.heldRuns -= 1
+                rows = None # Free the run's memory instead of holding it until the next export
+
+            self.notify(self.status(runPath, 'done', 1.0, path=csvPath))
@@ -0,0 +1,291 @@
+"""Streaming filters for sensor values, declared per sensor in config.yaml:
+
+    sensorSettings:
+      hx711LoadCell:
+        filters:
+        - {type: despike, threshold: 300000, jumpThreshold: 500000, jumpGain: 0.05}
+        - {type: lowPass, alpha: 0.3}
+
+Every stage can be used two ways, with the same results:
+    process(value)          One value at a time with O(1) work, used by the data collector. Returns None when
+                            the stage has no output for this value (see delays below).
+    processBlock(values)    A numpy array at a time, used to re-filter stored raw runs. Returns an array of the
+                            same length with NaN wherever process() would have returned None or NaN.
+Block mode carries the same state as streaming mode, so a stream can be split into blocks anywhere. Results
+match exactly for despike and decimate, and to floating point rounding for lowPass and movingAverage.
+
+NaN input (a failed read) is passed through as NaN and leaves the stage's state unchanged.
+
+Stages:
+    despike         Median of 3 style spike removal. A value that jumps more than threshold away from both of
+                    its neighbours is replaced by their mean. Optionally, a value that jumps more than
+                    jumpThreshold from the previous value is pulled towards it by jumpGain. The output is delayed
+                    by one sample, since a value is only final once the next one is known.
+    lowPass         Exponential low pass, y += alpha * (x - y)
+    movingAverage   Mean of the last window values
+    decimate        Mean of every factor values, outputs once per factor inputs. The data collector reads the
+                    sensor factor times faster than its sampleRate to make up for it (oversampling).
+"""
+import numpy as np
+
+from collections import deque
+
+class filterStage:
+    """Base class, handles NaN values so stages only implement the NaN free case"""
+
+    def process(self, value):
+        if value != value: # NaN
+            return value
+        return self.processValue(float(value))
+
+    def processBlock(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        out = np.full(len(values), np.nan)
+        valid = ~np.isnan(values)
+        if valid.any():
+            out[valid] = self.processValues(values[valid])
+        return out
+
+    def reset(self):
+        pass
+
+class despike(filterStage):
+
+    def __init__(self, threshold=300000, jumpThreshold=None, jumpGain=0.05):
+        self.threshold = threshold
+        self.jumpThreshold = jumpThreshold
+        self.jumpGain = jumpGain
+        self.reset()
+
+    def reset(self):
+        self.previous = None # Last output value
+        self.pending = None # Value waiting for its right hand neighbour
+
+    def rule(self, left, middle, right):
+        """Filtered value of middle given its neighbours"""
+
+        if abs(left - middle) > self.threshold and abs(middle - right) > self.threshold:
+            return (left + right) / 2
+
+        if self.jumpThreshold != None and abs(left - middle) > self.jumpThreshold:
+            return left + self.jumpGain * (middle - left)
+
+        return middle
+
+    def processValue(self, value):
+        if self.pending == None:
+            self.pending = value
+            return None
+
+        middle = self.pending
+        if self.previous != None:
+            middle = self.rule(self.previous, middle, value)
+
+        self.previous = middle
+        self.pending = value
+        return middle
+
+    def processValues(self, values):
+        out = np.full(len(values), np.nan)
+
+        start = 0
+        if self.pending == None: # The very first value has no output
+            self.pending = values[0]
+            start = 1
+
+        # z[i] is finalized once z[i + 1] is known, the last value stays pending
+        z = np.concatenate(([self.pending], values[start:]))
+        y = z.copy()
+
+        # Only values that jump away from their left neighbour can change, the rest are copied through.
+        # A changed value changes the left neighbour of the next one, so that one is checked too.
+        limit = self.threshold if self.jumpThreshold == None else min(self.threshold, self.jumpThreshold)
+        firstLeft = np.nan if self.previous == None else self.previous # NaN never counts as a jump
+        left = np.concatenate(([firstLeft], z[:-2]))
+        candidates = np.flatnonzero(np.abs(left - z[:-1]) > limit)
+
+        i = candidates[0] if len(candidates) > 0 else None
+        while i != None:
+            leftValue = self.previous if i == 0 else y[i - 1]
+            y[i] = self.rule(leftValue, z[i], z[i + 1])
+
+            position = np.searchsorted(candidates, i + 1)
+            if y[i] != z[i] and i + 1 < len(z) - 1:
+                i = i + 1
+            elif position < len(candidates):
+                i = candidates[position]
+            else:
+                i = None
+
+        if len(z) > 1:
+            self.previous = y[-2]
+        self.pending = z[-1]
+
+        out[start:] = y[:-1]
+        return out
+
+class lowPass(filterStage):
+
+    chunk = 64 # Block mode solves the recursion in chunks of this many values with a matrix product
+
+    def __init__(self, alpha=0.1):
+        if not 0 < alpha <= 1:
+            raise ValueError("lowPass alpha must be in (0, 1]")
+        self.alpha = alpha
+        self.reset()
+
+        # y[k] = decay[k] * y[-1] + sum_j weights[k, j] * x[j] within a chunk
+        k = np.arange(lowPass.chunk)
+        powers = (1 - alpha) ** np.clip(k[:, None] - k[None, :], 0, None)
+        self.weights = np.where(k[:, None] >= k[None, :], alpha * powers, 0.0)
+        self.decay = (1 - alpha) ** (k + 1)
+
+    def reset(self):
+        self.state = None
+
+    def processValue(self, value):
+        if self.state == None:
+            self.state = value
+        else:
+            self.state += self.alpha * (value - self.state)
+        return self.state
+
+    def processValues(self, values):
+        out = np.empty(len(values))
+        start = 0
+        if self.state == None:
+            self.state = values[0]
+            out[0] = values[0]
+            start = 1
+
+        for chunkStart in range(start, len(values), lowPass.chunk):
+            x = values[chunkStart:chunkStart + lowPass.chunk]
+            n = len(x)
+            y = self.weights[:n, :n] @ x + self.decay[:n] * self.state
+            out[chunkStart:chunkStart + n] = y
+            self.state = y[-1]
+
+        return out
+
+class movingAverage(filterStage):
+
+    def __init__(self, window=5):
+        self.window = int(window)
+        self.reset()
+
+    def reset(self):
+        self.history = deque(maxlen=self.window)
+        self.total = 0.0
+        self.count = 0
+
+    def processValue(self, value):
+        if len(self.history) == self.window:
+            self.total -= self.history[0]
+        self.history.append(value)
+        self.total += value
+
+        # Recompute the sum now and then so rounding errors don't build up over long runs
+        self.count += 1
+        if self.count % (self.window * 1000) == 0:
+            self.total = sum(self.history)
+
+        return self.total / len(self.history)
+
+    def processValues(self, values):
+        history = np.array(self.history, dtype=np.float64)
+        series = np.concatenate((history, values))
+        sums = np.concatenate(([0.0], np.cumsum(series)))
+
+        end = np.arange(len(history) + 1, len(series) + 1)
+        begin = np.maximum(end - self.window, 0)
+        out = (sums[end] - sums[begin]) / (end - begin)
+
+        self.history.extend(values[-self.window:])
+        self.total = float(sum(self.history))
+        self.count += len(values)
+        return out
+
+class decimate(filterStage):
+
+    def __init__(self, factor=4):
+        self.factor = int(factor)
+        self.reset()
+
+    def reset(self):
+        self.total = 0.0
+        self.count = 0
+
+    def processValue(self, value):
+        self.total += value
+        self.count += 1
+        if self.count < self.factor:
+            return None
+
+        mean = self.total / self.factor
+        self.reset()
+        return mean
+
+    def processValues(self, values):
+        out = np.full(len(values), np.nan)
+
+        # Finish the group started by earlier values
+        first = min(self.factor - self.count, len(values))
+        self.total += float(np.sum(values[:first]))
+        self.count += first
+        if self.count == self.factor:
+            out[first - 1] = self.total / self.factor
+            self.reset()
+
+        rest = values[first:]
+        whole = len(rest) // self.factor * self.factor
+        if whole > 0:
+            out[first + self.factor - 1:first + whole:self.factor] = rest[:whole].reshape(-1, self.factor).mean(axis=1)
+
+        for value in rest[whole:]:
+            self.total += value
+            self.count += 1
+
+        return out
+
+stageTypes = {'despike': despike, 'lowPass': lowPass, 'movingAverage': movingAverage, 'decimate': decimate}
+
+class filterChain:
+    """Runs a value through several stages in order.
+    Input:
+        specs:
+            List of dictionaries, each with a 'type' from stageTypes and that stage's parameters"""
+
+    def __init__(self, specs=None):
+        self.specs = specs or []
+        self.stages = []
+        for spec in self.specs:
+            spec = dict(spec)
+            kind = spec.pop('type')
+            if kind not in stageTypes:
+                raise ValueError(f"Unknown filter type '{kind}', options are {list(stageTypes)}")
+            self.stages += [stageTypes[kind](**spec)]
+
+        # Total decimation, the sensor has to be read this many times faster than its output rate
+        self.oversampling = 1
+        for stage in self.stages:
+            if isinstance(stage, decimate):
+                self.oversampling *= stage.factor
+
+    def process(self, value):
+        """Filter one value, returns None if the chain has no output for it"""
+        for stage in self.stages:
+            value = stage.process(value)
+            if value == None:
+                return None
+        return value
+
+    def processBlock(self, values):
+        """Filter an array of values, NaN where process() would have returned None"""
+        values = np.asarray(values, dtype=np.float64)
+        for stage in self.stages:
+            values = stage.processBlock(values)
+        return values
+
+    def reset(self):
+        for stage in self.stages:
+            stage.reset()
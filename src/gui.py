@@ -2,22 +2,62 @@ import asciichartpy as acp
 import time
 import numpy as np
 import os
+import sys
 import subprocess
 
+from src.decimator import minMaxDecimator
+from src.metrics import metricSet, statusLine
+
 class GUI:
-    """Class responsbile for creating and managing the terminal GUI"""
+    """Class responsbile for creating and managing the terminal GUI
+
+    The main process only sends rows the GUI has not seen yet, as ("rows", runNumber, startRow, block) messages
+    on the dataQueue. startRow is the index of the first row of block within the run, so rows the main process
+    skipped (because they would scroll off the plot before being drawn) show up as a gap in the row numbers.
+
+    Frames are drawn at most guiFPS times a second. Only the lines that changed since the last frame are
+    rewritten, using ANSI cursor positioning, and the header (IP address and user) is cached and only looked
+    up again every headerRefresh seconds.
+
+    With plotMode 'window' the plot scrolls through the last plotPoints rows. With plotMode 'overview' it
+    shows the whole run, decimated to plotPoints // 2 min/max buckets (see src.decimator), so the peak and
+    break of a long pull stay visible. The main process has to send every row in overview mode."""
 
-    def __init__(self, pipeConnection, dataQueue, sensors):
+    plotPoints = 125 # Number of samples shown in the plot window
+
+    def __init__(self, pipeConnection, dataQueue, sensors, settingsDict=None):
         self.pipeConnection = pipeConnection
         self.dataQueue = dataQueue
         self.sensors = sensors
+        self.metrics = metricSet()
+        self.processMetrics = {} # Latest metrics of the main and data collector processes
+        self.setSettingsDict(settingsDict or {})
         self.refresh = False # Controls if entire GUI is updated continuosly
         self.runNumber = 0
+        self.nextRunNumber = 1 # Set by the main process from the run catalog
+        self.exports = {} # Run file name -> latest status from src.exporter.exportWorker
+        self.captures = [] # Finished triggered captures of the current run
+        self.capturing = None # Triggered capture in progress
+        self.runStats = None # Latest src.runStats summary of the current (or last) run
+        self.redraw = False # Draw a frame as soon as possible, even while no run is displayed
 
         self.startTime = None
         self.newCmd = None
 
-        self.data = None
+        # Bounded plot window, only the last plotPoints rows of the current run are kept
+        self.window = None
+        self.overview = None # minMaxDecimator of the whole run, only used with plotMode 'overview'
+        self.nextRow = 0 # Index of the row expected next from the main process
+        self.skippedRows = 0 # Rows the main process didn't send because they'd scroll off the plot before being drawn
+
+        # Renderer state
+        self.header = None
+        self.headerTime = None
+        self.lastFrame = [] # Lines currently on screen
+        self.frameTime = 0.0 # Seconds spent building and writing the last frame
+        self.frameTimeMax = 0.0 # Slowest frame and frames over budget in the current run
+        self.framesOverBudget = 0
+
         self.config = {'colors': [acp.red, acp.green, acp.yellow, acp.blue,  # All colors available to asciichartpy
                      acp.magenta, acp.cyan, acp.lightgray, acp.default,
                      acp.darkgray, acp.lightred, acp.lightgreen, acp.lightyellow,
@@ -29,13 +69,25 @@ class GUI:
         self.drawGUI()
         
     def mainLoop(self):
+        """Blocks on the command pipe until either a command arrives or the next frame is due. While no run is
+        displayed a frame is only drawn when the header is due to be refreshed."""
         
         self.on = True
+        nextFrame = time.monotonic()
         while self.on:
+            if self.refresh:
+                timeout = max(0, nextFrame - time.monotonic())
+            else:
+                timeout = max(0, self.headerTime + self.headerRefresh - time.monotonic())
+            self.pipeConnection.poll(timeout)
+
             self.recieveCommand()
 
-            if self.refresh:
+            now = time.monotonic()
+            if (self.refresh and now >= nextFrame) or self.redraw or now >= self.headerTime + self.headerRefresh:
+                self.redraw = False
                 self.drawGUI()
+                nextFrame = max(nextFrame + self.frameInterval, now)
 
     def recieveCommand(self):
 
@@ -46,7 +98,19 @@ class GUI:
             if self.startTime == None:
                 self.startTime = time.time()
                 self.refresh = True
-                self.runNumber += 1
+                self.runNumber = self.nextRunNumber
+                self.nextRunNumber += 1
+                self.window = None
+                self.overview = None
+                self.metrics.reset()
+                self.processMetrics = {}
+                self.nextRow = 0
+                self.skippedRows = 0
+                self.frameTimeMax = 0.0
+                self.framesOverBudget = 0
+                self.captures = []
+                self.capturing = None
+                self.runStats = None
 
             self.read()
 
@@ -56,11 +120,30 @@ class GUI:
             self.refresh = False
             self.startTime = None
             self.newCmd = None
+            if self.metrics.enabled:
+                self.pipeConnection.send(("metrics", self.metrics.snapshot()))
 
         if self.newCmd == "set sensors":
             self.setSensors(self.pipeConnection.recv())
             self.newCmd = None
 
+        if self.newCmd == "set run number":
+            self.nextRunNumber = self.pipeConnection.recv()
+            self.newCmd = None
+
+        if self.newCmd == "set settings":
+            self.setSettingsDict(self.pipeConnection.recv())
+            self.newCmd = None
+
+        if self.newCmd == "stats":
+            self.runStats = self.pipeConnection.recv()
+            self.redraw = True
+            self.newCmd = "read" if self.startTime != None else None
+
+        if self.newCmd == "export":
+            self.setExportStatus(self.pipeConnection.recv())
+            self.newCmd = "read" if self.startTime != None else None # Exports of earlier runs finish during the next one
+
         if self.newCmd == "off":
             self.on = False
             self.newCmd = None
@@ -71,61 +154,207 @@ class GUI:
         NOTE: This is only safe to use when the system is not collecting data. """
         self.sensors = sensors
 
+    def setSettingsDict(self, settingsDict):
+        """Setter method for the settings used by the GUI (guiFPS and headerRefresh)"""
+        self.frameInterval = 1 / settingsDict.get('guiFPS', 20)
+        self.headerRefresh = settingsDict.get('headerRefresh', 10)
+        self.plotMode = settingsDict.get('plotMode', 'window')
+        self.triggered = settingsDict.get('capture', 'continuous') == 'triggered'
+        self.metrics.enabled = settingsDict.get('metrics', False)
+
+    def setExportStatus(self, status):
+        """Keep the latest status of each run being exported to csv, finished exports are shown until the
+        next one starts"""
+
+        if status['state'] in ('queued', 'exporting'):
+            self.exports = {run: latest for run, latest in self.exports.items() if latest['state'] in ('queued', 'exporting')}
+        self.exports[status['run']] = status
+        self.redraw = True
+
+    def statsLines(self):
+        """One line of headline numbers per sensor column"""
+
+        def number(value, unit=""):
+            return "-" if value == None else f"{value:.2f}{unit}"
+
+        lines = []
+        for channel in self.runStats['channels']:
+            line = (f"{channel['name']}: peak {number(channel['max'])} at {number(channel['timeOfMax'], ' s')}   "
+                    f"mean {number(channel['mean'])}   std {number(channel['std'])}   rate {number(channel['rate'], '/s')}")
+            if channel['breakTime'] != None:
+                line += f"   {acp.lightred}break at {channel['breakTime']:.2f} s from {channel['breakPeak']:.2f}{acp.reset}"
+                if channel['breaks'] > 1:
+                    line += f" ({channel['breaks']} breaks)"
+            lines += [line]
+
+        return lines
+
+    def exportLine(self):
+        """One line summary of the csv exports"""
+
+        parts = []
+        for run, status in self.exports.items():
+            if status['state'] == 'exporting':
+                parts += [f"Exporting {run} {status['fraction'] * 100:.0f}%"]
+            elif status['state'] == 'queued':
+                parts += [f"{run} queued for export"]
+            elif status['state'] == 'done':
+                parts += [f"Exported {os.path.basename(status['path'])}"]
+            else:
+                parts += [f"{acp.red}Export of {run} failed: {status['error']}{acp.reset}"]
+
+        return "    ".join(parts)
+
     ### Functions for commands ###
     def read(self):
+        """Drain every message waiting in the data queue"""
 
         dataInQueue = True
-        vals = None
         while dataInQueue:
             try:
-                vals = self.dataQueue.get(timeout=0.000000001)
+                message = self.dataQueue.get(timeout=0.000000001)
             except:
                 dataInQueue = False
                 break
-        
-        if vals != None:
-            self.data = vals
 
-    def drawGUI(self):
-        """Draws a single 'frame' of the GUI.
-        Note: It's important to create a single string to print once, so that terminal
-        autoscroll is minimized and reaches a 'steady state' where the terminal tries to get
-        all of the new information in the window."""
-        #return
+            if message[0] == "rows":
+                self.addRows(*message[1:])
+
+            elif message[0] == "metrics":
+                self.processMetrics = message[1]
+
+            elif message[0] == "capture": # Sent when a triggered capture starts and again when it ends
+                self.capturing = message[1] if message[1]['end'] == None else None
+                if message[1]['end'] != None:
+                    self.captures += [message[1]]
+
+    def addRows(self, runNumber, startRow, rows):
+        """Append newly recieved rows to the plot window, the work done is bounded by the window size (and
+        proportional to the number of new rows in overview mode)"""
+
+        if runNumber != self.runNumber:
+            return # Left over from a previous run
+
+        if startRow < self.nextRow: # Already recieved
+            rows = rows[self.nextRow - startRow:]
+            startRow = self.nextRow
+
+        if len(rows) == 0:
+            return
+
+        self.skippedRows += startRow - self.nextRow
+        self.nextRow = startRow + len(rows)
+
+        if self.window is None:
+            self.window = rows[-GUI.plotPoints:]
+        else:
+            self.window = np.concatenate((self.window, rows))[-GUI.plotPoints:]
+
+        if self.plotMode == 'overview':
+            if self.overview == None:
+                self.overview = minMaxDecimator(GUI.plotPoints // 2, rows.shape[1])
+            self.overview.add(rows)
+
+    def hostHeader(self):
+        """IP address and user for ssh access. Looking them up starts two processes, so the result is cached
+        and refreshed every headerRefresh seconds."""
+
+        now = time.monotonic()
+        if self.header == None or now - self.headerTime >= self.headerRefresh:
+            ip = subprocess.run(["hostname", "-I"], stdout=subprocess.PIPE).stdout.decode('utf-8')[:-2] # Removes the \n
+            password = subprocess.run(["whoami"], stdout=subprocess.PIPE).stdout.decode('utf-8')[:-1]
+            self.header = f"Current LAN accessible IP: {ip}   ssh password: {password}"
+            self.headerTime = now
+
+        return self.header
+
+    def buildFrame(self):
+        """Lines of a single 'frame' of the GUI"""
+
         ## Header information ##
-        GUIString = "Pull Tester \nCurrent LAN accessible IP: "
-        ip = subprocess.run(["hostname", "-I"], stdout=subprocess.PIPE).stdout.decode('utf-8')[:-2] # Removes the \n
-        GUIString += ip
-        GUIString += "   ssh password: "
-        password = subprocess.run(["whoami"], stdout=subprocess.PIPE).stdout.decode('utf-8')[:-1]
-        GUIString += password
+        lines = ["Pull Tester "]
 
         ## Button reminder/instructions
-        GUIString += f"        Press the {acp.lightgreen}O{acp.reset} button to begin/stop collecting data.\n"
-        GUIString += f"Run {self.runNumber}\n"
+        lines += [self.hostHeader() + f"        Press the {acp.lightgreen}O{acp.reset} button to begin/stop collecting data."]
+        lines += [f"Run {self.runNumber}"]
         
         # Create graph data
         if self.startTime != None:
             terminalGraphData = [0]
 
-            if self.data != None:
+            if self.window is not None:
                 now = time.time() - self.startTime
-                terminalGraphData = np.array(self.data)[-125:, 1:].T.tolist()
+                if self.overview != None:
+                    terminalGraphData = self.overview.series()
+                else:
+                    terminalGraphData = self.window[:, 1:].T.tolist()
 
             # Print/display graph data
-            GUIString += acp.plot(terminalGraphData, self.config) + '\n'
+            lines += acp.plot(terminalGraphData, self.config).split('\n')
 
             # Print x-axis
-            GUIString += "          ----|----|----|----|----|----|----|----|----|----|----|----|----|----|----|----|----|----|----|----|----|----|----|----|\n"
-            if self.data != None:
-                GUIString += f"Time elapsed: {now:.2f}\n"
+            lines += ["          ----|----|----|----|----|----|----|----|----|----|----|----|----|----|----|----|----|----|----|----|----|----|----|----|"]
+            if self.window is not None:
+                status = f"Time elapsed: {now:.2f}    Frame: {self.frameTime * 1000:.1f} ms (max {self.frameTimeMax * 1000:.1f} ms, {self.framesOverBudget} over budget)"
+                if self.overview != None:
+                    status += f"    Whole run, {self.overview.bucketSize} samples per bucket"
+                if self.skippedRows > 0: # Rows that would have scrolled off the plot before it was drawn
+                    status += f"    {self.skippedRows} rows not drawn"
+                lines += [status]
+
+            if self.triggered:
+                status = f"Triggered capture: {len(self.captures)} captured, "
+                if self.capturing != None:
+                    status += f"{acp.lightgreen}capturing{acp.reset}, triggered at {self.capturing['trigger']:.2f} s"
+                else:
+                    status += "armed, waiting for the trigger"
+                if len(self.captures) > 0:
+                    last = self.captures[-1]
+                    status += f"    Last: {last['end'] - last['start']:.2f} s, {last['rows']} samples"
+                lines += [status]
+
+            if self.metrics.enabled:
+                lines += [statusLine(dict(self.processMetrics, gui=self.metrics.snapshot()))]
+
+        if self.runStats != None:
+            lines += self.statsLines()
+
+        if len(self.exports) > 0:
+            lines += [self.exportLine()]
 
         # Legend (display it always to show which sensors are connected)
-        GUIString += "Selected Sensors:\n"
-        for sensor, color in zip(self.sensors, self.config['colors']):
-            GUIString += f"{color}{sensor.name} \033[0m   "
+        lines += ["Selected Sensors:"]
+        lines += ["".join([f"{color}{sensor.name} \033[0m   " for sensor, color in zip(self.sensors, self.config['colors'])])]
 
-        print(GUIString)
+        return lines
 
+    def drawGUI(self):
+        """Draws a single 'frame' of the GUI.
+        Only lines that differ from the previous frame are written, each one by moving the cursor to its row,
+        writing it and clearing the rest of the row. Everything is written with a single call so the terminal
+        never shows a half drawn frame. The time this takes is kept in frameTime and compared against the
+        frame interval."""
+
+        start = time.perf_counter()
 
+        lines = self.buildFrame()
+        output = ""
+        for row, line in enumerate(lines):
+            if row >= len(self.lastFrame) or self.lastFrame[row] != line:
+                output += f"\033[{row + 1};1H{line}\033[K"
 
+        if len(lines) < len(self.lastFrame): # The frame got shorter, clear what is left of the old one
+            output += f"\033[{len(lines) + 1};1H\033[J"
+
+        if output:
+            sys.stdout.write(output + f"\033[{len(lines) + 1};1H")
+            sys.stdout.flush()
+        self.lastFrame = lines
+
+        self.frameTime = time.perf_counter() - start
+        if self.startTime != None:
+            self.frameTimeMax = max(self.frameTimeMax, self.frameTime)
+            self.metrics.observe('frameTime', self.frameTime)
+            if self.frameTime > self.frameInterval:
+                self.framesOverBudget += 1
+                self.metrics.count('framesOverBudget')
@@ -0,0 +1,70 @@
+"""Wake up helpers that let the main, GUI and data collector loops block instead of polling.
+All of them expose a multiprocessing Connection, so a loop can wait on several of them at once with
+multiprocessing.connection.wait."""
+import threading
+
+from multiprocessing import Pipe, RawValue
+
+class eventMailbox:
+    """Thread safe mailbox for events from threads of the main process (button presses, flash drives).
+    The main loop blocks on mailbox.reader together with its other pipes."""
+
+    def __init__(self):
+        self.reader, self.writer = Pipe(duplex=False)
+        self.lock = threading.Lock()
+
+    def post(self, event):
+        with self.lock:
+            self.writer.send(event)
+
+    def receive(self):
+        """Every event posted since the last call, oldest first"""
+
+        events = []
+        while self.reader.poll():
+            events += [self.reader.recv()]
+
+        return events
+
+class dataReadySignal:
+    """Wakes a consumer that is blocked waiting for rows from the data collector. The consumer arms the
+    signal before it blocks, and the data collector only writes to the pipe when the signal is armed, so
+    there is no system call per sample while the consumer is busy.
+
+    The flag lives in shared memory without a lock, so a wake up can occasionally be missed on weakly ordered
+    CPUs. Consumers should always wait with a timeout."""
+
+    def __init__(self):
+        self.waiting = RawValue('b', 0)
+        self.reader, self.writer = Pipe(duplex=False)
+
+    def arm(self):
+        """Consumer side, call before checking for data one last time and blocking on self.reader"""
+        self.waiting.value = 1
+
+    def disarm(self):
+        """Consumer side, call after waking up"""
+        self.waiting.value = 0
+        while self.reader.poll():
+            self.reader.recv_bytes()
+
+    def notify(self):
+        """Producer side, call after new rows have been published"""
+        if self.waiting.value:
+            self.waiting.value = 0
+            self.writer.send_bytes(b"\0")
+
+class nullConnection:
+    """Stands in for the GUI's pipe when the GUI is disabled (gui: false), everything sent is discarded"""
+
+    def send(self, obj):
+        pass
+
+    def poll(self, timeout=0.0):
+        return False
+
+class nullQueue:
+    """Stands in for the GUI's queue when the GUI is disabled, everything put is discarded"""
+
+    def put(self, obj):
+        pass
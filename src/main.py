@@ -1,65 +1,55 @@
 """ Program start point, work in progress """
 import os
 import sys
-import csv
 import time
-import yaml
+import signal
+import shutil
 import threading
-import glob
+import importlib.util
+import numpy as np
 
 from multiprocessing import Process, Queue, Pipe
+from multiprocessing.connection import wait
 from datetime import datetime, timedelta
-from line_profiler import profile
 
-import seeed_python_reterminal.core as rt
-import seeed_python_reterminal.button as rtButton
-
-# Add base directory to system path for importing
-thisDir = os.path.dirname(__file__)
-baseDir = thisDir[0:thisDir.find("PullTester") + 10]
+# Add base directory (the folder containing src) to system path for importing
+thisDir = os.path.dirname(os.path.abspath(__file__))
+baseDir = os.path.dirname(thisDir)
 sys.path.append(baseDir)
 os.chdir(baseDir)
 
-### Sensor Imports ###
-from sensors.sinSensor import sinSensor
-from sensors.cosSensor import cosSensor
-from sensors.hx711LoadCell import hx711LoadCell
-
 ### Core Component Imports ###
 from src.gui import GUI
 from src.dataCollector import dataCollector
+from src.ringBuffer import sharedRingBuffer
+from src.runWriter import runWriter, csvRunFile, writeSidecar
+from src.runFormat import binaryRunFile, runHeader
+from src.runBuffer import runBuffer
+from src.exporter import exportWorker
+from src.runStats import runStatistics
+from src.streamServer import streamServer
+from src.alignment import streamAligner
+from src.calibration import blockConverter
+from src.ipc import eventMailbox, dataReadySignal, nullConnection, nullQueue
+from src.sensorRegistry import createSensors
+from src.metrics import metricSet, sizeBuckets
+from src.settings import loadConfig, sensorRates
+from src.mountWatcher import mountWatcher
+from src.catalog import runCatalog
+
+def getSelectedSensors(sensorNames: list[str], settingsDict=None):
+    """Match sensor string names with instances of their respective sensor objects, found in the sensors
+    folder by file name (see src/sensorRegistry.py)"""
+    return createSensors(sensorNames, settingsDict)
 
-def loadYaml(path):
-    with open(path, "r") as f:
-        contents = yaml.safe_load(f)
-    
-    return contents
-
-def getSelectedSensors(sensorNames: list[str]):
-    """Match sensor string names with instances of their respective sensor objects"""
-
-    selectedSensors = []
-    for sensorName in sensorNames:
-        # Using if elif since hardware is running on python 3.9.2 and upgrading just for match case is not worth it
-        if sensorName == "sinSensor":
-            selectedSensors += [sinSensor()]
-        
-        elif sensorName == "cosSensor":
-            selectedSensors += [cosSensor()]
-
-        elif sensorName == "hx711LoadCell":
-            selectedSensors += [hx711LoadCell()]
-
-    return selectedSensors
-
-@profile
 def queueReader(dataQueue):
     """Reads from a queue and centralizes the information into a multi dimensional array.
     Input:
         dataQueue: 
             multiprocessing.Queue that may or may not contain data from the sensors
     
-    Output:"""
+    Output:
+        2D numpy array with one row per sample, or None if there was no new data"""
 
     queueData = []
     dataInQueue = True
@@ -74,8 +64,40 @@ def queueReader(dataQueue):
     if queueData == []:
         return None
 
-    return queueData
-    
+    return np.array(queueData, dtype=np.float64)
+
+def ringBufferReader(ringBuffer):
+    """Reads every unread row from the shared memory ring buffer in one block.
+    Input:
+        ringBuffer:
+            src.ringBuffer.sharedRingBuffer that the data collector writes into
+
+    Output:
+        2D numpy array with one row per sample, or None if there was no new data"""
+
+    return ringBuffer.read()
+
+def createRingBuffer(settingsDict, sensors):
+    """Create the shared memory ring buffer if config.yaml selects it as the transport, otherwise
+    return None so the multiprocessing.Queue is used."""
+
+    if settingsDict.get('transport', 'queue') == 'sharedMemory':
+        return sharedRingBuffer.forSettings(settingsDict, sensors)
+
+    return None
+
+def sendToGUI(guiQueue, runNumber, startRow, rows, overview=False):
+    """Send rows the GUI has not seen yet. Rows that would scroll off the plot window before being drawn
+    are dropped here, so the size of each message is bounded no matter how long the run is.
+    Input:
+        startRow:
+            Index of rows[0] within the current run, used by the GUI as a sequence number
+        overview:
+            True when the GUI plots the whole run (plotMode: overview), every row is sent"""
+
+    skip = 0 if overview else max(0, len(rows) - GUI.plotPoints)
+    guiQueue.put(("rows", runNumber, startRow + skip, np.asarray(rows[skip:], dtype=np.float64)))
+
 def pipeMessager(pipes, command):
     """ Send the same command to several different pipes. """
 
@@ -85,7 +107,8 @@ def pipeMessager(pipes, command):
 ### Matplotlib formal graphing functions ###
 
 ### CSV and data sharing functions ### 
-def writeCSV(data, runNumber, settingsDict, path=None):
+def runFilePath(runNumber, path=None, extension=".csv"):
+    """Path of a new run file, Data/<day>/Run<runNumber>_<hour><extension> inside of path"""
 
     if path == None:
         path = baseDir
@@ -95,16 +118,45 @@ def writeCSV(data, runNumber, settingsDict, path=None):
     day = now.strftime("%m-%d-%Y")
     hour = now.strftime("%I_%M_%p")
 
-    
-    os.system(f"mkdir -p {path}/Data/{day} && touch {path}/Data/{day}/Run{runNumber}_{hour}.csv")
-    with open(f"{path}/Data/{day}/Run{runNumber}_{hour}.csv", 'w', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow(["Time (seconds)"] + settingsDict['columnNames'])
-        writer.writerows(data)  
+    return f"{path}/Data/{day}/Run{runNumber}_{hour}{extension}"
+
+def startRunWriter(runNumber, settingsDict, sensors, converter, metrics=None, drive=None):
+    """Open the run file on the flash drive if one is plugged in (drive is its path), otherwise in the Data
+    folder of this repository, and start streaming rows to it"""
+
+    fileType = binaryRunFile if settingsDict.get('fileFormat', 'csv') == 'binary' else csvRunFile
+    columnNames = ["Time (seconds)"] + settingsDict['columnNames']
+
+    writer = runWriter(runFilePath(runNumber, drive, fileType.extension),
+                       columnNames,
+                       settingsDict.get('flushInterval', 1),
+                       settingsDict.get('fsyncInterval', 5),
+                       fileType,
+                       runHeader(columnNames, settingsDict, sensors),
+                       converter,
+                       metrics)
+    writer.start()
+    return writer
+
+def backfillCatalog(dataDirs):
+    """Add the runs in Data folders that are missing from the run catalog, in the background"""
+
+    def backfill():
+        catalog = runCatalog() # sqlite connections can't be shared between threads
+        added = catalog.backfill(dataDirs)
+        catalog.close()
+        if added > 0:
+            print(f"Added {added} runs to the run catalog")
 
-def reterminalControls(buttonDevice):
+    threading.Thread(target=backfill, daemon=True).start()
+
+def reterminalControls(events):
     global doCollect
 
+    import seeed_python_reterminal.core as rt
+    import seeed_python_reterminal.button as rtButton
+    buttonDevice = rt.get_button_device()
+
     timeout = 0.5
     previousPress = time.time()
     ### Controls
@@ -114,128 +166,347 @@ def reterminalControls(buttonDevice):
             previousPress = time.time()
             if str(buttonEvent.name) == "ButtonName.O":
                 doCollect = not doCollect # Toggle doCollect between true and false
+                events.post("button") # Wake up the main loop
+
+def keyboardControls(events):
+    """Stand in for the reTerminal's button when its library is not installed (e.g. on a development
+    computer), pressing Enter begins/stops collecting data"""
+    global doCollect
+
+    for line in sys.stdin:
+        doCollect = not doCollect
+        events.post("button")
+
+def waitForWork(events, dataReady, dataAvailable, lastConsume, consumeInterval):
+    """Block while collecting until there are new rows, the button is pressed, or the timeout passes.
+    Rows are consumed at most once per consumeInterval seconds, so they are moved in blocks.
+    Input:
+        dataAvailable:
+            Function that returns True if the data collector has written rows that were not read yet
+        lastConsume:
+            time.monotonic() of the last read of the data collector's rows"""
 
-def updateSystem(configPath: str, oldSensors, dataPipe, GUIPipe):
-    """Updates entire system with new configuration settings specified in config.yaml"""
+    remaining = lastConsume + consumeInterval - time.monotonic()
+    if remaining > 0:
+        wait([events.reader], remaining)
+        return
+
+    dataReady.arm()
+    if not dataAvailable():
+        wait([events.reader, dataReady.reader], timeout=0.5) # The timeout covers a missed wake up
+    dataReady.disarm()
+
+def updateSystem(settingsDict, oldSensors, oldRingBuffer, dataPipe, GUIPipe):
+    """Updates entire system with new configuration settings, loaded from a config.yaml by src.settings.loadConfig"""
 
     for sensor in oldSensors:
         sensor.reset()
 
-    settingsDict = loadYaml(configPath)
-    selectedSensors = getSelectedSensors(settingsDict['selectedSensors'])
+    selectedSensors = getSelectedSensors(settingsDict['selectedSensors'], settingsDict)
+    ringBuffer = createRingBuffer(settingsDict, selectedSensors)
                 
     # Update the sensor process
     dataPipe.send("set sensors")
     dataPipe.send(selectedSensors)
     dataPipe.send("set settings")
     dataPipe.send(settingsDict)
+    dataPipe.send("set buffer")
+    dataPipe.send(ringBuffer)
+
+    # The data collector attaches to the new buffer by name, so the old one can be freed right away
+    if oldRingBuffer != None:
+        oldRingBuffer.close()
+        oldRingBuffer.unlink()
 
     # Update the GUI process
     GUIPipe.send("set sensors")
     GUIPipe.send(selectedSensors)
+    GUIPipe.send("set settings")
+    GUIPipe.send(settingsDict)
 
-    return selectedSensors # Return the sensors so that they can be passed back into this function if the flashdrive is plugged back in
+    # Return the sensors, settings and buffer so that they can be passed back into this function if the flashdrive is plugged back in
+    return selectedSensors, settingsDict, ringBuffer
     
 
 # Global scope variable used for terminal control
 doCollect = False
-@profile
 def main():
 
+    # systemd (and timeout) stop the pull tester with SIGTERM, exit through the cleanup at the end of main
+    signal.signal(signal.SIGTERM, lambda signalNumber, frame: sys.exit(0))
+
     ### Load settings from default config file ###
-    settingsDict = loadYaml("config.yaml")
-    selectedSensors = getSelectedSensors(settingsDict['selectedSensors'])
+    settingsDict = loadConfig("config.yaml")
+    if settingsDict == None:
+        sys.exit(1) # The problem was printed by loadConfig
+    selectedSensors = getSelectedSensors(settingsDict['selectedSensors'], settingsDict)
     
-    ### Create GUI process ###
-    guiQueue = Queue()
-    guiParent, guiChild = Pipe()
-    terminalGUI = GUI(guiChild, guiQueue, selectedSensors)
-    Process(target=terminalGUI.mainLoop).start()
+    ### Create GUI process, unless running headless ###
+    if settingsDict.get('gui', True) != False:
+        guiQueue = Queue()
+        guiParent, guiChild = Pipe()
+        terminalGUI = GUI(guiChild, guiQueue, selectedSensors, settingsDict)
+        Process(target=terminalGUI.mainLoop).start()
+    else:
+        print("The GUI is disabled (gui: false in config.yaml), runs can be watched with python -m src.streamClient")
+        guiQueue, guiParent = nullQueue(), nullConnection()
+
+    ### Serve the samples of each run to remote viewers ###
+    server = streamServer.fromSettings(settingsDict)
 
     ### Create sensor process ###
     sensorQueue = Queue()
+    ringBuffer = createRingBuffer(settingsDict, selectedSensors)
     parentPipe, childPipe = Pipe()
-    sensorReader = dataCollector(selectedSensors, sensorQueue, childPipe, settingsDict)
+    dataReady = dataReadySignal()
+    sensorReader = dataCollector(selectedSensors, sensorQueue, childPipe, settingsDict, ringBuffer, dataReady)
     Process(target=sensorReader.mainLoop).start()
 
-    ### Create control input thread for the reterminal ###
-    reterminalButtonDevice = rt.get_button_device()
-    reterminalThread = threading.Thread(target=reterminalControls, args=(reterminalButtonDevice,))
-    reterminalThread.start()
-
-    # Control logic
-    global doCollect
-    firstCollection = True
-    connected = False # Flash drive
-
-    # Counters
-    runNumber = 0
-    
-    while True:
+    ### Create control input thread for the reterminal, or the keyboard when not running on one ###
+    events = eventMailbox()
+    if importlib.util.find_spec("seeed_python_reterminal") != None:
+        controlThread = threading.Thread(target=reterminalControls, args=(events,))
+    else:
+        print("seeed_python_reterminal is not installed, press Enter to begin/stop collecting data")
+        controlThread = threading.Thread(target=keyboardControls, args=(events,), daemon=True)
+    controlThread.start()
 
-        ### Flash drive detection ###
-        if not doCollect: # Do only when not collecting because updating settings while gui and sensor processes are running is not safe
-            flashDrives = glob.glob("/media/pulltester/*")
+    ### Watch for flash drives and edits to their config files ###
+    watcher = mountWatcher(events)
+    watcher.start()
 
-            if len(flashDrives) >= 1 and connected == False:
-                connected = True
-                print(f"Detected new flash drive at: {flashDrives[0]}    Searching for config.yaml file")
-                time.sleep(0.5)
-                yamlFilePath = glob.glob(f"{flashDrives[0]}/config.yaml")
+    ### Add runs the catalog has not seen yet, on a thread of its own so startup isn't held up ###
+    catalog = runCatalog()
+    backfillCatalog([os.path.join(baseDir, "Data")])
 
-                if len(yamlFilePath) != 0: # There is a custom config.yaml file on the flash drive
-                    print("Found a config file on the flashdrive, this config will be used while flashdrive is connected.")
-                    
-                    selectedSensors = updateSystem(yamlFilePath[0], selectedSensors, parentPipe, guiParent)
+    ### Export finished runs to csv in the background, progress is passed on to the GUI by the main loop ###
+    exporter = exportWorker(lambda status: events.post(("export", status)))
 
-                else: # There isn't a custom yaml file and we need to put a copy of the default one onto the flash drive
-                    print("The config.yaml file couldn't be found on the first level of the flashdrive. A copy of the default configuration has been copied to the flashdrive.")
-                    os.system(f"cp config.yaml {flashDrives[0]}/config.yaml")
+    def readSamples():
+        if ringBuffer != None:
+            return ringBufferReader(ringBuffer)
+        return queueReader(sensorQueue)
 
+    def dataAvailable():
+        if ringBuffer != None:
+            return ringBuffer.available() > 0
+        return not sensorQueue.empty()
 
-            elif len(flashDrives) == 0 and connected == True:
-                connected = False
-                print("Flash drive was disconnected, using the defualt config file.")
+    # Control logic
+    global doCollect
+    firstCollection = True
+    connectedDrive = None # Path of the flash drive in use
+    drivesChanged = True # Check for a flash drive on the first pass
 
-                selectedSensors = updateSystem("config.yaml", selectedSensors, parentPipe, guiParent)
+    # Counters
+    runNumber = catalog.nextRunNumber() - 1 # Run numbers keep counting up across restarts
+    lastConsume = 0
 
+    # Metrics of the main process, and the latest ones sent by the other processes
+    metrics = metricSet(settingsDict.get('metrics', False))
+    processMetrics = {}
+    
+    try:
+        while True:
 
-        # Begin collection
-        if doCollect:
-            if firstCollection:
-                runNumber += 1
-                firstCollection = False
-                pipeMessager([parentPipe, guiParent], "read")
-                
-                # Wait for actual data to arrive
-                data = None
-                while data == None:
-                    data = queueReader(sensorQueue)
-
-            newData = queueReader(sensorQueue)
-
-            if newData != None:
-
-                data += newData
-                guiQueue.put(data)
-
-        # Stop collection
-        elif firstCollection == False:
-            # Stop collection with messaging and logic vars
-            firstCollection = True
-            pipeMessager([parentPipe, guiParent], "stop")
-
-            # Determine if flash drive is plugged in
-            flashDrives = glob.glob("/media/pulltester/*")
-        
-            # Write to CSV
-            if len(flashDrives) >= 1:
-                writeCSV(data, runNumber, settingsDict, flashDrives[0])
+            ### Block until there is something to do, instead of spinning ###
+            if doCollect and not firstCollection:
+                waitForWork(events, dataReady, dataAvailable, lastConsume, settingsDict.get('consumeInterval', 0.02))
             else:
-                writeCSV(data, runNumber, settingsDict)
-
-            # Clear last run from RAM
-            data = []
+                # Idle, wake up on a button press or a flash drive change
+                wait([events.reader])
+            for event in events.receive():
+                if isinstance(event, tuple) and event[0] == "drives":
+                    drivesChanged = True
+                elif isinstance(event, tuple) and event[0] == "export":
+                    guiParent.send("export")
+                    guiParent.send(event[1])
+
+            ### Flash drive and config changes ###
+            if not doCollect and drivesChanged: # Do only when not collecting because updating settings while gui and sensor processes are running is not safe
+                drivesChanged = False
+                drive = watcher.drive()
+                configPath = "config.yaml"
+
+                if drive != None:
+                    driveConfig = os.path.join(drive, "config.yaml")
+                    if drive != connectedDrive:
+                        print(f"Detected new flash drive at: {drive}    Searching for config.yaml file")
+
+                    if os.path.exists(driveConfig): # There is a custom config.yaml file on the flash drive
+                        configPath = driveConfig
+                        if drive != connectedDrive:
+                            print("Found a config file on the flashdrive, this config will be used while flashdrive is connected.")
+
+                    elif drive != connectedDrive: # There isn't a custom yaml file and we need to put a copy of the default one onto the flash drive
+                        try:
+                            shutil.copyfile("config.yaml", driveConfig)
+                            print("The config.yaml file couldn't be found on the first level of the flashdrive. A copy of the default configuration has been copied to the flashdrive.")
+                        except OSError as error:
+                            print(f"ERROR: Couldn't copy the default config.yaml to the flash drive: {error.strerror}")
+
+                elif connectedDrive != None:
+                    print("Flash drive was disconnected, using the defualt config file.")
+
+                if drive != None and drive != connectedDrive: # Runs already on the flash drive
+                    backfillCatalog([os.path.join(drive, "Data")])
+
+                connectedDrive = drive
+
+                # Parsed configs are cached, so the system is only updated when the settings actually changed
+                newSettings = loadConfig(configPath)
+                if newSettings != None and newSettings != settingsDict:
+                    selectedSensors, settingsDict, ringBuffer = updateSystem(newSettings, selectedSensors, ringBuffer, parentPipe, guiParent)
+
+                metrics.enabled = settingsDict.get('metrics', False)
+
+
+            # Begin collection
+            if doCollect:
+                if firstCollection:
+                    runNumber = max(runNumber + 1, catalog.nextRunNumber())
+                    firstCollection = False
+                    converter = blockConverter.fromSensors(settingsDict, selectedSensors)
+                    metrics.reset()
+                    processMetrics = {}
+                    lastMetricsSent = time.monotonic()
+                    overruns = ringBuffer.overruns if ringBuffer != None else 0
+                    writer = startRunWriter(runNumber, settingsDict, selectedSensors, converter, metrics if metrics.enabled else None, watcher.drive())
+                    rowCount = 0
+                    runRows = None # Only kept when the csv copy of a binary run can be written from memory
+                    if writer.fileType == binaryRunFile and settingsDict.get('exportCSV', True) and settingsDict.get('runBufferMB', 32) > 0:
+                        runRows = runBuffer(len(settingsDict['columnNames']) + 1, maxBytes=settingsDict.get('runBufferMB', 32) * 2**20)
+                    runId = catalog.startRun(runNumber, writer.path, settingsDict, selectedSensors, sensorRates(settingsDict, selectedSensors))
+                    stats = runStatistics.fromSettings(settingsDict)
+                    lastStatsSent = time.monotonic()
+                    guiAligner = streamAligner('hold') # The live plot always uses sample and hold, it can't wait for interpolation
+                    if server != None:
+                        server.startRun(runNumber, ["Time (seconds)"] + settingsDict['columnNames'],
+                                        sensorRates(settingsDict, selectedSensors), settingsDict.get('convert', False))
+                    guiParent.send("set run number")
+                    guiParent.send(runNumber)
+                    pipeMessager([parentPipe, guiParent], "read")
+
+                newData = readSamples()
+                lastConsume = time.monotonic()
+
+                if newData is not None:
+                    converted = converter.convert(newData)
+                    stats.update(converted)
+                    sendToGUI(guiQueue, runNumber, rowCount, guiAligner.align(converted),
+                              settingsDict.get('plotMode', 'window') == 'overview')
+                    if server != None:
+                        server.publishRows(rowCount, converted)
+                    writer.append(newData)
+                    if runRows != None:
+                        runRows.append(newData)
+                    rowCount += len(newData)
+
+                # Headline numbers for the GUI, twice a second
+                if time.monotonic() - lastStatsSent >= 0.5:
+                    guiParent.send("stats")
+                    guiParent.send(stats.summary())
+                    lastStatsSent = time.monotonic()
+
+                if metrics.enabled:
+                    if newData is not None:
+                        metrics.observe('backlogRows', len(newData), sizeBuckets) # Rows waiting since the last read
+                        metrics.observe('writeQueue', writer.blocks.qsize(), sizeBuckets)
+                        metrics.count('rows', len(newData))
+                    if ringBuffer != None and ringBuffer.overruns > overruns:
+                        metrics.count('overruns', ringBuffer.overruns - overruns)
+                        overruns = ringBuffer.overruns
+
+                # Live metrics and finished triggered captures from the data collector
+                while parentPipe.poll():
+                    reply, contents = parentPipe.recv()
+                    if reply == "metrics":
+                        processMetrics['collector'] = contents
+                    elif reply == "capture":
+                        guiQueue.put(("capture", contents))
+
+                # Metrics for the GUI status line, once a second
+                if metrics.enabled and time.monotonic() - lastMetricsSent >= 1:
+                    processMetrics['main'] = metrics.snapshot()
+                    if server != None:
+                        processMetrics['stream'] = server.snapshot()
+                    guiQueue.put(("metrics", processMetrics))
+                    lastMetricsSent = time.monotonic()
+
+            # Stop collection
+            elif firstCollection == False:
+                # Stop collection with messaging and logic vars
+                firstCollection = True
+                pipeMessager([parentPipe, guiParent], "stop")
+
+                # The data collector replies with its timing statistics once it has stopped writing rows, after its
+                # final metrics when they are enabled
+                timing = None
+                while timing == None and parentPipe.poll(2):
+                    reply, contents = parentPipe.recv()
+                    if reply == "metrics":
+                        processMetrics['collector'] = contents
+                    elif reply == "capture":
+                        guiQueue.put(("capture", contents))
+                    elif reply == "timing":
+                        timing = contents
+
+                # Rows read just before the data collector stopped
+                newData = readSamples()
+                if newData is not None:
+                    writer.append(newData)
+                    if runRows != None:
+                        runRows.append(newData)
+                    converted = converter.convert(newData)
+                    stats.update(converted)
+                    if server != None:
+                        server.publishRows(rowCount, converted)
+                    metrics.count('rows', len(newData))
+
+                # Everything else is already on disk, only the tail is written and the file renamed
+                runPath = writer.stop()
+                if timing != None:
+                    if runRows != None:
+                        timing['runBuffer'] = runRows.memoryUse()
+                    writeSidecar(runPath, "timing", timing)
+
+                # Peak, mean, break and so on, without reading the run file again
+                summary = stats.summary()
+                writeSidecar(runPath, "summary", summary)
+                catalog.finishRun(runId, runPath, summary)
+                guiParent.send("stats")
+                guiParent.send(summary)
+                if server != None:
+                    server.stopRun(summary)
+                    streamCounters = server.snapshot()['counters']
+                    if streamCounters['droppedFrames'] > 0:
+                        print(f"Stream: {streamCounters['droppedFrames']} sample frames dropped so far for clients that couldn't keep up, "
+                              f"{streamCounters['disconnects']} clients left")
+
+                if metrics.enabled:
+                    if guiParent.poll(1):
+                        reply, processMetrics['gui'] = guiParent.recv()
+                    processMetrics['main'] = metrics.snapshot()
+                    if server != None:
+                        processMetrics['stream'] = server.snapshot()
+                    writeSidecar(runPath, "metrics", processMetrics)
+
+                # Binary runs get a csv copy for spreadsheets, written while the next run can already be collected
+                if writer.fileType == binaryRunFile and settingsDict.get('exportCSV', True):
+                    exporter.submit(runPath, converter, settingsDict.get('compressCSV', False), runRows if runRows != None and runRows.complete else None)
+                runRows = None # Only the exporter keeps the rows
+    finally:
+        # Stop the other processes, free the shared memory and remove the stream socket, also when stopped with
+        # Ctrl-C or SIGTERM, so blocks in /dev/shm don't pile up
+        try:
+            pipeMessager([parentPipe, guiParent], "off")
+        except OSError: # They already stopped, Ctrl-C reaches every process
+            pass
+        if ringBuffer != None:
+            ringBuffer.close()
+            ringBuffer.unlink()
+        if server != None:
+            server.close()
   
 if __name__ == "__main__":
     main()
@@ -0,0 +1,124 @@
+"""Low overhead counters and histograms for diagnosing rate problems without a profiler.
+
+Each process (main, data collector and GUI) keeps its own metricSet. When metrics are disabled every method
+returns straight away, and hot loops check metricSet.enabled before taking timestamps, so the cost is one
+attribute lookup. Histograms have fixed buckets, so recording a value never allocates and the memory used does
+not depend on the length of the run.
+
+The data collector and GUI send snapshots of their metrics to the main process, which passes the combined
+metrics on to the GUI status line and saves them next to each run as Run<N>_<time>_metrics.json.
+"""
+import bisect
+
+def bucketEdges(low, high):
+    """Upper bucket edges from low to high, ten per decade in the 1, 1.25, 1.6, 2, 2.5 ... series, so a
+    percentile is accurate to about 25%"""
+
+    edges = []
+    decade = low
+    while decade <= high:
+        edges += [round(decade * step, 12) for step in (1, 1.25, 1.6, 2, 2.5, 3.15, 4, 5, 6.3, 8) if decade * step <= high]
+        decade *= 10
+    return edges
+
+latencyBuckets = bucketEdges(1e-6, 10) # Seconds, 1 us to 10 s
+sizeBuckets = bucketEdges(1, 1000000) # Counts of rows or blocks
+
+class histogram:
+    """Counts of values per bucket, plus the count, total and maximum of every value recorded.
+    Values above the last edge go in an overflow bucket."""
+
+    def __init__(self, edges):
+        self.edges = edges
+        self.counts = [0] * (len(edges) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        self.counts[bisect.bisect_left(self.edges, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percentile):
+        """Upper edge of the bucket holding the given percentile, the maximum for the overflow bucket"""
+
+        if self.count == 0:
+            return None
+
+        target = percentile / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self.edges[index], self.max) if index < len(self.edges) else self.max
+
+        return self.max
+
+    def summary(self):
+        return {'count': self.count,
+                'mean': self.total / self.count if self.count > 0 else None,
+                'p50': self.percentile(50),
+                'p99': self.percentile(99),
+                'max': self.max if self.count > 0 else None,
+                'buckets': {str(edge): count for edge, count in zip(self.edges + ['overflow'], self.counts) if count > 0}}
+
+class metricSet:
+    """Named counters and histograms for one process.
+    Input:
+        enabled:
+            When False nothing is recorded, set from metrics in config.yaml"""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.reset()
+
+    def reset(self):
+        self.counters = {}
+        self.histograms = {}
+
+    def count(self, name, amount=1):
+        if not self.enabled:
+            return
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name, value, edges=latencyBuckets):
+        """Record a value in the named histogram, latencies are in seconds"""
+
+        if not self.enabled:
+            return
+
+        if name not in self.histograms:
+            self.histograms[name] = histogram(edges)
+        self.histograms[name].record(value)
+
+    def snapshot(self):
+        """Everything recorded so far as a json friendly dictionary"""
+
+        return {'counters': dict(self.counters),
+                'histograms': {name: values.summary() for name, values in list(self.histograms.items())}} # list(), other threads may add histograms
+
+def statusLine(processMetrics):
+    """One line summary for the GUI of snapshots keyed by process name (main, collector, gui, and stream when
+    the stream server is running)"""
+
+    def p99(process, name, scale=1000):
+        values = processMetrics.get(process, {}).get('histograms', {}).get(name)
+        if values == None or values['p99'] == None:
+            return "-"
+        return f"{values['p99'] * scale:.3g}"
+
+    def total(process, name):
+        return processMetrics.get(process, {}).get('counters', {}).get(name, 0)
+
+    line = (f"p99 read {p99('collector', 'sensorRead')} ms  interval {p99('collector', 'loopInterval')} ms  "
+            f"backlog {p99('main', 'backlogRows', 1)} rows  write {p99('main', 'writeTime')} ms  "
+            f"frame {p99('gui', 'frameTime')} ms    failed reads {total('collector', 'failedReads')}  "
+            f"overruns {total('main', 'overruns')}  missed {total('collector', 'missedDeadlines')}")
+
+    if 'stream' in processMetrics: # src.streamServer.streamServer.snapshot()
+        line += (f"    stream {total('stream', 'clients')} clients  dropped {total('stream', 'droppedFrames')} frames  "
+                 f"{total('stream', 'disconnects')} left")
+    return line
@@ -0,0 +1,162 @@
+"""Watches for flash drives being plugged in and removed, and for edits to their config.yaml, without polling.
+
+Drives are mounted as folders inside /media/pulltester. On Linux the watcher thread sleeps on inotify (through
+ctypes, no extra packages) and only wakes up when that folder or a drive's top level changes. Where inotify is
+not available it falls back to scanning the folder every few seconds. Each change is posted to the main loop's
+src.ipc.eventMailbox as ("drives", [drive paths]).
+"""
+import os
+import time
+import select
+import ctypes
+import ctypes.util
+import threading
+
+# inotify event masks, from sys/inotify.h
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_UNMOUNT = 0x2000
+watchMask = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_UNMOUNT
+
+def inotifyLibrary():
+    """libc with inotify, or None when it is not available (not Linux)"""
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+
+    return libc
+
+class mountWatcher:
+    """Background thread that keeps track of the drives mounted in mediaDir.
+    Input:
+        events:
+            src.ipc.eventMailbox that changes are posted to
+        mediaDir:
+            Folder that drives are mounted in
+        configName:
+            File on each drive that is watched for edits, its modification time is part of the drive state so
+            saving it wakes up the main loop
+        fallbackInterval:
+            Seconds between scans of mediaDir when inotify can't be used
+        mountTimeout:
+            A new folder is reported once it is a mount point, or after this many seconds if it never becomes one"""
+
+    def __init__(self, events, mediaDir="/media/pulltester", configName="config.yaml", fallbackInterval=2, mountTimeout=2):
+        self.events = events
+        self.mediaDir = mediaDir
+        self.configName = configName
+        self.fallbackInterval = fallbackInterval
+        self.mountTimeout = mountTimeout
+
+        self.drives = [] # Paths of the mounted drives, sorted
+        self.state = None
+        self.firstSeen = {} # New folder -> time.monotonic() it appeared, until it is mounted
+        self.watched = set()
+
+        self.libc = inotifyLibrary()
+        self.fd = None
+        if self.libc != None:
+            self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if self.fd < 0:
+                print(f"ERROR: inotify is not available ({os.strerror(ctypes.get_errno())}), scanning for flash drives every {fallbackInterval} s")
+                self.fd = None
+
+        self.thread = threading.Thread(target=self.watchLoop, daemon=True)
+
+    def start(self):
+        self.scan() # The drives plugged in at start up are known before start() returns
+        self.thread.start()
+
+    def drive(self):
+        """Path of the first mounted drive, or None"""
+        return self.drives[0] if len(self.drives) > 0 else None
+
+    def watch(self, path):
+        """Add an inotify watch, returns False if the path can't be watched (e.g. it doesn't exist)"""
+
+        if self.fd == None:
+            return False
+        if path in self.watched:
+            return True
+
+        if self.libc.inotify_add_watch(self.fd, os.fsencode(path), watchMask) < 0:
+            return False
+
+        self.watched.add(path)
+        return True
+
+    def scan(self):
+        """Look at mediaDir and post the drives if anything changed. Returns True while a new folder is
+        waiting to become a mount point."""
+
+        try:
+            folders = sorted([entry.path for entry in os.scandir(self.mediaDir) if entry.is_dir()])
+        except OSError: # No drive has been plugged in since boot, so the folder doesn't exist yet
+            folders = []
+            self.watched.discard(self.mediaDir)
+
+        now = time.monotonic()
+        drives = []
+        for folder in folders:
+            if folder not in self.firstSeen:
+                self.firstSeen[folder] = now
+
+            # The folder is created just before the drive is mounted on it
+            if os.path.ismount(folder) or now - self.firstSeen[folder] >= self.mountTimeout:
+                drives += [folder]
+        self.firstSeen = {folder: seen for folder, seen in self.firstSeen.items() if folder in folders}
+
+        # Watches on removed folders are dropped by the kernel, so they are added again if the folder comes back
+        self.watched &= set([os.path.dirname(self.mediaDir), self.mediaDir] + drives)
+        if not self.watch(self.mediaDir):
+            self.watch(os.path.dirname(self.mediaDir)) # Wakes up when mediaDir is created
+        for drive in drives:
+            self.watch(drive)
+
+        state = (drives, [self.configTime(drive) for drive in drives])
+        if state != self.state:
+            self.state = state
+            self.drives = drives
+            self.events.post(("drives", drives))
+
+        return len(drives) < len(folders)
+
+    def configTime(self, drive):
+        try:
+            return os.stat(os.path.join(drive, self.configName)).st_mtime_ns
+        except OSError:
+            return None
+
+    def watchLoop(self):
+        mounting = False
+        while True:
+            if mounting:
+                timeout = 0.05 # Check again shortly for the mount to finish
+            elif self.fd == None or len(self.watched) == 0:
+                timeout = self.fallbackInterval
+            else:
+                timeout = None
+
+            if self.fd != None:
+                ready = select.select([self.fd], [], [], timeout)[0]
+                if ready:
+                    time.sleep(0.01) # Let a burst of events (e.g. a file being saved) arrive before scanning once
+                    try:
+                        while os.read(self.fd, 65536): # Only the wake up matters, the folders are scanned again
+                            pass
+                    except BlockingIOError:
+                        pass
+            else:
+                time.sleep(timeout)
+
+            mounting = self.scan()
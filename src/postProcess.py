@@ -0,0 +1,189 @@
+"""Batch post-processing of recorded runs on every core: re-convert, re-filter and summarize whole Data folders.
+
+Each run is processed by a worker process of its own, streaming the run in blocks so the memory used per worker
+doesn't depend on how long the run is:
+    1. The filters in the config's sensorSettings are applied to each sensor column, with the same filter code the
+       data collector uses live (see src/filters.py). Runs are stored after the live filters, so the config
+       should only list the filtering to add on top.
+    2. Rows where the filters left no sensor value (decimation) are dropped. Binary runs are then aligned like
+       the csv export, so a decimated sensor is aligned like one read at a lower rate, and converted to units
+       with the calibration stored in the run, or the config's convert and sensorSettings calibrations when
+       given (see src/calibration.py).
+       Csv runs don't record whether they hold raw values or units. With --csv-raw they are converted like
+       binary runs, with the calibrations of the config's sensors. Otherwise they are taken to be in units: they
+       are not recalibrated and despike filters (raw unit thresholds) are skipped, with a warning.
+    3. The converted rows are written to <output>/<day>/<run>.csv, and the run's statistics are computed (see
+       src/runStats.py).
+When every run is done the statistics are written to <output>/summary.csv, one row per run and sensor column.
+
+Filters of csv runs are looked up by matching the csv's column names to the config's columnNames, binary runs
+store their sensor types.
+
+Usage, from the PullTester directory:
+    python -m src.postProcess Data --config recalibrated.yaml --output Processed
+    python -m src.postProcess Data/07-09-2024/Run1_10_30_AM.ptrun /media/pulltester/USB/Data --workers 2 --gzip
+"""
+import os
+import sys
+import csv
+import gzip
+import time
+import argparse
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from src.runFormat import readHeader, iterBlocks, iterCSVBlocks, csvOutput
+from src.calibration import blockConverter
+from src.sensorRegistry import createSensors
+from src.alignment import streamAligner
+from src.filters import filterChain
+from src.runStats import runStatistics
+from src.catalog import runFiles
+
+rawUnitFilters = ['despike'] # Filters with thresholds in raw sensor units
+
+summaryColumns = ['run', 'path', 'rows', 'duration', 'channel', 'max', 'timeOfMax', 'mean', 'std', 'maxRate', 'breaks', 'breakTime', 'breakPeak']
+
+def sensorTypes(path, columns, settingsDict):
+    """Sensor type of each sensor column of a run, None where it isn't known"""
+
+    if path.endswith(".ptrun"):
+        return readHeader(path)[0].get('sensorTypes') or [None] * (len(columns) - 1)
+
+    types = dict(zip(settingsDict.get('columnNames') or [], settingsDict.get('selectedSensors') or []))
+    return [types.get(column) for column in columns[1:]]
+
+def csvConverter(columns, types, settingsDict):
+    """Converter for the sensor columns of a raw csv run, from the config's convert and the calibrations of the
+    sensors the columns were recorded with"""
+
+    if None in types:
+        raise ValueError(f"Columns {[column for column, sensorType in zip(columns[1:], types) if sensorType == None]} "
+                         "are not in the config's columnNames, their calibration is unknown")
+
+    sensors = createSensors(types, settingsDict)
+    for sensor in sensors:
+        sensor.reset() # Sensor numbers index pin lists, don't let them count up across runs
+
+    return blockConverter.fromSensors(settingsDict, sensors)
+
+def processRun(path, outputDir, settingsDict=None, compress=False, blockRows=65536, csvRaw=False):
+    """Filter, convert and summarize one run, runs in a worker process. Returns (path, csv path, summary).
+    csvRaw tells whether csv runs hold raw values (recorded with convert: false), csv runs don't record it."""
+
+    settingsDict = settingsDict or {}
+    allSensorSettings = settingsDict.get('sensorSettings') or {}
+
+    if path.endswith(".ptrun"):
+        header, _ = readHeader(path)
+        columns = header['columns']
+        blocks = iterBlocks(path, blockRows)
+        converter = blockConverter.fromHeader(header, settingsDict if settingsDict != {} else None)
+        aligner = streamAligner(header.get('alignment', 'none'))
+    else:
+        with (gzip.open(path, 'rt', newline='') if path.endswith(".gz") else open(path, newline='')) as f:
+            columns = next(csv.reader(f))
+        blocks = iterCSVBlocks(path, blockRows)
+        aligner = streamAligner('none')
+
+    types = sensorTypes(path, columns, settingsDict)
+    filterSpecs = [(allSensorSettings.get(sensorType) or {}).get('filters', []) for sensorType in types]
+
+    if not path.endswith(".ptrun") and csvRaw:
+        converter = csvConverter(columns, types, settingsDict)
+    elif not path.endswith(".ptrun"):
+        # Already in units, calibrating again or thresholds meant for raw values would give wrong results
+        converter = blockConverter([], enabled=False)
+        if settingsDict.get('convert', False) == True or any(['calibration' in (allSensorSettings.get(sensorType) or {}) for sensorType in types]):
+            print(f"WARNING: {path} is a csv run in units, it is not recalibrated (use --csv-raw for runs recorded with convert: false)")
+        if any([spec.get('type') in rawUnitFilters for specs in filterSpecs for spec in specs]):
+            print(f"WARNING: {path} is a csv run in units, its {rawUnitFilters} filters are skipped since their thresholds are in raw units")
+            filterSpecs = [[spec for spec in specs if spec.get('type') not in rawUnitFilters] for specs in filterSpecs]
+
+    chains = [filterChain(specs) for specs in filterSpecs]
+
+    name = os.path.basename(path).split(".")[0]
+    csvPath = os.path.join(outputDir, os.path.basename(os.path.dirname(path)), name + (".csv.gz" if compress else ".csv"))
+    os.makedirs(os.path.dirname(csvPath), exist_ok=True)
+
+    options = settingsDict.get('breakDetection') or {}
+    stats = runStatistics(columns[1:], options.get('drop', 0.5), options.get('minimumPeak', 5.0))
+
+    def writeRows(writer, rows):
+        stats.update(rows)
+        writer.writerows(rows.tolist())
+
+    with csvOutput(csvPath, compress) as writer:
+        writer.writerow(columns)
+        for block in blocks:
+            block = block.copy()
+            for column, chain in enumerate(chains, start=1):
+                if len(chain.stages) > 0:
+                    block[:, column] = chain.processBlock(block[:, column])
+            if len(block) > 0 and block.shape[1] > 1: # Before aligning, or it would fill them with held values
+                block = block[~np.isnan(block[:, 1:]).all(axis=1)]
+            writeRows(writer, converter.convert(aligner.align(block)))
+
+        tail = aligner.flush()
+        if tail is not None:
+            writeRows(writer, converter.convert(tail))
+
+    return path, csvPath, stats.summary()
+
+def writeSummary(summaryPath, results):
+    """One row per run and sensor column, in the order of the runs"""
+
+    with open(summaryPath, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(summaryColumns)
+        for path, csvPath, summary in results:
+            name = os.path.basename(path).split(".")[0]
+            for channel in summary['channels']:
+                writer.writerow([name, csvPath, summary['rows'], summary['duration'], channel['name'], channel['max'],
+                                 channel['timeOfMax'], channel['mean'], channel['std'], channel['maxRate'],
+                                 channel['breaks'], channel['breakTime'], channel['breakPeak']])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-convert, re-filter and summarize recorded runs in parallel")
+    parser.add_argument('runs', nargs='+', help="Run files (.ptrun or .csv) or Data folders")
+    parser.add_argument('--config', default=None,
+                        help="config.yaml with the convert, calibrations and filters to apply (sensorSettings) and breakDetection")
+    parser.add_argument('--output', default="Processed", help="Folder the converted runs and summary.csv are written to")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes, defaults to the number of cores")
+    parser.add_argument('--gzip', action='store_true', help="Write gzip compressed csv files")
+    parser.add_argument('--csv-raw', action='store_true',
+                        help="The csv runs hold raw values (recorded with convert: false), convert them with the config")
+    args = parser.parse_args(argv)
+
+    settingsDict = {}
+    if args.config != None:
+        import yaml
+        with open(args.config, "r") as f:
+            settingsDict = yaml.safe_load(f) or {}
+
+    paths = []
+    for run in args.runs:
+        paths += runFiles([run]) if os.path.isdir(run) else [os.path.abspath(run)]
+    if len(paths) == 0:
+        print("ERROR: No runs found")
+        return 1
+
+    start = time.monotonic()
+    results = {}
+    with ProcessPoolExecutor(args.workers) as pool:
+        futures = {pool.submit(processRun, path, args.output, settingsDict, args.gzip, csvRaw=args.csv_raw): path for path in paths}
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except (OSError, ValueError, KeyError, IndexError) as error:
+                print(f"ERROR: Failed to process {futures[future]}: {error}")
+                continue
+            print(f"[{len(results)}/{len(paths)}] {results[futures[future]][1]}")
+
+    summaryPath = os.path.join(args.output, "summary.csv")
+    os.makedirs(args.output, exist_ok=True)
+    writeSummary(summaryPath, [results[path] for path in paths if path in results])
+    print(f"Processed {len(results)} of {len(paths)} runs in {time.monotonic() - start:.1f} s, summary in {summaryPath}")
+
+if __name__ == "__main__":
+    sys.exit(main())
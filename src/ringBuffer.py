@@ -0,0 +1,145 @@
+"""Fixed capacity ring buffer in shared memory, used to move sensor data from the data collector
+process to the main process without pickling every sample."""
+import math
+import numpy as np
+
+from multiprocessing import shared_memory
+from src.settings import sensorRates
+
+class sharedRingBuffer:
+    """Single producer, single consumer ring buffer backed by multiprocessing.shared_memory. Each row holds
+    one timestamp followed by one value per sensor. A small header in front of the rows stores the write cursor,
+    the read cursor and the number of rows that were overwritten before the reader got to them (overruns).
+
+    The cursors only ever increase, the slot of a row is its cursor modulo the capacity. The writer copies a
+    block of rows into place before advancing the write cursor, so the reader never sees a half written block.
+
+    Input:
+        nColumns:
+            Number of values in each row (time + one per sensor)
+        capacity:
+            Number of rows that can be stored before the writer starts overwriting unread rows
+        name:
+            Name of an existing shared memory block to attach to. Leave as None to create a new block.
+
+    NOTE: The object can be sent through a multiprocessing.Pipe, the receiving process attaches to the
+    same shared memory by name."""
+
+    # Header slots (int64)
+    WRITE = 0
+    READ = 1
+    OVERRUNS = 2
+    HEADER_SLOTS = 8 # Keeps the rows 64 byte aligned and leaves room for more fields
+
+    def __init__(self, nColumns, capacity, name=None):
+        self.nColumns = int(nColumns)
+        self.capacity = int(capacity)
+
+        # Rows that the writer may be overwriting while a read is in progress are treated as lost
+        self.guard = max(1, self.capacity // 16)
+
+        self.owner = name == None
+        if self.owner:
+            size = (sharedRingBuffer.HEADER_SLOTS + self.nColumns * self.capacity) * 8
+            self.memory = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+
+        self.header = np.ndarray((sharedRingBuffer.HEADER_SLOTS,), dtype=np.int64, buffer=self.memory.buf)
+        self.rows = np.ndarray((self.capacity, self.nColumns), dtype=np.float64, buffer=self.memory.buf,
+                               offset=sharedRingBuffer.HEADER_SLOTS * 8)
+
+        if self.owner:
+            self.header[:] = 0
+
+    @classmethod
+    def forSettings(cls, settingsDict, sensors):
+        """Create a ring buffer sized to hold settingsDict['bufferSeconds'] of data for the given sensors"""
+
+        rate = max(sensorRates(settingsDict, sensors) + [1])
+        capacity = max(1024, math.ceil(settingsDict.get('bufferSeconds', 10) * rate))
+        return cls(len(sensors) + 1, capacity)
+
+    def __getstate__(self):
+        return {'nColumns': self.nColumns, 'capacity': self.capacity, 'name': self.memory.name}
+
+    def __setstate__(self, state):
+        self.__init__(state['nColumns'], state['capacity'], name=state['name'])
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    @property
+    def overruns(self):
+        """Number of rows that were overwritten before they could be read"""
+        return int(self.header[sharedRingBuffer.OVERRUNS])
+
+    def available(self):
+        """Number of rows waiting to be read (can be larger than the capacity if the reader fell behind)"""
+        return int(self.header[sharedRingBuffer.WRITE] - self.header[sharedRingBuffer.READ])
+
+    def write(self, rows):
+        """Copy one row or a 2D block of rows into the buffer. Only called by the writing process."""
+
+        rows = np.asarray(rows, dtype=np.float64).reshape(-1, self.nColumns)
+        start = int(self.header[sharedRingBuffer.WRITE])
+        end = start + len(rows)
+
+        # A block larger than the buffer can only keep its newest rows
+        if len(rows) > self.capacity:
+            rows = rows[-self.capacity:]
+            start = end - self.capacity
+
+        slot = start % self.capacity
+        first = min(len(rows), self.capacity - slot)
+        self.rows[slot:slot + first] = rows[:first]
+        self.rows[:len(rows) - first] = rows[first:]
+
+        # Publish the rows only after they are in place
+        self.header[sharedRingBuffer.WRITE] = end
+
+    def read(self):
+        """Return a copy of every unread row as a 2D numpy array, or None if there is nothing new.
+        Only called by the reading process."""
+
+        write = int(self.header[sharedRingBuffer.WRITE])
+        read = int(self.header[sharedRingBuffer.READ])
+        if write == read:
+            return None
+
+        lost = 0
+        if write - read > self.capacity - self.guard:
+            lost = write - read - (self.capacity - self.guard)
+            read += lost
+
+        slot = read % self.capacity
+        count = write - read
+        first = min(count, self.capacity - slot)
+        block = np.concatenate((self.rows[slot:slot + first], self.rows[:count - first]))
+
+        # The writer may have wrapped onto the oldest rows while they were being copied, drop those
+        torn = int(self.header[sharedRingBuffer.WRITE]) - (self.capacity - self.guard) - read
+        if torn > 0:
+            torn = min(torn, len(block))
+            block = block[torn:]
+            lost += torn
+
+        if lost > 0:
+            self.header[sharedRingBuffer.OVERRUNS] += lost
+
+        self.header[sharedRingBuffer.READ] = write
+        if len(block) == 0:
+            return None
+
+        return block
+
+    def close(self):
+        """Detach from the shared memory, the numpy views have to be released first"""
+        del self.header, self.rows
+        self.memory.close()
+
+    def unlink(self):
+        """Free the shared memory block, only called by the process that created it"""
+        if self.owner:
+            self.memory.unlink()
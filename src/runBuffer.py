@@ -0,0 +1,84 @@
+"""The run being collected, kept in memory as raw float64 rows so it can be exported once it stops without
+reading the run file back from the flash drive.
+
+Rows are copied once into preallocated chunks of chunkRows rows. Chunks are never moved or resized when the run
+grows (unlike a list of rows or one array grown with np.concatenate), so the memory used is 8 bytes per value
+plus at most one partly filled chunk, and the heap doesn't fragment over a long run. Reading hands out views of
+the chunks, nothing is copied.
+
+Rows are only ever added after the rows already stored, so views stay valid (and unchanged) while the run grows
+and can be passed to other threads.
+"""
+import numpy as np
+
+class runBuffer:
+    """Chunked, append only storage of the rows of a run.
+    Input:
+        nColumns:
+            Columns per row, including time
+        chunkRows:
+            Rows per chunk
+        maxBytes:
+            Memory the chunks may use, None for no limit. When a run outgrows it the chunks are released and
+            the run has to be read from its file instead (complete is False)."""
+
+    def __init__(self, nColumns, chunkRows=65536, maxBytes=None):
+        self.nColumns = nColumns
+        self.chunkRows = chunkRows
+        self.maxBytes = maxBytes
+        self.chunks = []
+        self.rows = 0 # Rows stored, the last chunk holds rows - (len(chunks) - 1) * chunkRows of them
+        self.complete = True
+
+    def __len__(self):
+        return self.rows
+
+    def append(self, block):
+        """Copy a 2D block of rows onto the end"""
+
+        if not self.complete or len(block) == 0:
+            return
+
+        block = np.asarray(block, dtype=np.float64)
+        start = 0
+        while start < len(block):
+            used = self.rows - (len(self.chunks) - 1) * self.chunkRows
+            if len(self.chunks) == 0 or used == self.chunkRows:
+                if self.maxBytes != None and (len(self.chunks) + 1) * self.chunkRows * self.nColumns * 8 > self.maxBytes:
+                    print(f"ERROR: The run is larger than the {self.maxBytes / 2**20:.1f} MB kept in memory, it will be exported from its file")
+                    self.release()
+                    return
+                self.chunks += [np.empty((self.chunkRows, self.nColumns), dtype=np.float64)]
+                used = 0
+
+            count = min(len(block) - start, self.chunkRows - used)
+            self.chunks[-1][used:used + count] = block[start:start + count]
+            self.rows += count
+            start += count
+
+    def blocks(self, blockRows=None):
+        """Yield views of every row in order, at most blockRows (by default a chunk) at a time"""
+
+        blockRows = blockRows or self.chunkRows
+        for index, chunk in enumerate(self.chunks):
+            filled = min(self.chunkRows, self.rows - index * self.chunkRows)
+            for start in range(0, filled, blockRows):
+                yield chunk[start:min(start + blockRows, filled)]
+
+    def release(self):
+        """Free the chunks, the buffer no longer holds the whole run"""
+
+        self.chunks = []
+        self.rows = 0
+        self.complete = False
+
+    def memoryUse(self):
+        """Rows stored and the memory their chunks take, as a json friendly dictionary"""
+
+        allocated = len(self.chunks) * self.chunkRows * self.nColumns * 8
+        return {'rows': self.rows,
+                'chunks': len(self.chunks),
+                'bytes': allocated, # Pages of the last chunk that haven't been written to yet take no memory
+                'filledBytes': self.rows * self.nColumns * 8,
+                'bytesPerRow': allocated / self.rows if self.rows > 0 else None,
+                'complete': self.complete}
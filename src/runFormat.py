@@ -0,0 +1,252 @@
+"""Compact binary run format and conversion to csv.
+
+A run file (.ptrun) is laid out as:
+    8 bytes     b"PTRUN\\x00" followed by the format version as a little endian uint16
+    8 bytes     Length of the json header in bytes, little endian uint64
+    header      utf-8 json with the column names, sample rate, sensor names and calibration, padded with spaces
+                so that the data starts on a 64 byte boundary
+    data        Rows of little endian float64 values, one column per entry in header['columns'], appended in
+                blocks while the run is collected
+
+Rows are stored exactly as the data collector produced them, as raw sensor values. The csv export converts them
+to units with the calibration in the header (or a newer one from a config file) when header['convert'] is true.
+With sensors at different rates, a sensor that was not read at a row's time has NaN in its column. The csv
+export aligns the columns using header['alignment'].
+
+The row count is not stored, it follows from the file size. A run that was cut short by a crash or power loss
+can still be read, a partially written last row is ignored. Since the data is one contiguous array it can be
+memory mapped directly:
+
+    header, data = openRun("Run1_10_30_AM.ptrun")
+    peak = data[:, 1].max()
+
+Usage as a script, from the PullTester directory:
+    python -m src.runFormat info Data/07-09-2024/Run1_10_30_AM.ptrun
+    python -m src.runFormat csv Data/07-09-2024/Run1_10_30_AM.ptrun [output.csv] [--config recalibrated.yaml] [--gzip]
+"""
+import io
+import os
+import sys
+import csv
+import gzip
+import json
+import struct
+import argparse
+import numpy as np
+
+from datetime import datetime
+from contextlib import contextmanager
+from src.alignment import streamAligner
+from src.calibration import blockConverter, calibrationSpec
+from src.settings import sensorRates
+
+MAGIC = b"PTRUN\x00"
+VERSION = 1
+DTYPE = np.dtype("<f8")
+ALIGNMENT = 64
+
+def runHeader(columnNames, settingsDict, sensors):
+    """Build the header dictionary stored at the start of a run file"""
+
+    sampleRates = sensorRates(settingsDict, sensors)
+
+    return {'columns': columnNames,
+            'sampleRate': max(sampleRates + [0]),
+            'sampleRates': sampleRates,
+            'alignment': settingsDict.get('alignment', 'hold'),
+            'sensors': [sensor.name for sensor in sensors],
+            'sensorTypes': [sensor.__class__.__name__ for sensor in sensors],
+            'calibration': [calibrationSpec(settingsDict, sensor) for sensor in sensors],
+            'convert': settingsDict.get('convert', False),
+            'created': datetime.now().isoformat(),
+            'dtype': DTYPE.str}
+
+class binaryRunFile:
+    """Run file in the binary format described at the top of this module, used by src.runWriter.runWriter"""
+
+    extension = ".ptrun"
+
+    def __init__(self, path, columnNames, header=None, converter=None):
+        if header == None:
+            header = {'columns': columnNames, 'dtype': DTYPE.str}
+
+        self.nColumns = len(header['columns'])
+        self.file = open(path, 'wb')
+        self.file.write(encodeHeader(header))
+
+    def write(self, block):
+        block = np.ascontiguousarray(block, dtype=DTYPE).reshape(-1, self.nColumns)
+        self.file.write(block.data)
+
+    def flush(self):
+        self.file.flush()
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        """Sync to disk and close"""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+def encodeHeader(header):
+    """Magic, version, header length and the padded json header"""
+
+    text = json.dumps(header).encode('utf-8')
+    prefixSize = len(MAGIC) + 2 + 8
+    text += b" " * (-(prefixSize + len(text)) % ALIGNMENT)
+    return MAGIC + struct.pack("<HQ", VERSION, len(text)) + text
+
+def readHeader(path):
+    """Returns the header dictionary of a run file and the byte offset of the first row"""
+
+    with open(path, 'rb') as f:
+        prefix = f.read(len(MAGIC) + 2 + 8)
+        if len(prefix) < len(MAGIC) + 2 + 8 or prefix[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a pull tester run file")
+
+        version, headerLength = struct.unpack("<HQ", prefix[len(MAGIC):])
+        if version > VERSION:
+            raise ValueError(f"{path} uses run format version {version}, this software reads up to {VERSION}")
+
+        header = json.loads(f.read(headerLength).decode('utf-8'))
+
+    return header, len(prefix) + headerLength
+
+def openRun(path, mode='r'):
+    """Memory map a run file.
+    Output:
+        header:
+            Dictionary stored at the start of the file
+        data:
+            numpy.memmap with one row per sample and one column per entry in header['columns']"""
+
+    header, offset = readHeader(path)
+    nColumns = len(header['columns'])
+    rowCount = (os.path.getsize(path) - offset) // (DTYPE.itemsize * nColumns)
+
+    if rowCount == 0: # numpy can't map an empty region
+        return header, np.zeros((0, nColumns), dtype=DTYPE)
+
+    return header, np.memmap(path, dtype=DTYPE, mode=mode, offset=offset, shape=(rowCount, nColumns))
+
+def iterBlocks(path, blockRows=65536):
+    """Yield a run's rows in blocks of at most blockRows, so that memory use does not depend on the run length"""
+
+    header, data = openRun(path)
+    for start in range(0, len(data), blockRows):
+        yield np.array(data[start:start + blockRows])
+
+def iterCSVBlocks(path, blockRows=65536):
+    """Yield the rows of a csv run (or .csv.gz) as float64 blocks of at most blockRows, empty cells are NaN"""
+
+    with (gzip.open(path, 'rt', newline='') if path.endswith(".gz") else open(path, newline='')) as f:
+        reader = csv.reader(f)
+        next(reader)
+        rows = []
+        for row in reader:
+            rows += [[float(value) if value != "" else np.nan for value in row]]
+            if len(rows) == blockRows:
+                yield np.array(rows)
+                rows = []
+        if len(rows) > 0:
+            yield np.array(rows)
+
+@contextmanager
+def csvOutput(csvPath, compress=False):
+    """csv.writer for a new csv file (gzip compressed when compress is true). The file is written with a
+    '.partial' suffix, synced and renamed when the with block finishes, so a csv file without the suffix is
+    always complete. If the block raises, the '.partial' file is removed."""
+
+    partialPath = csvPath + ".partial"
+    try:
+        with open(partialPath, 'wb') as raw:
+            f = io.TextIOWrapper(gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6) if compress else raw,
+                                 encoding='utf-8', newline='')
+            yield csv.writer(f)
+
+            f.flush()
+            stream = f.detach() # raw stays open so it can be synced
+            if compress:
+                stream.close() # Writes the gzip trailer
+            raw.flush()
+            os.fsync(raw.fileno())
+    except BaseException:
+        try:
+            os.remove(partialPath)
+        except OSError: # e.g. the flash drive was removed
+            pass
+        raise
+
+    os.replace(partialPath, csvPath)
+
+def exportCSV(runPath, csvPath=None, blockRows=65536, converter=None, compress=False, progress=None, rows=None):
+    """Stream a binary run file to a csv file in bounded memory (see csvOutput). Returns the path of the csv file.
+    Input:
+        converter:
+            src.calibration.blockConverter used to convert raw values to units, by default it is built from
+            the calibration stored in the run's header
+        compress:
+            Write a gzip compressed csv, the default csvPath then ends in .csv.gz
+        progress:
+            Optional function called with (rowsWritten, rowCount) after each block
+        rows:
+            src.runBuffer.runBuffer holding the run's rows, written instead of reading them back from the file"""
+
+    if csvPath == None:
+        csvPath = os.path.splitext(runPath)[0] + (".csv.gz" if compress else ".csv")
+
+    header, data = openRun(runPath)
+    aligner = streamAligner(header.get('alignment', 'none'))
+    if converter == None:
+        converter = blockConverter.fromHeader(header)
+
+    with csvOutput(csvPath, compress) as writer:
+        writer.writerow(header['columns'])
+        rowsWritten = 0
+        rowCount = len(data) if rows == None else len(rows)
+        for block in iterBlocks(runPath, blockRows) if rows == None else rows.blocks(blockRows):
+            writer.writerows(converter.convert(aligner.align(block)).tolist())
+            rowsWritten += len(block)
+            if progress != None:
+                progress(rowsWritten, rowCount)
+
+        tail = aligner.flush()
+        if tail is not None:
+            writer.writerows(converter.convert(tail).tolist())
+
+    return csvPath
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect and convert binary pull tester run files")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    info = commands.add_parser('info', help="Print the header and row count of a run")
+    info.add_argument('run')
+
+    toCSV = commands.add_parser('csv', help="Convert a run to a csv file")
+    toCSV.add_argument('run')
+    toCSV.add_argument('output', nargs='?', default=None)
+    toCSV.add_argument('--config', default=None,
+                       help="config.yaml whose convert and sensorSettings calibrations replace the ones stored in the run")
+    toCSV.add_argument('--gzip', action='store_true', help="Write a gzip compressed csv")
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'info':
+        header, data = openRun(args.run)
+        print(json.dumps(header, indent=4))
+        print(f"Rows: {len(data)}")
+
+    elif args.command == 'csv':
+        converter = None
+        if args.config != None:
+            import yaml
+            with open(args.config, "r") as f:
+                converter = blockConverter.fromHeader(readHeader(args.run)[0], yaml.safe_load(f))
+
+        print(f"Wrote {exportCSV(args.run, args.output, converter=converter, compress=args.gzip)}")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+"""Headline numbers of a run (peak, time to peak, mean, break) computed while it is collected, so they never have
+to be worked out from the run file afterwards.
+
+The statistics are updated with each block of converted rows the main process reads. The work per block is a
+few numpy passes over its rows, and nothing is kept from earlier blocks except a handful of numbers per channel:
+    - Running minimum, maximum and the time of the maximum
+    - Mean and variance, merging each block into the totals with Welford's method (Chan et al.), which stays
+      accurate over millions of samples
+    - Rate of change, the latest one and the fastest rise between two readings
+    - Breaks, a reading falling breakDrop (a fraction) below the peak of the pull so far. The peak and time of
+      the first break are kept, and the peak starts over so later pulls are counted too.
+"""
+import numpy as np
+
+class channelStatistics:
+    """Online statistics of one column"""
+
+    def __init__(self, name, breakDrop=0.5, minimumPeak=5.0):
+        self.name = name
+        self.breakDrop = breakDrop
+        self.minimumPeak = minimumPeak
+
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0 # Sum of squared differences from the mean
+        self.min = None
+        self.max = None
+        self.peakTime = None
+        self.rate = None
+        self.maxRate = None
+        self.lastTime = None
+        self.lastValue = None
+
+        self.pullPeak = None # Peak since the last break
+        self.pullPeakTime = None
+        self.breaks = 0
+        self.breakTime = None
+        self.breakPeak = None
+        self.breakPeakTime = None
+
+    def update(self, times, values):
+        """Add the readings of a block, NaN values (not read at that time) are skipped"""
+
+        valid = ~np.isnan(values)
+        times, values = times[valid], values[valid]
+        if len(values) == 0:
+            return
+
+        # Mean and variance, merge the block's own into the running totals
+        count = len(values)
+        mean = values.mean()
+        m2 = ((values - mean) ** 2).sum()
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta ** 2 * self.count * count / total
+        self.count = total
+
+        # Extremes
+        peak = int(values.argmax())
+        if self.max == None or values[peak] > self.max:
+            self.max = float(values[peak])
+            self.peakTime = float(times[peak])
+        self.min = float(values.min()) if self.min == None else min(self.min, float(values.min()))
+
+        # Rate of change, including the step from the previous block
+        if self.lastTime != None:
+            steps = np.diff(np.concatenate(([self.lastTime], times)))
+            changes = np.diff(np.concatenate(([self.lastValue], values)))
+        else:
+            steps = np.diff(times)
+            changes = np.diff(values)
+        rates = changes[steps > 0] / steps[steps > 0]
+        if len(rates) > 0:
+            self.rate = float(rates[-1])
+            self.maxRate = float(rates.max()) if self.maxRate == None else max(self.maxRate, float(rates.max()))
+
+        self.findBreaks(times, values)
+        self.lastTime = float(times[-1])
+        self.lastValue = float(values[-1])
+
+    def findBreaks(self, times, values):
+        """Look for readings that fall breakDrop below the peak of the current pull"""
+
+        start = 0
+        while start < len(values):
+            peaks = np.maximum.accumulate(values[start:])
+            if self.pullPeak != None:
+                peaks = np.maximum(peaks, self.pullPeak)
+
+            broken = np.nonzero((peaks >= self.minimumPeak) & (values[start:] <= peaks * (1 - self.breakDrop)))[0]
+            if len(broken) == 0:
+                self.updatePullPeak(times[start:], values[start:])
+                return
+
+            end = start + int(broken[0])
+            self.updatePullPeak(times[start:end + 1], values[start:end + 1])
+            self.breaks += 1
+            if self.breakTime == None:
+                self.breakTime = float(times[end])
+                self.breakPeak = self.pullPeak
+                self.breakPeakTime = self.pullPeakTime
+            self.pullPeak = None # The next pull starts from the reading after the break
+            start = end + 1
+
+    def updatePullPeak(self, times, values):
+        if len(values) == 0:
+            return
+        peak = int(values.argmax())
+        if self.pullPeak == None or values[peak] > self.pullPeak:
+            self.pullPeak = float(values[peak])
+            self.pullPeakTime = float(times[peak])
+
+    def summary(self):
+        return {'name': self.name,
+                'count': self.count,
+                'min': self.min,
+                'max': self.max,
+                'timeOfMax': self.peakTime,
+                'mean': float(self.mean) if self.count > 0 else None,
+                'std': float(np.sqrt(self.m2 / (self.count - 1))) if self.count > 1 else None,
+                'rate': self.rate,
+                'maxRate': self.maxRate,
+                'breaks': self.breaks,
+                'breakTime': self.breakTime,
+                'breakPeak': self.breakPeak,
+                'timeOfBreakPeak': self.breakPeakTime}
+
+class runStatistics:
+    """Online statistics of every sensor column of a run.
+    Input:
+        columnNames:
+            Names of the sensor columns (not time)
+        breakDrop:
+            Fraction of the peak a reading has to fall by to count as a break
+        minimumPeak:
+            Peaks below this are not considered pulls, so noise around zero is never a break"""
+
+    def __init__(self, columnNames, breakDrop=0.5, minimumPeak=5.0):
+        self.channels = [channelStatistics(name, breakDrop, minimumPeak) for name in columnNames]
+        self.rows = 0
+        self.duration = 0.0
+
+    @classmethod
+    def fromSettings(cls, settingsDict):
+        """Statistics for the columns in config.yaml, with the breakDetection options"""
+
+        options = settingsDict.get('breakDetection') or {}
+        return cls(settingsDict['columnNames'], options.get('drop', 0.5), options.get('minimumPeak', 5.0))
+
+    def update(self, block):
+        """Add a block of rows, time in column 0 and one column per sensor"""
+
+        block = np.asarray(block, dtype=np.float64)
+        if len(block) == 0:
+            return
+
+        self.rows += len(block)
+        self.duration = float(block[-1, 0])
+        for column, channel in enumerate(self.channels, start=1):
+            channel.update(block[:, 0], block[:, column])
+
+    def summary(self):
+        """Everything as a json friendly dictionary"""
+        return {'rows': self.rows, 'duration': self.duration, 'channels': [channel.summary() for channel in self.channels]}
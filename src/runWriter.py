@@ -0,0 +1,165 @@
+"""Streams a run to disk while it is being collected, so a crash or power loss only loses the last few
+seconds of data and the main process never has to hold the whole run in memory."""
+import os
+import csv
+import json
+import time
+import queue
+import threading
+import numpy as np
+
+from src.alignment import streamAligner
+
+def writeSidecar(runPath, kind, contents):
+    """Save a dictionary as json next to a run file, Run1_10_30_AM.ptrun -> Run1_10_30_AM_<kind>.json.
+    Returns the path of the json file."""
+
+    path = f"{os.path.splitext(runPath)[0]}_{kind}.json"
+    with open(path, 'w') as f:
+        json.dump(contents, f, indent=4)
+
+    return path
+
+class csvRunFile:
+    """Run file that stores each row as a line of comma seperated text. Multi rate rows are aligned
+    with header['alignment'] and converted with converter (src.calibration.blockConverter) before they
+    are written, since a csv file has no room for the calibration."""
+
+    extension = ".csv"
+
+    def __init__(self, path, columnNames, header=None, converter=None):
+        self.file = open(path, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(columnNames)
+        self.aligner = streamAligner((header or {}).get('alignment', 'none'))
+        self.converter = converter
+
+    def write(self, block):
+        block = self.aligner.align(block)
+        if self.converter != None:
+            block = self.converter.convert(block)
+        self.writer.writerows(block.tolist())
+
+    def flush(self):
+        self.file.flush()
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        """Write the rows held back by the aligner, sync to disk and close"""
+        tail = self.aligner.flush()
+        if tail is not None:
+            if self.converter != None:
+                tail = self.converter.convert(tail)
+            self.writer.writerows(tail.tolist())
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+class runWriter:
+    """Writes blocks of rows to a run file from a background thread. The file is created with a '.partial'
+    suffix when the run starts and renamed to its final name when the run is stopped, so a file without the
+    suffix is always a complete run.
+
+    Input:
+        path:
+            Final path of the run file
+        columnNames:
+            Names of every column, including time
+        flushInterval:
+            Seconds between handing buffered rows to the operating system
+        fsyncInterval:
+            Seconds between forcing the written rows onto the storage device, 0 only syncs when stopping
+        fileType:
+            Class that formats the rows, csvRunFile or src.runFormat.binaryRunFile
+        header:
+            Run information (see src.runFormat.runHeader) for file types that store it
+        converter:
+            src.calibration.blockConverter for file types that store converted values
+        metrics:
+            Optional src.metrics.metricSet that the time taken by each write and fsync is recorded in
+    """
+
+    _stop = object() # Marks the end of the run in the block queue
+
+    def __init__(self, path, columnNames, flushInterval=1.0, fsyncInterval=5.0, fileType=csvRunFile, header=None, converter=None, metrics=None):
+        self.path = path
+        self.partialPath = path + ".partial"
+        self.columnNames = columnNames
+        self.flushInterval = flushInterval
+        self.fsyncInterval = fsyncInterval
+        self.fileType = fileType
+        self.header = header
+        self.converter = converter
+        self.metrics = metrics
+
+        self.blocks = queue.Queue()
+        self.thread = None
+        self.error = None
+        self.rowsWritten = 0
+
+    def start(self):
+        """Create the partial run file and start the writing thread"""
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.runFile = self.fileType(self.partialPath, self.columnNames, self.header, self.converter)
+        self.thread = threading.Thread(target=self.writeLoop, daemon=True)
+        self.thread.start()
+
+    def append(self, rows):
+        """Queue rows to be written, never blocks the caller on disk access"""
+        self.blocks.put(np.asarray(rows, dtype=np.float64))
+
+    def writeLoop(self):
+        lastFlush = lastSync = time.monotonic()
+
+        while True:
+            try:
+                block = self.blocks.get(timeout=self.flushInterval)
+            except queue.Empty:
+                block = None
+
+            if block is runWriter._stop:
+                break
+
+            try:
+                if block is not None:
+                    writeStart = time.perf_counter()
+                    self.runFile.write(block)
+                    self.rowsWritten += len(block)
+                    if self.metrics != None:
+                        self.metrics.observe('writeTime', time.perf_counter() - writeStart)
+
+                now = time.monotonic()
+                if now - lastFlush >= self.flushInterval:
+                    self.runFile.flush()
+                    lastFlush = now
+
+                if self.fsyncInterval and now - lastSync >= self.fsyncInterval:
+                    os.fsync(self.runFile.fileno())
+                    lastSync = now
+                    if self.metrics != None:
+                        self.metrics.observe('fsyncTime', time.monotonic() - now)
+
+            except OSError as error: # The storage device may have been removed mid run
+                if self.error == None:
+                    print(f"ERROR: Failed to write to {self.partialPath}: {error}")
+                self.error = error
+
+    def stop(self):
+        """Write the remaining rows, sync them to disk and give the file its final name.
+        Returns the path of the finished run file."""
+
+        self.blocks.put(runWriter._stop)
+        self.thread.join()
+
+        try:
+            self.runFile.close()
+            os.replace(self.partialPath, self.path)
+        except OSError as error:
+            print(f"ERROR: Failed to finalize {self.path}: {error}")
+            self.error = error
+            return self.partialPath
+
+        return self.path
@@ -0,0 +1,156 @@
+"""Deadline based timing for reading sensors at a fixed rate"""
+import time
+import numpy as np
+
+def sleepUntil(deadline, spinWait=0, wait=None):
+    """Sleep until time.perf_counter_ns() reaches deadline. The last spinWait nanoseconds are spent busy
+    waiting, since time.sleep can wake up a fraction of a millisecond late.
+    Input:
+        wait:
+            Optional blocking function used for most of the sleep, it is called with a timeout in seconds and
+            returns True if it was woken up early (e.g. Connection.poll). The sleep then ends early.
+
+    Output:
+        True if the deadline was reached, False if the wait was interrupted"""
+
+    remaining = deadline - time.perf_counter_ns()
+    if wait != None and remaining - spinWait > 2000000:
+        # Connection.poll rounds its timeout up to whole milliseconds, so it is only used for the whole
+        # milliseconds (less one for rounding) and time.sleep covers the rest
+        if wait(((remaining - spinWait) // 1000000 - 1) / 1000):
+            return False
+        remaining = deadline - time.perf_counter_ns()
+
+    if remaining > spinWait:
+        time.sleep((remaining - spinWait) / 1e9)
+
+    while time.perf_counter_ns() < deadline:
+        pass
+
+    return True
+
+class deadlineScheduler:
+    """Fires at absolute deadlines, start + n * period, so time spent reading sensors and late wake ups
+    do not accumulate into a lower sample rate over the course of a run.
+
+    Input:
+        frequency:
+            Target rate in Hz
+        spinWait:
+            Seconds before each deadline that are spent busy waiting instead of sleeping, 0 disables it
+        catchUp:
+            What to do when a read overruns one or more deadlines. If True the missed ticks fire back to back
+            until the schedule is caught up, if False they are skipped and counted as missed deadlines.
+
+    Interval statistics use a fixed size histogram (1% of the period per bucket, up to 4 periods) so the
+    memory use does not depend on the length of the run."""
+
+    bucketsPerPeriod = 100
+    periodsTracked = 4
+
+    def __init__(self, frequency, spinWait=0.0, catchUp=False):
+        self.frequency = frequency
+        self.period = int(round(1e9 / frequency))
+        self.spinWait = int(spinWait * 1e9)
+        self.catchUp = catchUp
+        self.bucketWidth = max(1, self.period // deadlineScheduler.bucketsPerPeriod)
+        self.start()
+
+    def start(self, startTime=None):
+        """Reset the statistics and schedule the first deadline at startTime (default now)"""
+
+        if startTime == None:
+            startTime = time.perf_counter_ns()
+
+        self.startTime = startTime
+        self.nextDeadline = startTime
+
+        self.ticks = 0
+        self.missedDeadlines = 0
+        self.lateTicks = 0
+        self.firstFire = None
+        self.lastFire = None
+        self.intervalMin = None
+        self.intervalMax = 0
+        self.intervalSum = 0
+        self.latenessSum = 0
+        self.latenessMax = 0
+        self.histogram = np.zeros(deadlineScheduler.bucketsPerPeriod * deadlineScheduler.periodsTracked + 1, dtype=np.int64)
+
+    def wait(self):
+        """Block until the next deadline, returns the time it fired in perf_counter_ns"""
+
+        sleepUntil(self.nextDeadline, self.spinWait)
+        now = time.perf_counter_ns()
+        self.fire(now)
+        return now
+
+    def fire(self, now):
+        """Record a tick at time now and schedule the next deadline"""
+
+        lateness = now - self.nextDeadline
+        self.latenessSum += lateness
+        self.latenessMax = max(self.latenessMax, lateness)
+
+        if self.lastFire != None:
+            interval = now - self.lastFire
+            self.intervalSum += interval
+            self.intervalMax = max(self.intervalMax, interval)
+            self.intervalMin = interval if self.intervalMin == None else min(self.intervalMin, interval)
+            self.histogram[min(interval // self.bucketWidth, len(self.histogram) - 1)] += 1
+        else:
+            self.firstFire = now
+
+        self.lastFire = now
+        self.ticks += 1
+
+        missed = lateness // self.period
+        if missed > 0:
+            if self.catchUp:
+                self.lateTicks += 1
+            else:
+                self.missedDeadlines += missed
+                self.nextDeadline += missed * self.period
+
+        self.nextDeadline += self.period
+
+    def intervalPercentile(self, percentile):
+        """Upper edge of the histogram bucket that holds the given percentile of intervals, in nanoseconds"""
+
+        count = self.histogram.sum()
+        if count == 0:
+            return None
+
+        bucket = int(np.searchsorted(np.cumsum(self.histogram), percentile / 100 * count))
+        if bucket >= len(self.histogram) - 1:
+            return self.intervalMax
+
+        return min((bucket + 1) * self.bucketWidth, self.intervalMax)
+
+    def stats(self):
+        """Summary of the run so far, times in seconds"""
+
+        intervals = self.ticks - 1
+        stats = {'targetRate': self.frequency,
+                 'ticks': self.ticks,
+                 'missedDeadlines': int(self.missedDeadlines),
+                 'lateTicks': self.lateTicks,
+                 'achievedRate': None,
+                 'intervalMin': None,
+                 'intervalMean': None,
+                 'intervalP99': None,
+                 'intervalMax': None,
+                 'latenessMean': None,
+                 'latenessMax': self.latenessMax / 1e9}
+
+        if self.ticks > 0:
+            stats['latenessMean'] = self.latenessSum / self.ticks / 1e9
+
+        if intervals > 0:
+            stats['achievedRate'] = intervals / ((self.lastFire - self.firstFire) / 1e9)
+            stats['intervalMin'] = self.intervalMin / 1e9
+            stats['intervalMean'] = self.intervalSum / intervals / 1e9
+            stats['intervalP99'] = self.intervalPercentile(99) / 1e9
+            stats['intervalMax'] = self.intervalMax / 1e9
+
+        return stats
@@ -0,0 +1,47 @@
+"""Finds sensor classes in the sensors folder by name. A sensor's file name matches its class name
+(see sensors/Custom Sensor Format/SensorNameHere.py), so sensors/hx711LoadCell.py holds class hx711LoadCell.
+Each sensor module is only imported when a config selects it, so hardware libraries are never loaded for
+sensors that are not in use."""
+import os
+import glob
+import importlib
+
+from src.settings import sensorSettings
+
+sensorDir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sensors")
+
+loadedClasses = {} # Sensor name -> class, filled as sensors are selected
+
+def availableSensors():
+    """Names of every sensor in the sensors folder"""
+
+    names = [os.path.splitext(os.path.basename(path))[0] for path in glob.glob(os.path.join(sensorDir, "*.py"))]
+    return sorted([name for name in names if not name.startswith("_")])
+
+def sensorClass(sensorName):
+    """Import sensors/<sensorName>.py and return the class of the same name"""
+
+    if sensorName not in loadedClasses:
+        module = importlib.import_module(f"sensors.{sensorName}")
+        loadedClasses[sensorName] = getattr(module, sensorName)
+
+    return loadedClasses[sensorName]
+
+def createSensors(sensorNames, settingsDict=None):
+    """Create an instance of each named sensor, names that don't match a sensor file are skipped. Sensors with
+    a configure() method are passed their sensorSettings from config.yaml."""
+
+    available = availableSensors()
+    sensors = []
+    for sensorName in sensorNames:
+        if sensorName not in available:
+            print(f"ERROR: Unknown sensor '{sensorName}' in selectedSensors, available sensors are {available}")
+            continue
+
+        sensor = sensorClass(sensorName)()
+        if hasattr(sensor, 'configure'):
+            sensor.configure(sensorSettings(settingsDict or {}, sensor))
+
+        sensors += [sensor]
+
+    return sensors
@@ -0,0 +1,98 @@
+"""Helpers for loading config.yaml and reading values out of the settings dictionary it holds"""
+import os
+import yaml
+
+# Keys that must have one of a few values, the first one is the default used by the rest of the system
+settingChoices = {'transport': ['queue', 'sharedMemory'],
+                  'fileFormat': ['csv', 'binary'],
+                  'alignment': ['hold', 'interpolate', 'none'],
+                  'plotMode': ['window', 'overview'],
+                  'missedDeadlines': ['skip', 'catchUp'],
+                  'acquisition': ['sequential', 'parallel'],
+                  'capture': ['continuous', 'triggered']}
+
+configCache = {} # Path -> ((modification time, size), settings dictionary)
+
+def loadConfig(path):
+    """Parse and validate a config file. The result is cached by the file's modification time and size, so a
+    file that hasn't changed is never parsed twice, and the same dictionary is returned for it.
+
+    Output:
+        The settings dictionary, or None if the file can't be read or isn't a usable config"""
+
+    try:
+        stat = os.stat(path)
+    except OSError as error:
+        print(f"ERROR: Couldn't read {path}: {error.strerror}")
+        return None
+
+    key = (stat.st_mtime_ns, stat.st_size)
+    if path in configCache and configCache[path][0] == key:
+        return configCache[path][1]
+
+    try:
+        with open(path, "r") as f:
+            settingsDict = yaml.safe_load(f)
+    except (OSError, UnicodeDecodeError, yaml.YAMLError) as error:
+        print(f"ERROR: Couldn't parse {path}: {error}")
+        return None
+
+    if not validSettings(settingsDict, path):
+        return None
+
+    configCache[path] = (key, settingsDict)
+    return settingsDict
+
+def validSettings(settingsDict, path="config.yaml"):
+    """Check a settings dictionary before it is used. Problems that the system can't run with make it invalid,
+    unknown values of keys with fixed choices are reported and left to fall back to their default."""
+
+    if not isinstance(settingsDict, dict):
+        print(f"ERROR: {path} doesn't contain any settings")
+        return False
+
+    selectedSensors = settingsDict.get('selectedSensors')
+    if not isinstance(selectedSensors, list) or len(selectedSensors) == 0 or not all([isinstance(name, str) for name in selectedSensors]):
+        print(f"ERROR: selectedSensors in {path} must be a list of sensor names")
+        return False
+
+    columnNames = settingsDict.get('columnNames')
+    if not isinstance(columnNames, list) or len(columnNames) != len(selectedSensors):
+        print(f"ERROR: columnNames in {path} must be a list with one name per sensor in selectedSensors")
+        return False
+
+    for key, choices in settingChoices.items():
+        if key in settingsDict and settingsDict[key] not in choices:
+            print(f"ERROR: Unknown {key} '{settingsDict[key]}' in {path}, options are {choices}. Using '{choices[0]}'.")
+
+    return True
+
+def sensorSettings(settingsDict, sensor):
+    """Per sensor options from the sensorSettings section of config.yaml. The section is keyed by the
+    same names used in selectedSensors (the sensor's class name), and applies to every sensor of that type.
+
+        sensorSettings:
+          hx711LoadCell:
+            sampleRate: 80
+    """
+
+    allSensorSettings = settingsDict.get('sensorSettings') or {}
+    return allSensorSettings.get(sensor.__class__.__name__) or {}
+
+def sensorRates(settingsDict, sensors):
+    """Rate in Hz that each sensor is read at. A sampleRate in the sensor's sensorSettings wins, then the
+    global sampleRate, and if both are null the sensor is read at its own maxReadFrequency."""
+
+    rates = []
+    for sensor in sensors:
+        rate = sensorSettings(settingsDict, sensor).get('sampleRate', settingsDict.get('sampleRate'))
+        if rate == None:
+            rate = sensor.maxReadFrequency
+
+        if not isinstance(rate, (float, int)) or rate <= 0:
+            print(f"ERROR: Bad sampleRate value for {sensor.name} in config.yaml, must be a positive int or float. Using {sensor.maxReadFrequency} Hz.")
+            rate = sensor.maxReadFrequency
+
+        rates += [rate]
+
+    return rates
@@ -0,0 +1,126 @@
+"""Watches the live sample stream of a pull tester (see src/streamServer.py) from another terminal or computer.
+
+Usage, from the PullTester directory:
+    python -m src.streamClient --tcp pulltester.local:5555            # Latest values of each sensor
+    python -m src.streamClient --unix /tmp/pulltester.sock --plot     # Terminal plot like the GUI's
+    python -m src.streamClient --tcp 192.0.2.2:5555 --csv pulls.csv   # Log every sample to a csv file
+"""
+import sys
+import csv
+import json
+import time
+import socket
+import struct
+import argparse
+import numpy as np
+
+def receiveExactly(connection, size):
+    data = b""
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("The pull tester closed the connection")
+        data += chunk
+    return data
+
+def frames(connection):
+    """Yield (kind, payload) for every frame from the server"""
+
+    while True:
+        length, kind = struct.unpack("<IB", receiveExactly(connection, 5))
+        yield chr(kind), receiveExactly(connection, length - 1)
+
+def decodeRows(payload):
+    """Index of the first row in the run and the 2D array of rows of a sample frame"""
+
+    startRow, nColumns = struct.unpack("<QI", payload[:12])
+    return startRow, np.frombuffer(payload[12:], dtype="<f8").reshape(-1, nColumns)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Watch the live sample stream of a pull tester")
+    where = parser.add_mutually_exclusive_group(required=True)
+    where.add_argument('--tcp', help="host:port of the pull tester's stream")
+    where.add_argument('--unix', help="Unix socket path of the pull tester's stream")
+    parser.add_argument('--csv', default=None, help="Append every sample to this csv file")
+    parser.add_argument('--plot', action='store_true', help="Plot the latest samples in the terminal")
+    parser.add_argument('--points', type=int, default=125, help="Samples shown in the plot")
+    args = parser.parse_args(argv)
+
+    if args.tcp != None:
+        host, port = args.tcp.rsplit(":", 1)
+        connection = socket.create_connection((host, int(port)))
+    else:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(args.unix)
+
+    logFile = open(args.csv, 'a', newline='') if args.csv != None else None
+    logWriter = csv.writer(logFile) if logFile != None else None
+
+    columns = None
+    window = None
+    nextRow = 0
+    lastDraw = 0
+
+    try:
+        for kind, payload in frames(connection):
+            if kind == 'S':
+                header = json.loads(payload.decode('utf-8'))
+                columns = header['columns']
+                window = None
+                nextRow = 0
+                print(f"Run {header['run']} started: {', '.join(columns[1:])}")
+                if logWriter != None:
+                    logWriter.writerow(["Run"] + columns)
+
+            elif kind == 'D':
+                startRow, rows = decodeRows(payload)
+                if startRow > nextRow:
+                    print(f"Dropped {startRow - nextRow} samples, this client is not keeping up")
+                nextRow = startRow + len(rows)
+
+                if logWriter != None:
+                    logWriter.writerows([[header['run']] + row for row in rows.tolist()])
+
+                window = rows if window is None else np.concatenate((window, rows))[-args.points:]
+                if time.monotonic() - lastDraw >= 0.2:
+                    draw(window, columns, args.plot)
+                    lastDraw = time.monotonic()
+
+            elif kind == 'E':
+                summary = json.loads(payload.decode('utf-8'))
+                if window is not None:
+                    draw(window, columns, args.plot)
+                print(f"Run stopped after {summary.get('duration', 0):.2f} s")
+                if logFile != None:
+                    logFile.flush()
+                for channel in summary.get('channels', []):
+                    print(f"    {channel['name']}: peak {channel['max']} at {channel['timeOfMax']} s, break at {channel['breakTime']} s")
+
+    except (ConnectionError, KeyboardInterrupt) as error:
+        print(error)
+    finally:
+        connection.close()
+        if logFile != None:
+            logFile.close()
+
+def draw(window, columns, plot):
+    """Print the latest value of each sensor, or plot the window"""
+
+    # Forward fill sensors that were not read in every row, like the GUI's sample and hold
+    values = window[:, 1:].copy()
+    for column in range(values.shape[1]):
+        valid = np.nonzero(~np.isnan(values[:, column]))[0]
+        if len(valid) > 0:
+            values[:, column] = values[valid[np.maximum(np.searchsorted(valid, np.arange(len(values)), side='right') - 1, 0)], column]
+
+    if plot:
+        import asciichartpy as acp
+        series = [[value for value in column if value == value] or [0] for column in values.T.tolist()]
+        sys.stdout.write("\033[H\033[J" + acp.plot(series, {'height': 20}) + "\n")
+
+    latest = "   ".join([f"{name}: {value:.3f}" for name, value in zip(columns[1:], values[-1])])
+    sys.stdout.write(f"{window[-1, 0]:8.2f} s   {latest}\n")
+    sys.stdout.flush()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,301 @@
+"""Live stream of the samples of each run over TCP and a Unix socket, for watching a pull from another computer
+(see src/streamClient.py). Options are set in config.yaml:
+
+    stream:
+      tcp: 0.0.0.0:5555            # host:port to listen on, leave out to disable
+      unix: /tmp/pulltester.sock   # Unix socket path, leave out to disable
+      clientBuffer: 256            # Frames kept per client before the oldest samples are dropped
+
+Every message is a frame: a little endian uint32 length of the rest of the frame, one byte with the frame kind,
+and the payload.
+    b'S'    Run started, utf-8 json with 'run', 'columns', 'sampleRates' and 'convert'. Clients that connect
+            during a run receive the latest one first.
+    b'D'    Samples, uint64 index of the first row in the run, uint32 number of columns, then the rows as little
+            endian float64 (time first, in units when convert is true, NaN where a sensor was not read)
+    b'E'    Run stopped, utf-8 json with the run's summary (see src.runStats)
+
+Sending happens on a background thread with non-blocking sockets. Each client has its own bounded buffer, when
+a client can't keep up its oldest sample frames are dropped (and counted), so a slow client never holds up the
+main loop or the other clients. A client whose buffer is full of start and stop frames alone isn't reading at
+all and is disconnected.
+"""
+import os
+import json
+import stat
+import socket
+import struct
+import selectors
+import threading
+
+from collections import deque
+
+def encodeFrame(kind, payload):
+    return struct.pack("<IB", len(payload) + 1, ord(kind)) + payload
+
+class streamClientState:
+    """Frames waiting to be sent to one client"""
+
+    def __init__(self, connection, address):
+        self.connection = connection
+        self.address = address
+        self.frames = deque()
+        self.sending = None # memoryview of the rest of the frame being sent
+        self.dropped = 0
+        self.overflowed = False # Its buffer filled up with frames that can't be dropped, it gets disconnected
+
+def removeStaleSocket(path):
+    """Remove a Unix socket left behind by a server that is gone. Anything else at path, or a socket a server
+    is still accepting connections on, raises OSError."""
+
+    if not stat.S_ISSOCK(os.lstat(path).st_mode):
+        raise OSError(f"{path} exists and is not a socket")
+
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except ConnectionRefusedError: # Nobody is listening on it
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+
+    raise OSError(f"{path} is in use by another stream server")
+
+class streamServer:
+    """Serves the sample stream to any number of clients.
+    Input:
+        tcp:
+            'host:port' to listen on, or None
+        unix:
+            Path of a Unix socket to listen on, or None
+        clientBuffer:
+            Frames kept per client, beyond that the oldest sample frames are dropped (or the client is
+            disconnected when there are none)"""
+
+    def __init__(self, tcp=None, unix=None, clientBuffer=256):
+        if unix != None and os.path.lexists(unix): # Checked before any socket is opened
+            removeStaleSocket(unix)
+
+        self.clientBuffer = clientBuffer
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        self.clients = {} # Socket -> streamClientState
+        self.startFrame = None # Frame of the run in progress, sent first to clients that connect during it
+        self.listeners = []
+        self.unix = None # Socket path to remove when the server is closed
+        self.closing = False
+        self.dropped = 0 # Sample frames dropped for slow clients, including clients that have left
+        self.disconnects = 0
+
+        # Written to by publishing threads to wake up the sending thread
+        self.wakeReader, self.wakeWriter = socket.socketpair()
+        self.wakeReader.setblocking(False)
+        self.wakeWriter.setblocking(False)
+        self.selector.register(self.wakeReader, selectors.EVENT_READ, 'wake')
+
+        if tcp != None:
+            host, port = str(tcp).rsplit(":", 1)
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.listen(listener, (host, int(port)))
+
+        if unix != None:
+            self.listen(socket.socket(socket.AF_UNIX, socket.SOCK_STREAM), unix)
+            self.unix = unix
+
+        self.thread = threading.Thread(target=self.serveLoop, daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def fromSettings(cls, settingsDict):
+        """Server for the stream section of config.yaml, or None when it is missing or listens nowhere"""
+
+        options = settingsDict.get('stream') or {}
+        if options.get('tcp') == None and options.get('unix') == None:
+            return None
+
+        try:
+            return cls(options.get('tcp'), options.get('unix'), options.get('clientBuffer', 256))
+        except (OSError, ValueError) as error:
+            print(f"ERROR: Couldn't start the stream server: {error}")
+            return None
+
+    def close(self):
+        """Stop serving, disconnect every client and remove the Unix socket"""
+
+        self.closing = True
+        try:
+            self.wakeWriter.send(b"\0")
+        except BlockingIOError:
+            pass
+        self.thread.join(1)
+
+        with self.lock:
+            connections = list(self.clients)
+            self.clients = {}
+        for sock in self.listeners + connections + [self.wakeReader, self.wakeWriter]:
+            sock.close()
+        self.selector.close()
+
+        if self.unix != None:
+            try:
+                os.unlink(self.unix)
+            except FileNotFoundError:
+                pass
+
+    def listen(self, listener, address):
+        listener.bind(address)
+        listener.listen()
+        listener.setblocking(False)
+        self.selector.register(listener, selectors.EVENT_READ, 'listener')
+        self.listeners += [listener]
+
+    ### Called by the main loop ###
+    def startRun(self, runNumber, columnNames, sampleRates, convert):
+        frame = encodeFrame('S', json.dumps({'run': runNumber, 'columns': columnNames, 'sampleRates': sampleRates,
+                                             'convert': convert}).encode('utf-8'))
+        with self.lock:
+            self.startFrame = frame
+        self.publish(frame)
+
+    def publishRows(self, startRow, rows):
+        """Queue a 2D block of rows for every client, the block is encoded once"""
+
+        payload = struct.pack("<QI", startRow, rows.shape[1]) + rows.astype("<f8", copy=False).tobytes()
+        self.publish(encodeFrame('D', payload))
+
+    def stopRun(self, summary):
+        with self.lock:
+            self.startFrame = None
+        self.publish(encodeFrame('E', json.dumps(summary).encode('utf-8')))
+
+    def publish(self, frame):
+        with self.lock:
+            if len(self.clients) == 0:
+                return
+
+            for client in self.clients.values():
+                if len(client.frames) >= self.clientBuffer and not self.dropOldest(client):
+                    client.frames.clear()
+                    client.overflowed = True
+                if not client.overflowed:
+                    client.frames.append(frame)
+
+        try:
+            self.wakeWriter.send(b"\0")
+        except BlockingIOError: # Already has plenty of wake ups waiting
+            pass
+
+    def dropOldest(self, client):
+        """Drop the oldest sample frame, start and stop frames are kept. Returns False when there was none."""
+
+        for index, frame in enumerate(client.frames):
+            if frame[4:5] == b'D':
+                del client.frames[index]
+                client.dropped += 1
+                self.dropped += 1
+                return True
+
+        return False
+
+    def stats(self):
+        """Connected clients and how many frames each one has dropped"""
+
+        with self.lock:
+            return [{'client': str(client.address), 'waiting': len(client.frames), 'dropped': client.dropped}
+                    for client in self.clients.values()]
+
+    def snapshot(self):
+        """Counters in the format of src.metrics.metricSet.snapshot(), for the GUI status line and metrics files"""
+
+        with self.lock:
+            return {'counters': {'clients': len(self.clients), 'droppedFrames': self.dropped, 'disconnects': self.disconnects},
+                    'clients': [{'client': str(client.address), 'waiting': len(client.frames), 'dropped': client.dropped}
+                                for client in self.clients.values()]}
+
+    ### Sending thread ###
+    def serveLoop(self):
+        while not self.closing:
+            for key, events in self.selector.select():
+                if key.data == 'wake':
+                    try:
+                        while self.wakeReader.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+
+                elif key.data == 'listener':
+                    self.accept(key.fileobj)
+
+                elif events & selectors.EVENT_READ:
+                    self.receive(key.fileobj)
+
+            with self.lock:
+                clients = list(self.clients.values())
+            for client in clients:
+                self.send(client)
+
+    def accept(self, listener):
+        try:
+            connection, address = listener.accept()
+        except BlockingIOError:
+            return
+
+        connection.setblocking(False)
+        client = streamClientState(connection, address or "unix")
+        with self.lock:
+            if self.startFrame != None:
+                client.frames.append(self.startFrame)
+            self.clients[connection] = client
+        self.selector.register(connection, selectors.EVENT_READ, 'client')
+
+    def receive(self, connection):
+        """Clients don't send anything, reading only notices when they disconnect"""
+
+        try:
+            if connection.recv(4096):
+                return
+        except BlockingIOError:
+            return
+        except OSError:
+            pass
+
+        self.disconnect(connection)
+
+    def disconnect(self, connection):
+        with self.lock:
+            if self.clients.pop(connection, None) != None:
+                self.disconnects += 1
+        self.selector.unregister(connection)
+        connection.close()
+
+    def send(self, client):
+        """Send as much as the client's socket takes without blocking"""
+
+        if client.overflowed:
+            self.disconnect(client.connection)
+            return
+
+        while True:
+            if client.sending == None:
+                with self.lock:
+                    if len(client.frames) == 0:
+                        break
+                    client.sending = memoryview(client.frames.popleft())
+
+            try:
+                sent = client.connection.send(client.sending)
+            except BlockingIOError:
+                break
+            except OSError: # Disconnected
+                self.disconnect(client.connection)
+                return
+
+            client.sending = client.sending[sent:]
+            if len(client.sending) == 0:
+                client.sending = None
+
+        # Wake up when the socket can take more
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if client.sending != None or len(client.frames) > 0 else 0)
+        if self.selector.get_key(client.connection).events != events:
+            self.selector.modify(client.connection, events, 'client')
@@ -0,0 +1,225 @@
+"""Triggered capture, only the part of a run around each pull is kept instead of everything between two
+button presses. Options are set in config.yaml:
+
+    capture: triggered
+    trigger:
+      channel: 0          # Index of the sensor in selectedSensors that is watched
+      condition: above    # above, slope or drop
+      threshold: 5        # Value (or value per second for slope) that fires the trigger
+      dropFraction: 0.5   # For drop, how far below the peak the value has to fall
+      preTrigger: 2       # Seconds kept before the trigger
+      postTrigger: 3      # Seconds kept after the trigger
+
+Conditions are checked on the filtered value of the channel, in units when convert is true (raw otherwise). The
+data collector stores raw values, so with a linear calibration the above and slope thresholds are converted to
+raw units once when the trigger is set up, and each row is only a scalar comparison:
+    above       The value is at or above threshold
+    slope       The value rises at threshold per second or faster
+    drop        The value falls to dropFraction below its peak, after the peak reached threshold (a break)
+
+While armed the rows go into a pre-trigger buffer of preTrigger seconds instead of being passed on, so memory
+use is bounded however long the tester waits. When the trigger fires the buffer is passed on, followed by every
+row until postTrigger seconds after the condition last held. The capture then ends and the trigger is armed
+again, so every pull of a run is captured.
+"""
+import numpy as np
+
+from src.calibration import calibration, calibrationSpec
+
+class triggerCondition:
+    """Checks one channel's values against the trigger condition.
+    Input:
+        options:
+            The trigger section of config.yaml
+        channelCalibration:
+            src.calibration.calibration of the channel, None to check raw values"""
+
+    conditions = ['above', 'slope', 'drop']
+
+    def __init__(self, options, channelCalibration=None):
+        self.condition = options.get('condition', 'above')
+        self.threshold = float(options.get('threshold', 0))
+        self.dropFraction = float(options.get('dropFraction', 0.5))
+        self.channelCalibration = channelCalibration
+
+        if self.condition not in triggerCondition.conditions:
+            print(f"ERROR: Unknown trigger condition '{self.condition}' in config.yaml, options are {triggerCondition.conditions}. Using 'above'.")
+            self.condition = 'above'
+
+        # Raw threshold to compare against, the sign flips the comparison for calibrations with a negative slope
+        self.sign = 1.0
+        self.rawThreshold = None
+        self.toUnits = self.scalarConversion(channelCalibration)
+        if self.toUnits == None:
+            self.rawThreshold = self.threshold
+        elif channelCalibration.spec != None and channelCalibration.kind == 'linear' and channelCalibration.coefficients[1] != 0:
+            b, m = [float(coefficient) for coefficient in channelCalibration.coefficients]
+            self.sign = 1.0 if m > 0 else -1.0
+            if self.condition == 'above':
+                self.rawThreshold = self.sign * (self.threshold - b) / m
+            elif self.condition == 'slope':
+                self.rawThreshold = self.threshold / abs(m)
+
+        self.reset()
+
+    @staticmethod
+    def scalarConversion(channelCalibration):
+        """Function converting one raw float to units without numpy, None when values are compared raw"""
+
+        if channelCalibration == None or (channelCalibration.spec == None and channelCalibration.function == None):
+            return None
+        if channelCalibration.spec == None:
+            return channelCalibration.function
+
+        if channelCalibration.kind in ('linear', 'polynomial'):
+            coefficients = [float(coefficient) for coefficient in channelCalibration.coefficients][::-1]
+            def polynomial(value):
+                result = 0.0
+                for coefficient in coefficients: # Horner's method
+                    result = result * value + coefficient
+                return result
+            return polynomial
+
+        return lambda value: float(channelCalibration.apply([value])[0]) # Tables are rare enough to use numpy
+
+    def reset(self):
+        self.lastTime = None
+        self.lastValue = None
+        self.peak = None
+
+    def check(self, time, value):
+        """True if the condition holds for the value read at time (seconds)"""
+
+        if self.rawThreshold != None:
+            if self.condition == 'above':
+                return self.sign * value >= self.rawThreshold
+
+            if self.condition == 'slope':
+                fired = self.lastTime != None and time > self.lastTime and self.sign * (value - self.lastValue) / (time - self.lastTime) >= self.rawThreshold
+                self.lastTime, self.lastValue = time, value
+                return fired
+
+        if self.toUnits != None:
+            value = self.toUnits(value)
+
+        if self.condition == 'above':
+            return value >= self.threshold
+
+        if self.condition == 'slope':
+            fired = self.lastTime != None and time > self.lastTime and (value - self.lastValue) / (time - self.lastTime) >= self.threshold
+            self.lastTime, self.lastValue = time, value
+            return fired
+
+        # drop
+        if self.peak == None or value > self.peak:
+            self.peak = value
+        if self.peak >= self.threshold and value <= self.peak * (1 - self.dropFraction):
+            self.peak = None # Wait for the next pull
+            return True
+        return False
+
+class triggeredCapture:
+    """Holds rows back until the trigger fires, see the top of this module.
+    Input:
+        options:
+            The trigger section of config.yaml
+        nColumns:
+            Columns per row, including time
+        rate:
+            Highest rate rows are produced at in Hz, sizes the pre-trigger buffer
+        channelCalibration:
+            src.calibration.calibration of the watched channel, None to check raw values"""
+
+    def __init__(self, options, nColumns, rate, channelCalibration=None):
+        self.channel = int(options.get('channel', 0))
+        self.preTrigger = float(options.get('preTrigger', 2))
+        self.postTrigger = float(options.get('postTrigger', 3))
+        self.condition = triggerCondition(options, channelCalibration)
+
+        if not 0 <= self.channel < nColumns - 1:
+            print(f"ERROR: Trigger channel {self.channel} in config.yaml is not one of the {nColumns - 1} selected sensors. Using 0.")
+            self.channel = 0
+
+        # Preallocated, the memory used while armed does not grow
+        self.buffer = np.empty((max(1, int(np.ceil(self.preTrigger * rate)) + 1), nColumns), dtype=np.float64)
+        self.rowBlock = np.empty((1, nColumns), dtype=np.float64) # Holds the row passed on while capturing
+        self.reset()
+
+    @classmethod
+    def fromSettings(cls, settingsDict, sensors, rate):
+        """Capture for the settings in config.yaml, or None when capture is continuous"""
+
+        if settingsDict.get('capture', 'continuous') != 'triggered':
+            return None
+
+        options = settingsDict.get('trigger') or {}
+        channelCalibration = None
+        channel = int(options.get('channel', 0))
+        if settingsDict.get('convert', False) == True and 0 <= channel < len(sensors):
+            channelCalibration = calibration(calibrationSpec(settingsDict, sensors[channel]), sensors[channel].convert)
+
+        return cls(options, len(sensors) + 1, rate, channelCalibration)
+
+    def reset(self):
+        """Arm the trigger and empty the pre-trigger buffer, called when a run starts"""
+
+        self.condition.reset()
+        self.buffered = 0 # Rows in the pre-trigger buffer, the newest is at self.next - 1
+        self.next = 0
+        self.captureEnd = None # Time the current capture ends, None while armed
+        self.capture = None
+        self.captures = [] # Every finished capture of the run
+        self.lastTime = None
+
+    def process(self, row):
+        """Returns the rows to pass on for a new row, a 2D array that is empty while armed.
+        self.started and self.finished are set to the capture that started or ended with this row, otherwise None."""
+
+        time = row[0]
+        value = row[self.channel + 1]
+        fired = value == value and self.condition.check(time, value) # NaN rows did not read the channel
+        self.started = None
+        self.finished = None
+        self.lastTime = time
+
+        if self.captureEnd != None: # Capturing
+            if fired:
+                self.captureEnd = time + self.postTrigger
+            self.capture['rows'] += 1
+            self.rowBlock[0] = row
+            block = self.rowBlock # Reused, the caller writes it out before the next row
+
+            if time >= self.captureEnd:
+                self.capture['end'] = time
+                self.finished = self.capture
+                self.captures += [self.capture]
+                self.captureEnd = None
+                self.capture = None
+
+            return block
+
+        # Armed, keep only the last preTrigger seconds
+        self.buffer[self.next] = row
+        self.next = (self.next + 1) % len(self.buffer)
+        self.buffered = min(self.buffered + 1, len(self.buffer))
+        if not fired:
+            return self.buffer[:0]
+
+        block = np.roll(self.buffer, -self.next, axis=0)[len(self.buffer) - self.buffered:]
+        block = block[block[:, 0] >= time - self.preTrigger]
+        self.buffered = 0
+        self.captureEnd = time + self.postTrigger
+        self.capture = {'start': float(block[0, 0]), 'trigger': float(time), 'end': None, 'rows': len(block)}
+        self.started = dict(self.capture)
+        return block
+
+    def stop(self):
+        """End the capture in progress when the run stops. Returns it, or None while armed."""
+
+        if self.capture == None:
+            return None
+
+        self.capture['end'] = self.lastTime
+        self.captures += [self.capture]
+        finished, self.capture, self.captureEnd = self.capture, None, None
+        return finished
@@ -0,0 +1,57 @@
+import time
+import queue
+import threading
+import numpy as np
+import pytest
+
+from multiprocessing import Pipe
+from src.acquisition import timeOrder
+from src.dataCollector import dataCollector
+from src.sensorRegistry import createSensors
+
+def collectRun(settingsDict, sensorNames, seconds=1.5):
+    """Rows and timing statistics of a run of the data collector, run in a thread instead of a process"""
+
+    sensors = createSensors(sensorNames, settingsDict)
+    rows = queue.Queue()
+    commandPipe, collectorPipe = Pipe()
+    collector = dataCollector(sensors, rows, collectorPipe, settingsDict)
+    thread = threading.Thread(target=collector.mainLoop, daemon=True)
+    thread.start()
+
+    commandPipe.send("read")
+    time.sleep(seconds)
+    commandPipe.send("stop")
+    reply, timing = commandPipe.recv()
+    while reply != "timing":
+        reply, timing = commandPipe.recv()
+    commandPipe.send("off")
+    thread.join(5)
+
+    return np.array([rows.get() for _ in range(rows.qsize())]), timing
+
+@pytest.mark.parametrize('acquisition', ['sequential', 'parallel'])
+def test_block_sample_times_with_read_sensor(acquisition):
+    settingsDict = {'sampleRate': 20, 'acquisition': acquisition, 'sensorSettings': {'sinSensor': {'blockSize': 4}}}
+    rows, timing = collectRun(settingsDict, ['sinSensor', 'cosSensor'])
+
+    blockTimes = rows[~np.isnan(rows[:, 1]), 0]
+    readTimes = rows[~np.isnan(rows[:, 2]), 0]
+    assert [sensor.get('blockSize') for sensor in timing['sensors']] == [4, None]
+    assert len(blockTimes) >= 24 and len(readTimes) >= 24
+    assert (np.diff(blockTimes) > 0).all() # Every block sample keeps its own time
+    assert (np.diff(rows[:, 0]) >= 0).all() # Rows are written in time order
+    assert blockTimes[0] == 0.0 # The first block starts with the run, no samples are lost
+    assert np.allclose(np.diff(blockTimes[:4]), 0.05)
+
+def test_time_order_holds_rows_until_watermark():
+    order = timeOrder(2)
+    order.add([[0.0, 1.0], [0.1, 1.0], [0.2, 1.0]])
+    order.add([[0.05, 2.0]])
+
+    assert order.release(0.1)[:, 0].tolist() == [0.0, 0.05]
+    order.add([[0.15, 2.0]])
+    assert order.flush()[:, 0].tolist() == [0.1, 0.15, 0.2]
+
+    order.add([[0.1, 3.0]]) # Behind rows already released
+    assert order.late == 1 and len(order.flush()) == 0
@@ -0,0 +1,39 @@
+import os
+import queue
+import numpy as np
+
+from src.exporter import exportWorker
+from src.runFormat import binaryRunFile
+
+class brokenConverter:
+    def convert(self, block):
+        raise KeyError('calibration')
+
+def writeRun(path, rows):
+    run = binaryRunFile(path, ["Time (seconds)", "a"])
+    run.write(rows)
+    run.close()
+    return path
+
+def test_failed_export_keeps_the_worker_running(tmp_path):
+    rows = np.column_stack([np.arange(10) / 80, np.arange(10)])
+    first = writeRun(str(tmp_path / "Run1_10_30_AM.ptrun"), rows)
+    second = writeRun(str(tmp_path / "Run2_10_31_AM.ptrun"), rows)
+
+    statuses = queue.Queue()
+    worker = exportWorker(statuses.put)
+    worker.submit(first, converter=brokenConverter())
+    worker.submit(second)
+
+    finished = {}
+    while len(finished) < 2:
+        status = statuses.get(timeout=5)
+        if status['state'] in ('done', 'failed'):
+            finished[status['run']] = status
+
+    assert finished["Run1_10_30_AM.ptrun"]['state'] == 'failed'
+    assert 'calibration' in finished["Run1_10_30_AM.ptrun"]['error']
+    assert not os.path.exists(str(tmp_path / "Run1_10_30_AM.csv.partial"))
+    assert not os.path.exists(str(tmp_path / "Run1_10_30_AM.csv"))
+    assert finished["Run2_10_31_AM.ptrun"]['state'] == 'done'
+    assert os.path.exists(finished["Run2_10_31_AM.ptrun"]['path'])
@@ -0,0 +1,23 @@
+import csv
+import numpy as np
+
+from src.postProcess import processRun
+from src.runFormat import binaryRunFile, DTYPE
+
+def test_decimated_rows_of_a_binary_run_are_not_held(tmp_path):
+    header = {'columns': ["Time (seconds)", "sin"], 'alignment': 'hold', 'sensorTypes': ['sinSensor'],
+              'calibration': [None], 'convert': False, 'dtype': DTYPE.str}
+    path = str(tmp_path / "07-09-2024" / "Run1_10_30_AM.ptrun")
+    (tmp_path / "07-09-2024").mkdir()
+    run = binaryRunFile(path, header['columns'], header)
+    run.write(np.column_stack([np.arange(40) / 80, np.arange(40, dtype=np.float64)]))
+    run.close()
+
+    settingsDict = {'sensorSettings': {'sinSensor': {'filters': [{'type': 'decimate', 'factor': 4}]}}}
+    _, csvPath, summary = processRun(path, str(tmp_path / "Processed"), settingsDict, blockRows=7)
+
+    with open(csvPath, newline='') as f:
+        rows = list(csv.reader(f))[1:]
+    values = [float(row[1]) for row in rows]
+    assert len(rows) == 10 and summary['rows'] == 10
+    assert values == [1.5 + 4 * index for index in range(10)] # One mean per 4 readings, none repeated
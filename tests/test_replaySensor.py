@@ -0,0 +1,18 @@
+import math
+import pytest
+
+from src.sensorRegistry import createSensors
+
+@pytest.mark.parametrize('options', [{'file': "missing/Run1_10_30_AM.ptrun"}, {'file': "missing/Run1_10_30_AM.csv"},
+                                     {'file': "Run1.csv", 'column': "unknown"}])
+def test_bad_replay_settings_read_nan(tmp_path, options, capsys):
+    with open(tmp_path / "Run1.csv", 'w') as f:
+        f.write("Time (seconds),a\n0.0,1\n0.0125,2\n")
+    options = dict(options, file=str(tmp_path / options['file']))
+
+    sensors = createSensors(['replaySensor'], {'sensorSettings': {'replaySensor': options}})
+    sensors[0].initInProcess()
+
+    assert "ERROR" in capsys.readouterr().out
+    assert math.isnan(sensors[0].read())
+    sensors[0].reset()
@@ -0,0 +1,58 @@
+import os
+import time
+import socket
+import numpy as np
+import pytest
+
+from src.streamServer import streamServer
+
+def waitFor(condition, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end
+        time.sleep(0.01)
+
+def test_client_that_never_reads_stays_bounded(tmp_path):
+    path = str(tmp_path / "stream.sock")
+    server = streamServer(unix=path, clientBuffer=4)
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(path)
+    waitFor(lambda: server.snapshot()['counters']['clients'] == 1)
+
+    rows = np.zeros((2000, 8))
+    for block in range(50): # Much more than the socket buffers hold
+        server.publishRows(block * len(rows), rows)
+        assert all([client['waiting'] <= 4 for client in server.stats()])
+        time.sleep(0.005)
+    assert server.snapshot()['counters']['droppedFrames'] > 0
+
+    for run in range(4): # Start and stop frames aren't dropped, the client is let go instead of queueing them
+        server.startRun(run, ["Time (seconds)", "a"], [80], False)
+        server.stopRun({})
+        assert all([client['waiting'] <= 4 for client in server.stats()])
+    waitFor(lambda: server.snapshot()['counters']['disconnects'] == 1)
+    assert server.snapshot()['counters']['clients'] == 0
+
+    client.close()
+    server.close()
+    assert not os.path.exists(path)
+
+def test_unix_socket_of_a_live_server_is_not_replaced(tmp_path):
+    path = str(tmp_path / "stream.sock")
+    server = streamServer(unix=path)
+    with pytest.raises(OSError):
+        streamServer(unix=path)
+    assert streamServer.fromSettings({'stream': {'unix': path}}) == None
+    server.close()
+
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) # Left behind by a server that crashed
+    stale.bind(path)
+    stale.close()
+    server = streamServer(unix=path)
+    server.close()
+
+    with open(path, 'w') as f: # Never removed
+        f.write("data")
+    with pytest.raises(OSError):
+        streamServer(unix=path)
+    assert os.path.exists(path)